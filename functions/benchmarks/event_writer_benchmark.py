@@ -0,0 +1,153 @@
+# functions/benchmarks/event_writer_benchmark.py
+"""
+Compares the EventWriter against the previous single-batch write path for runs of 10, 100 and 1,000 events.
+
+Firestore is replaced by a fake batch whose commit sleeps for a fixed round trip plus a per-write cost, so the
+numbers show how batching and concurrent commits scale rather than real Firestore latency. Run from `functions/`
+inside the functions virtualenv:
+
+    echo '{"type": "authorized_user", "client_id": "bench", "client_secret": "bench", "refresh_token": "bench"}' > /tmp/bench-adc.json
+    GOOGLE_APPLICATION_CREDENTIALS=/tmp/bench-adc.json GCLOUD_PROJECT=demo-bench FIRESTORE_EMULATOR_HOST=localhost:8080 \
+        python -m benchmarks.event_writer_benchmark
+
+`common.core` creates the Firestore client at import time, which needs Application Default Credentials and a project.
+The placeholder credentials and emulator variables only satisfy that; nothing is sent to Google or to an emulator, so
+neither needs to exist.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import threading
+import time
+
+from handlers.vertex.task import event_writer
+from handlers.vertex.task.event_writer import EventWriter, MAX_WRITES_PER_BATCH
+
+EVENT_COUNTS = (10, 100, 1000)
+
+
+class _FakeDocumentRef:
+    def __init__(self, path: str, db=None):
+        self.path, self._db = path, db
+
+    def update(self, fields):
+        batch = self._db.batch()
+        batch.update(self, fields)
+        batch.commit()
+
+
+class _FakeCollectionRef:
+    def __init__(self, path: str, db):
+        self.path, self._db = path, db
+        self.parent = _FakeDocumentRef(path.rsplit("/", 1)[0], db)
+
+    def document(self, doc_id: str | None = None):
+        return _FakeDocumentRef(f"{self.path}/{doc_id or 'auto'}", self._db)
+
+
+class _FakeBatch:
+    def __init__(self, db):
+        self._db, self._writes = db, 0
+
+    def set(self, doc_ref, document):
+        if self._writes >= MAX_WRITES_PER_BATCH:
+            raise ValueError(f"Batch exceeds {MAX_WRITES_PER_BATCH} writes.")
+        self._writes += 1
+
+    def update(self, doc_ref, fields):
+        self.set(doc_ref, fields)
+
+    def commit(self, retry=None):
+        time.sleep(self._db.commit_latency_seconds + self._writes * self._db.per_write_seconds)
+        with self._db.lock:
+            self._db.commits += 1
+            self._db.writes += self._writes
+
+
+class FakeFirestore:
+    """Stands in for `common.core.db`: counts commits and writes, and simulates commit latency."""
+
+    def __init__(self, commit_latency_seconds: float, per_write_seconds: float):
+        self.commit_latency_seconds, self.per_write_seconds = commit_latency_seconds, per_write_seconds
+        self.commits = self.writes = 0
+        self.lock = threading.Lock()
+
+    def batch(self):
+        return _FakeBatch(self)
+
+
+def make_events(count: int) -> list[dict]:
+    """Alternating model text, function call and function response events of a few hundred bytes each."""
+    events = []
+    for index in range(count):
+        if index % 3 == 0:
+            part = {"text": f"Step {index}: " + "reasoning about the next action. " * 8}
+        elif index % 3 == 1:
+            part = {"function_call": {"id": f"call-{index}", "name": "search", "args": {"query": f"topic {index}", "limit": 5}}}
+        else:
+            part = {"function_response": {"id": f"call-{index - 1}", "name": "search",
+                                          "response": {"results": [{"title": f"Result {n}", "score": n / 10} for n in range(5)]}}}
+        events.append({"id": f"event-{index}", "author": "agent", "invocation_id": "inv-1", "partial": False,
+                       "content": {"role": "model", "parts": [part]}, "actions": {"state_delta": {}}})
+    return events
+
+
+def run_legacy(events: list[dict], db: FakeFirestore) -> float:
+    """
+    The previous path: a JSON round trip per event, then one batch. That batch failed beyond 500 writes; here it is
+    split every 500 events, committed one after another, so 1,000-event runs can be compared at all.
+    """
+    started = time.perf_counter()
+    batch, in_batch = db.batch(), 0
+    for index, event_dict in enumerate(events):
+        sanitized = json.loads(json.dumps(event_dict, default=str))
+        if in_batch == MAX_WRITES_PER_BATCH:
+            batch.commit()
+            batch, in_batch = db.batch(), 0
+        batch.set(None, {**sanitized, "eventIndex": index})
+        in_batch += 1
+    batch.commit()
+    return time.perf_counter() - started
+
+
+async def run_event_writer(events: list[dict], db: FakeFirestore) -> float:
+    """The current path, fed the way `_run_agent_and_collect_events` feeds it."""
+    started = time.perf_counter()
+    writer = EventWriter(_FakeCollectionRef("chats/bench/messages/bench/events", db))
+    for event_dict in events:
+        writer.add(event_dict)
+        writer.flush_in_background_if_due()
+        await asyncio.sleep(0)  # The `async for` over the agent's events yields to the loop between events.
+    errors = await writer.close()
+    if errors:
+        raise RuntimeError(errors)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--commit-latency-ms", type=float, default=40.0)
+    parser.add_argument("--per-write-us", type=float, default=50.0)
+    args = parser.parse_args()
+
+    # The SDK imports leave a large heap behind; without this, whichever run first crosses the threshold for a full
+    # collection pays several hundred milliseconds for it.
+    gc.collect()
+    gc.freeze()
+
+    print(f"{'events':>7} | {'legacy ms':>9} | {'writer ms':>9} | {'writer commits':>14} | {'writer events/s':>15}")
+    for count in EVENT_COUNTS:
+        events = make_events(count)
+        legacy_db = FakeFirestore(args.commit_latency_ms / 1000, args.per_write_us / 1e6)
+        legacy_seconds = run_legacy(events, legacy_db)
+
+        writer_db = FakeFirestore(args.commit_latency_ms / 1000, args.per_write_us / 1e6)
+        event_writer.db = writer_db
+        writer_seconds = asyncio.run(run_event_writer(events, writer_db))
+        print(f"{count:>7} | {legacy_seconds * 1000:>9.1f} | {writer_seconds * 1000:>9.1f} | "
+              f"{writer_db.commits:>14} | {count / writer_seconds:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
 # functions/common/adk_helpers.py
+import copy
+import os
 import re
+import threading
+import time
+from collections import OrderedDict
 from .core import logger, db
 from google.adk.artifacts import GcsArtifactService
+from vertexai import agent_engines
 from .config import get_gcp_project_config
 
 
@@ -43,26 +49,169 @@ async def get_model_config_from_firestore(model_id: str) -> dict:
         raise ValueError(f"Could not fetch model configuration for ID '{model_id}'.")
 
 
-async def get_adk_artifact_service() -> GcsArtifactService:
+# --- Artifacts ---
+# Artifact versions are immutable once written, so loaded parts can be kept per instance without invalidation.
+# The cache is bounded by payload bytes; parts larger than a quarter of the budget are always read from GCS.
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get("ARTIFACT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+_artifact_cache: "OrderedDict[tuple, tuple[int, object]]" = OrderedDict()
+_artifact_cache_bytes = 0
+_artifact_cache_lock = threading.Lock()
+
+
+def _artifact_part_size(part) -> int:
+    if getattr(part, "inline_data", None) is not None and part.inline_data.data:
+        return len(part.inline_data.data)
+    return len(getattr(part, "text", None) or "")
+
+
+def _cache_artifact(key: tuple, part):
+    global _artifact_cache_bytes
+    size = _artifact_part_size(part)
+    if size > ARTIFACT_CACHE_MAX_BYTES // 4:
+        return
+    with _artifact_cache_lock:
+        if key in _artifact_cache:
+            return
+        _artifact_cache[key] = (size, part)
+        _artifact_cache_bytes += size
+        while _artifact_cache_bytes > ARTIFACT_CACHE_MAX_BYTES and _artifact_cache:
+            _, (evicted_size, _) = _artifact_cache.popitem(last=False)
+            _artifact_cache_bytes -= evicted_size
+
+
+def _cached_artifact(key: tuple):
+    with _artifact_cache_lock:
+        cached = _artifact_cache.get(key)
+        if cached is None:
+            return None
+        _artifact_cache.move_to_end(key)
+        return cached[1]
+
+
+class CachedGcsArtifactService(GcsArtifactService):
+    """
+    GCS artifact service with a per-instance read-through cache. Nothing is downloaded until a tool or the UI
+    loads an artifact; runs only record `{filename: version}` in their events' `actions.artifact_delta`.
+
+    A view created with `scoped(scope_id)` stores artifacts under `scope_id` instead of the ADK session ID. Chat
+    runs scope by chat, because every turn is its own ADK session segment but should see earlier artifacts.
+    """
+
+    def __init__(self, bucket_name: str, **kwargs):
+        super().__init__(bucket_name=bucket_name, **kwargs)
+        self._scope_id = None
+
+    def scoped(self, scope_id: str) -> "CachedGcsArtifactService":
+        view = copy.copy(self)  # Shares the storage client and bucket handle.
+        view._scope_id = scope_id
+        return view
+
+    def _cache_key(self, app_name: str, user_id: str, session_id: str, filename: str, version: int) -> tuple:
+        return (self.bucket.name, app_name, user_id, session_id, filename, version)
+
+    async def save_artifact(self, *, app_name: str, user_id: str, session_id: str, filename: str, artifact, **kwargs) -> int:
+        session_id = self._scope_id or session_id
+        version = await super().save_artifact(app_name=app_name, user_id=user_id, session_id=session_id,
+                                              filename=filename, artifact=artifact, **kwargs)
+        _cache_artifact(self._cache_key(app_name, user_id, session_id, filename, version), artifact)
+        return version
+
+    async def load_artifact(self, *, app_name: str, user_id: str, session_id: str, filename: str, version: int | None = None, **kwargs):
+        session_id = self._scope_id or session_id
+        if version is None:
+            # Resolving "latest" only lists object names; the payload itself may already be cached.
+            versions = await super().list_versions(app_name=app_name, user_id=user_id, session_id=session_id, filename=filename)
+            if not versions:
+                return None
+            version = max(versions)
+        key = self._cache_key(app_name, user_id, session_id, filename, version)
+        part = _cached_artifact(key)
+        if part is None:
+            part = await super().load_artifact(app_name=app_name, user_id=user_id, session_id=session_id,
+                                               filename=filename, version=version, **kwargs)
+            if part is not None:
+                _cache_artifact(key, part)
+        return part
+
+    async def list_artifact_keys(self, *, app_name: str, user_id: str, session_id: str, **kwargs) -> list[str]:
+        return await super().list_artifact_keys(app_name=app_name, user_id=user_id, session_id=self._scope_id or session_id, **kwargs)
+
+    async def list_versions(self, *, app_name: str, user_id: str, session_id: str, filename: str, **kwargs) -> list[int]:
+        return await super().list_versions(app_name=app_name, user_id=user_id, session_id=self._scope_id or session_id,
+                                           filename=filename, **kwargs)
+
+    async def delete_artifact(self, *, app_name: str, user_id: str, session_id: str, filename: str, **kwargs) -> None:
+        global _artifact_cache_bytes
+        session_id = self._scope_id or session_id
+        await super().delete_artifact(app_name=app_name, user_id=user_id, session_id=session_id, filename=filename, **kwargs)
+        prefix = (self.bucket.name, app_name, user_id, session_id, filename)
+        with _artifact_cache_lock:
+            for key in [key for key in _artifact_cache if key[:5] == prefix]:
+                _artifact_cache_bytes -= _artifact_cache.pop(key)[0]
+
+
+_artifact_service: CachedGcsArtifactService | None = None
+_artifact_service_lock = threading.Lock()
+
+
+async def get_adk_artifact_service() -> CachedGcsArtifactService:
     """
-    Initializes and returns a GCSArtifactService instance.
-    This can be shared across different runs within the same function invocation.
+    Returns the per-instance GCS artifact service, creating it on first use.
+    Runs share it (and its storage client); use `.scoped(...)` to store artifacts under a chat.
     """
+    global _artifact_service
+    if _artifact_service is not None:
+        return _artifact_service
     try:
         project_id, _, _ = get_gcp_project_config()
         # Bucket for ADK artifacts, separate from context uploads
         bucket_name = f"{project_id}-adk-artifacts"
-        # The GcsArtifactService might create the bucket if it doesn't exist,
-        # but it's better to ensure it exists with correct permissions.
-        # For now, we assume it will be created or exists.
-        return GcsArtifactService(bucket_name=bucket_name)
+        with _artifact_service_lock:
+            if _artifact_service is None:
+                _artifact_service = CachedGcsArtifactService(bucket_name=bucket_name)
+        return _artifact_service
     except Exception as e:
         logger.error(f"Failed to initialize GCSArtifactService: {e}")
-        # Depending on requirements, could fallback to InMemoryArtifactService or raise
         raise ValueError("Could not create GCS Artifact Service for ADK.")
 
+# --- Remote Agent Engine Handles ---
+# `agent_engines.get` is a control-plane round-trip that also builds a fresh API client, so handles are
+# reused per instance. Entries are keyed by resource name plus a deployment version (the agent doc's
+# `lastDeployedAt`), so a redeploy recorded in Firestore is picked up even on instances that never saw it.
+REMOTE_ENGINE_CACHE_TTL_SECONDS = int(os.environ.get("REMOTE_ENGINE_CACHE_TTL_SECONDS", "1800"))
+_remote_engine_cache: dict[str, tuple[str, float, object]] = {}
+_remote_engine_cache_lock = threading.Lock()
+
+
+def get_remote_agent_engine(resource_name: str, deployment_version: str | None = None):
+    """Returns a cached Vertex AI Agent Engine handle for `resource_name`, fetching it on a miss."""
+    now = time.monotonic()
+    with _remote_engine_cache_lock:
+        cached = _remote_engine_cache.get(resource_name)
+        if cached and cached[0] == str(deployment_version) and now - cached[1] < REMOTE_ENGINE_CACHE_TTL_SECONDS:
+            return cached[2]
+
+    remote_app = agent_engines.get(resource_name)
+    with _remote_engine_cache_lock:
+        _remote_engine_cache[resource_name] = (str(deployment_version), now, remote_app)
+    logger.info(f"Fetched and cached Vertex AI Agent Engine handle for '{resource_name}'.")
+    return remote_app
+
+
+def invalidate_remote_agent_engine(resource_name: str | None = None):
+    """Drops the cached handle for `resource_name`, or every cached handle when no name is given."""
+    with _remote_engine_cache_lock:
+        if resource_name is None:
+            _remote_engine_cache.clear()
+        elif _remote_engine_cache.pop(resource_name, None) is not None:
+            logger.info(f"Invalidated cached Vertex AI Agent Engine handle for '{resource_name}'.")
+
+
 __all__ = [
     'generate_vertex_deployment_display_name',
+    'CachedGcsArtifactService',
     'get_adk_artifact_service',
     'get_model_config_from_firestore',
+    'get_remote_agent_engine',
+    'invalidate_remote_agent_engine',
 ]
\ No newline at end of file
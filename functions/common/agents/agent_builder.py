@@ -7,6 +7,8 @@ from google.genai import types as genai_types
 
 from .llm_config import prepare_llm_and_generation_config
 from .tool_factory import prepare_tools_from_config
+from .tool_memoization import ToolResultMemoizer
+from .mcp_preconnect import McpPreconnector, PreconnectedMcpToolset
 from ..core import logger
 from ..adk_helpers import get_model_config_from_firestore
 
@@ -18,7 +20,8 @@ async def _prepare_llm_agent_kwargs(merged_config: dict, adk_agent_name: str, co
     logger.info(f"Preparing kwargs for LlmAgent '{adk_agent_name}' {context_for_log}.")
 
     # 1. Delegate tool preparation
-    instantiated_tools = await prepare_tools_from_config(merged_config, adk_agent_name)
+    memoizable_tools = {}
+    instantiated_tools = await prepare_tools_from_config(merged_config, adk_agent_name, memoizable_tools)
 
     # 2. Delegate LLM and generation config preparation
     actual_model_for_adk, generate_content_config = await prepare_llm_and_generation_config(
@@ -38,6 +41,19 @@ async def _prepare_llm_agent_kwargs(merged_config: dict, adk_agent_name: str, co
     if generate_content_config:
         agent_kwargs["generate_content_config"] = generate_content_config
 
+    # Results of tools flagged idempotent are replayed for repeated calls with the same arguments.
+    if memoizable_tools:
+        tool_memoizer = ToolResultMemoizer(memoizable_tools)
+        agent_kwargs["before_tool_callback"] = tool_memoizer.before_tool
+        agent_kwargs["after_tool_callback"] = tool_memoizer.after_tool
+        agent_kwargs["after_model_callback"] = tool_memoizer.after_model
+        logger.info(f"Memoizing results of idempotent tools {sorted(memoizable_tools)} for agent '{adk_agent_name}'.")
+
+    # MCP servers are connected concurrently when the agent starts, rather than one by one at its first step.
+    mcp_toolsets = [tool for tool in instantiated_tools if isinstance(tool, PreconnectedMcpToolset)]
+    if mcp_toolsets:
+        agent_kwargs["before_agent_callback"] = McpPreconnector(mcp_toolsets).before_agent
+
     return {k: v for k, v in agent_kwargs.items() if v is not None}
 
 
@@ -0,0 +1,118 @@
+# functions/common/agents/hedged_llm.py
+import asyncio
+import os
+from typing import AsyncGenerator
+from pydantic import ConfigDict
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+
+from ..core import logger
+
+# Longest fallback chain a model config may declare, counting the primary model.
+MAX_FALLBACK_CHAIN_LENGTH = 4
+# Without a hedge delay, a model that hasn't responded within this many seconds hands over to the next one; once
+# every model in the chain has been tried, the turn gives up after the same wait.
+FIRST_RESPONSE_TIMEOUT_SECONDS = float(os.environ.get("LLM_FIRST_RESPONSE_TIMEOUT_SECONDS", "120"))
+
+
+async def _first_response(responses: AsyncGenerator[LlmResponse, None]) -> LlmResponse:
+    response = await responses.__anext__()
+    if response.error_code:
+        raise RuntimeError(f"{response.error_code}: {response.error_message}")
+    return response
+
+
+class HedgedLlm(BaseLlm):
+    """
+    Sends a request down an ordered chain of models. A candidate that fails before its first response hands over
+    to the next one immediately. With `hedge_delay_seconds`, a candidate that has not produced a first response
+    within the delay is raced against the next one; the first to respond wins and the others are cancelled.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    candidates: list[BaseLlm]
+    hedge_delay_seconds: float | None = None
+
+    @classmethod
+    def supported_models(cls) -> list[str]:
+        return []
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        generators, models = {}, {}
+
+        def launch_next() -> asyncio.Future:
+            index = len(generators)
+            candidate = self.candidates[index]
+            # Duplicates get their own contents list, since LiteLlm may append to it while preparing the request.
+            request = llm_request if index == 0 else llm_request.model_copy(update={"contents": list(llm_request.contents)})
+            responses = candidate.generate_content_async(request, stream=stream)
+            attempt = asyncio.ensure_future(_first_response(responses))
+            generators[attempt], models[attempt] = responses, candidate.model
+            if index > 0:
+                logger.info(f"[HedgedLlm] Sending request to fallback model '{candidate.model}'.")
+            return attempt
+
+        pending, winner, last_error = {launch_next()}, None, None
+        try:
+            while pending and winner is None:
+                can_hedge = self.hedge_delay_seconds is not None and len(generators) < len(self.candidates)
+                done, pending = await asyncio.wait(pending, timeout=self.hedge_delay_seconds if can_hedge else FIRST_RESPONSE_TIMEOUT_SECONDS,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if len(generators) == len(self.candidates):
+                        raise TimeoutError(f"No model in the fallback chain responded within {FIRST_RESPONSE_TIMEOUT_SECONDS}s.")
+                    # A hung request stays in the race; the next candidate is launched alongside it.
+                    waited = self.hedge_delay_seconds if can_hedge else FIRST_RESPONSE_TIMEOUT_SECONDS
+                    logger.warn(f"[HedgedLlm] No response from '{models[next(iter(pending))]}' within {waited}s; "
+                                f"{'hedging' if can_hedge else 'trying the next model'}.")
+                    pending.add(launch_next())
+                    continue
+                for attempt in done:
+                    if attempt.exception() is not None:
+                        last_error = attempt.exception()
+                        logger.warn(f"[HedgedLlm] Model '{models[attempt]}' failed: {last_error}")
+                    elif winner is None:
+                        winner = attempt
+                if winner is None and not pending and len(generators) < len(self.candidates):
+                    pending.add(launch_next())
+        finally:
+            # Cancel the losing requests and close every generator but the winner's.
+            for attempt in pending:
+                attempt.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for attempt, responses in generators.items():
+                if attempt is not winner:
+                    try:
+                        await responses.aclose()
+                    except Exception:
+                        pass
+
+        if winner is None:
+            raise last_error or RuntimeError("All models in the fallback chain failed.")
+        if models[winner] != self.candidates[0].model:
+            logger.info(f"[HedgedLlm] Served by fallback model '{models[winner]}'.")
+        winning_responses = generators[winner]
+        try:
+            yield winner.result()
+            async for response in winning_responses:
+                yield response
+        finally:
+            await winning_responses.aclose()
+
+
+def build_fallback_chain(primary: BaseLlm, fallbacks: list[BaseLlm], hedge_delay_ms: float | None) -> BaseLlm:
+    """Returns `primary` alone when there are no fallbacks, otherwise a HedgedLlm over the chain."""
+    if not fallbacks:
+        return primary
+    chain = [primary, *fallbacks][:MAX_FALLBACK_CHAIN_LENGTH]
+    return HedgedLlm(
+        model=primary.model, candidates=chain,
+        hedge_delay_seconds=float(hedge_delay_ms) / 1000 if hedge_delay_ms else None,
+    )
+
+
+__all__ = [
+    'HedgedLlm',
+    'build_fallback_chain',
+]
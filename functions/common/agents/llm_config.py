@@ -1,8 +1,20 @@
 # functions/common/agents/llm_config.py
+import contextlib
+import contextvars
+import functools
+import hashlib
+import json
 import os
+import threading
+from collections import OrderedDict
+from google.adk.models.base_llm import BaseLlm
 from google.adk.models.lite_llm import LiteLlm
 from google.genai import types as genai_types
 from ..core import logger
+from ..adk_helpers import get_model_config_from_firestore
+from .response_cache import wrap_with_response_cache
+from .hedged_llm import MAX_FALLBACK_CHAIN_LENGTH, build_fallback_chain
+from .prompt_caching import CACHE_CONTROL_INJECTION_POINTS, PROMPT_CACHE_EXPLICIT, PromptCacheUsageClient, prompt_caching_mode
 
 BACKEND_LITELLM_PROVIDER_CONFIG = {
     "openai": {"prefix": "openai", "apiKeyEnv": "OPENAI_API_KEY"},
@@ -21,27 +33,70 @@ BACKEND_LITELLM_PROVIDER_CONFIG = {
     "custom": {"prefix": None, "apiKeyEnv": None} # No prefix, user provides full string
 }
 
-async def prepare_llm_and_generation_config(merged_agent_and_model_config: dict, adk_agent_name: str, context_for_log: str = "") -> tuple[LiteLlm, genai_types.GenerateContentConfig | None]:
-    """
-    Prepares the LiteLlm model instance and the GenerateContentConfig from the merged configuration.
-    """
-    # --- Part 1: Prepare LiteLlm instance ---
-    selected_provider_id = merged_agent_and_model_config.get("provider")
-    base_model_name_from_config = merged_agent_and_model_config.get("modelString")
-    user_api_base_override = merged_agent_and_model_config.get("litellm_api_base")
-    user_api_key_override = merged_agent_and_model_config.get("litellm_api_key")
+# --- Shared LiteLlm Instances ---
+# A LiteLlm instance holds no per-run state, so identical provider settings share one instance (and the provider
+# client LiteLLM keeps for it) across agent nodes and turns on a warm instance. Keys never contain raw API keys.
+LITELLM_REGISTRY_MAX_ENTRIES = int(os.environ.get("LITELLM_REGISTRY_MAX_ENTRIES", "64"))
+_litellm_registry: "OrderedDict[tuple, LiteLlm]" = OrderedDict()
+_litellm_registry_lock = threading.Lock()
+
+
+# --- Deploy Builds ---
+# Agents built for Agent Engine are pickled by reference to their classes, and Agent Engine only installs ADK and
+# LiteLLM, not this codebase. Builds inside `deploy_build_scope()` therefore use plain ADK/LiteLLM objects only.
+_building_for_deploy: contextvars.ContextVar[bool] = contextvars.ContextVar("building_for_deploy", default=False)
+
+
+@contextlib.contextmanager
+def deploy_build_scope():
+    """Marks agents built inside the block as destined for Agent Engine deployment."""
+    token = _building_for_deploy.set(True)
+    try:
+        yield
+    finally:
+        _building_for_deploy.reset(token)
 
-    if not selected_provider_id:
-        logger.error(f"Missing 'provider' in model config for agent '{merged_agent_and_model_config.get('name', 'N/A')}' {context_for_log}.")
-        raise ValueError("Model config is missing 'provider' field.")
 
+def is_deploy_build() -> bool:
+    return _building_for_deploy.get()
+
+
+def _api_key_fingerprint(api_key: str | None) -> str | None:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else None
+
+
+def get_shared_litellm(model_constructor_kwargs: dict) -> LiteLlm:
+    """Returns the registered LiteLlm for these constructor kwargs, creating it on first use."""
+    extras = tuple(sorted((k, str(v)) for k, v in model_constructor_kwargs.items() if k not in ("model", "api_base", "api_key")))
+    registry_key = (model_constructor_kwargs["model"], model_constructor_kwargs.get("api_base"),
+                    _api_key_fingerprint(model_constructor_kwargs.get("api_key")), extras)
+    with _litellm_registry_lock:
+        llm = _litellm_registry.get(registry_key)
+        if llm is not None:
+            _litellm_registry.move_to_end(registry_key)
+            return llm
+        # The client records prompt-cache usage for run metrics; it is not part of the provider settings.
+        llm = LiteLlm(**model_constructor_kwargs, llm_client=PromptCacheUsageClient())
+        _litellm_registry[registry_key] = llm
+        if len(_litellm_registry) > LITELLM_REGISTRY_MAX_ENTRIES:
+            _litellm_registry.popitem(last=False)
+    logger.info(f"Registered shared LiteLlm for model '{registry_key[0]}' (API Base='{registry_key[1] or 'Default/Env'}').")
+    return llm
+
+
+@functools.lru_cache(maxsize=256)
+def _resolve_litellm_constructor_kwargs(selected_provider_id: str, base_model_name_from_config: str | None,
+                                        user_api_base_override: str | None, user_api_key_override: str | None,
+                                        project_id: str | None, space_id: str | None, prompt_caching_enabled: bool = True) -> tuple:
+    """
+    Resolves the LiteLLM model string, credentials and provider extras. Cached per instance, so environment
+    variables are read (and missing-setting warnings logged) once per distinct model config. Returns the kwargs
+    as sorted items, since cached values must not be mutated by callers.
+    """
     if not base_model_name_from_config:
         logger.warn(f"Missing 'modelString' for provider '{selected_provider_id}'. This may lead to errors.")
 
-    provider_backend_config = BACKEND_LITELLM_PROVIDER_CONFIG.get(selected_provider_id)
-    if not provider_backend_config:
-        logger.error(f"Invalid 'provider': {selected_provider_id}. Cannot determine LiteLLM prefix or API key for agent '{adk_agent_name}'.")
-        raise ValueError(f"Invalid provider ID: {selected_provider_id}")
+    provider_backend_config = BACKEND_LITELLM_PROVIDER_CONFIG[selected_provider_id]
 
     final_model_str_for_litellm = base_model_name_from_config
     if provider_backend_config["prefix"]:
@@ -67,10 +122,10 @@ async def prepare_llm_and_generation_config(merged_agent_and_model_config: dict,
     if selected_provider_id == "watsonx":
         if not os.getenv("WATSONX_URL") and not final_api_base:
             logger.error("WatsonX provider: WATSONX_URL env var not set and not overridden by user. LiteLLM will likely fail.")
-        if not os.getenv("WATSONX_PROJECT_ID") and not merged_agent_and_model_config.get("project_id"): # project_id can be in config or env
-            logger.warn("WatsonX provider: WATSONX_PROJECT_ID env var not set and no project_id in agent_config. LiteLLM may require it.")
+        if not os.getenv("WATSONX_PROJECT_ID") and not project_id: # project_id can be in config or env
+            logger.warn("WatsonX provider: WATSONX_PROJECT_ID env var not set and no project_id in the model config. LiteLLM may require it.")
 
-    logger.info(f"Configuring LiteLlm for agent '{adk_agent_name}' (Provider: {selected_provider_id}): "
+    logger.info(f"Configuring LiteLlm for model '{base_model_name_from_config}' (Provider: {selected_provider_id}): "
                 f"Model='{final_model_str_for_litellm}', API Base='{final_api_base or 'Default/Env'}', KeyIsSet={(not not final_api_key) or (selected_provider_id in ['bedrock', 'watsonx'])}")
 
     model_constructor_kwargs = {"model": final_model_str_for_litellm}
@@ -81,26 +136,36 @@ async def prepare_llm_and_generation_config(merged_agent_and_model_config: dict,
 
     # Specific handling for WatsonX project_id and space_id
     if selected_provider_id == "watsonx":
-        project_id_for_watsonx = merged_agent_and_model_config.get("project_id") or os.getenv("WATSONX_PROJECT_ID")
+        project_id_for_watsonx = project_id or os.getenv("WATSONX_PROJECT_ID")
         if project_id_for_watsonx:
             model_constructor_kwargs["project_id"] = project_id_for_watsonx
         else:
             # project_id is often required by LiteLLM for watsonx
-            logger.warn(f"WatsonX project_id not found for agent {adk_agent_name}. This might be required by LiteLLM.")
+            logger.warn(f"WatsonX project_id not found for model '{base_model_name_from_config}'. This might be required by LiteLLM.")
         # space_id for watsonx deployments
         if base_model_name_from_config and base_model_name_from_config.startswith("deployment/"): # Heuristic for deployment models
-            space_id_for_watsonx = merged_agent_and_model_config.get("space_id") or os.getenv("WATSONX_DEPLOYMENT_SPACE_ID")
+            space_id_for_watsonx = space_id or os.getenv("WATSONX_DEPLOYMENT_SPACE_ID")
             if space_id_for_watsonx:
                 model_constructor_kwargs["space_id"] = space_id_for_watsonx
             else:
-                logger.warn(f"WatsonX deployment model used for {adk_agent_name} but space_id not found. Deployment may fail or use default space.")
+                logger.warn(f"WatsonX deployment model '{base_model_name_from_config}' used but space_id not found. Deployment may fail or use default space.")
 
-    actual_model_for_adk = LiteLlm(**model_constructor_kwargs)
+    # Mark the stable prompt prefix (system instruction, tool schemas, earlier turns) as cacheable where the
+    # provider needs explicit breakpoints. Providers that cache automatically need no hints.
+    if prompt_caching_enabled and prompt_caching_mode(selected_provider_id, final_model_str_for_litellm) == PROMPT_CACHE_EXPLICIT:
+        model_constructor_kwargs["cache_control_injection_points"] = [dict(point) for point in CACHE_CONTROL_INJECTION_POINTS]
 
-    # --- Part 2: Prepare GenerateContentConfig ---
-    model_params = merged_agent_and_model_config
+    return tuple(sorted(model_constructor_kwargs.items()))
+
+
+@functools.lru_cache(maxsize=256)
+def _build_generation_config(parameters_json: str, stop_sequences: tuple) -> genai_types.GenerateContentConfig | None:
+    """
+    Builds the GenerateContentConfig for a parameter set once per instance. The result is shared between agents:
+    ADK deep-copies an agent's config into each LLM request, so it is never mutated after this point.
+    """
     generate_config_kwargs = {}
-    parameters_field = merged_agent_and_model_config.get("parameters", {})
+    parameters = json.loads(parameters_json)
 
     def flatten_parameters(params, prefix=''):
         flat = {}
@@ -112,7 +177,7 @@ async def prepare_llm_and_generation_config(merged_agent_and_model_config: dict,
                 flat[prefix + k] = v
         return flat
 
-    flat_params = flatten_parameters(parameters_field)
+    flat_params = flatten_parameters(parameters)
 
     if "temperature" in flat_params:
         try: generate_config_kwargs["temperature"] = float(flat_params["temperature"])
@@ -126,12 +191,79 @@ async def prepare_llm_and_generation_config(merged_agent_and_model_config: dict,
     if "topK" in flat_params:
         try: generate_config_kwargs["top_k"] = int(flat_params["topK"])
         except (ValueError, TypeError): logger.warn(f"Invalid topK: {flat_params['topK']}")
-    if "stopSequences" in model_params and isinstance(model_params["stopSequences"], list):
-        generate_config_kwargs["stop_sequences"] = [str(seq) for seq in model_params["stopSequences"]]
+    if stop_sequences:
+        generate_config_kwargs["stop_sequences"] = list(stop_sequences)
+
+    if not generate_config_kwargs:
+        return None
+    logger.info(f"Built model generation parameters: {generate_config_kwargs}")
+    return genai_types.GenerateContentConfig(**generate_config_kwargs)
+
+
+def _shared_litellm_for_config(model_config: dict) -> LiteLlm:
+    model_constructor_kwargs = dict(_resolve_litellm_constructor_kwargs(
+        model_config.get("provider"),
+        model_config.get("modelString"),
+        model_config.get("litellm_api_base"),
+        model_config.get("litellm_api_key"),
+        model_config.get("project_id"),
+        model_config.get("space_id"),
+        model_config.get("promptCaching", True) is not False,
+    ))
+    if is_deploy_build():
+        # The shared instances carry PromptCacheUsageClient, which Agent Engine cannot import.
+        return LiteLlm(**model_constructor_kwargs)
+    return get_shared_litellm(model_constructor_kwargs)
+
+
+async def prepare_llm_and_generation_config(merged_agent_and_model_config: dict, adk_agent_name: str, context_for_log: str = "") -> tuple[BaseLlm, genai_types.GenerateContentConfig | None]:
+    """
+    Prepares the LiteLlm model instance and the GenerateContentConfig from the merged configuration.
+    Both come from per-instance caches, so agents with the same model settings share them. Models declaring
+    `fallbackModelIds` are wrapped in a HedgedLlm, and models that opt into `responseCache` in a ResponseCachingLlm.
+    """
+    # --- Part 1: Prepare LiteLlm instance ---
+    selected_provider_id = merged_agent_and_model_config.get("provider")
+    if not selected_provider_id:
+        logger.error(f"Missing 'provider' in model config for agent '{merged_agent_and_model_config.get('name', 'N/A')}' {context_for_log}.")
+        raise ValueError("Model config is missing 'provider' field.")
+    if selected_provider_id not in BACKEND_LITELLM_PROVIDER_CONFIG:
+        logger.error(f"Invalid 'provider': {selected_provider_id}. Cannot determine LiteLLM prefix or API key for agent '{adk_agent_name}'.")
+        raise ValueError(f"Invalid provider ID: {selected_provider_id}")
+
+    actual_model_for_adk = _shared_litellm_for_config(merged_agent_and_model_config)
+
+    # Optional fallback chain: other model documents tried in order when this provider fails or is slow.
+    # HedgedLlm can't be loaded in Agent Engine, so deployed agents always use the primary model alone.
+    fallback_model_ids = merged_agent_and_model_config.get("fallbackModelIds") or []
+    if fallback_model_ids and is_deploy_build():
+        logger.warn(f"Agent '{adk_agent_name}' is built for deployment; its fallback models {fallback_model_ids} are not used.")
+        fallback_model_ids = []
+    fallback_models = []
+    for fallback_model_id in fallback_model_ids[:MAX_FALLBACK_CHAIN_LENGTH - 1]:
+        try:
+            fallback_config = await get_model_config_from_firestore(fallback_model_id)
+            if fallback_config.get("provider") not in BACKEND_LITELLM_PROVIDER_CONFIG:
+                raise ValueError(f"Invalid provider ID: {fallback_config.get('provider')}")
+            fallback_models.append(_shared_litellm_for_config(fallback_config))
+        except ValueError as e:
+            logger.warn(f"Skipping fallback model '{fallback_model_id}' for agent '{adk_agent_name}': {e}")
+    actual_model_for_adk = build_fallback_chain(actual_model_for_adk, fallback_models, merged_agent_and_model_config.get("hedgeDelayMs"))
+
+    # --- Part 2: Prepare GenerateContentConfig ---
+    stop_sequences = merged_agent_and_model_config.get("stopSequences")
+    generate_content_config = _build_generation_config(
+        json.dumps(merged_agent_and_model_config.get("parameters") or {}, sort_keys=True, default=str),
+        tuple(str(seq) for seq in stop_sequences) if isinstance(stop_sequences, list) else ()
+    )
+    if generate_content_config is not None:
+        logger.info(f"Agent '{adk_agent_name}' uses shared generation config {generate_content_config.model_dump(exclude_none=True)}")
 
-    generate_content_config = None
-    if generate_config_kwargs:
-        logger.info(f"Agent '{adk_agent_name}' has model generation parameters: {generate_config_kwargs}")
-        generate_content_config = genai_types.GenerateContentConfig(**generate_config_kwargs)
+    # --- Part 3: Optional response cache for deterministic runs (evals, regression suites) ---
+    actual_model_for_adk = wrap_with_response_cache(
+        actual_model_for_adk, merged_agent_and_model_config.get("responseCache"),
+        temperature=generate_content_config.temperature if generate_content_config else None,
+        for_deploy=is_deploy_build()
+    )
 
-    return actual_model_for_adk, generate_content_config
\ No newline at end of file
+    return actual_model_for_adk, generate_content_config
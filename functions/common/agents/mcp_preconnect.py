@@ -0,0 +1,89 @@
+# functions/common/agents/mcp_preconnect.py
+import asyncio
+import logging
+import os
+
+from google.adk.tools.base_toolset import BaseToolset
+
+# Agents are pickled by value into Agent Engine on deployment (see `register_pickle_by_value` in the deploy
+# handler), so this module only depends on the standard library and ADK, and logs through `logging`.
+logger = logging.getLogger(__name__)
+
+# --- Settings ---
+# Upper bound for connecting to an MCP server and listing its tools; slower servers are skipped for the run.
+MCP_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("MCP_CONNECT_TIMEOUT_SECONDS", "10"))
+# Session state key of the warning written when servers are skipped, so it shows up in the run's events.
+MCP_PRECONNECT_STATE_KEY = "mcpPreconnect"
+
+
+class PreconnectedMcpToolset(BaseToolset):
+    """
+    Wraps an MCPToolset so its connection and tool listing happen once per invocation under a timeout. A slow or
+    unreachable server contributes no tools to that invocation instead of failing or stalling the agent's step.
+    """
+
+    def __init__(self, toolset: BaseToolset, server_label: str, timeout_seconds: float = MCP_CONNECT_TIMEOUT_SECONDS):
+        super().__init__()
+        self.toolset = toolset
+        self.server_label = server_label
+        self.timeout_seconds = timeout_seconds
+        # Invocation id and listing task of the latest invocation, shared by the pre-connect and the agent's steps.
+        self._listing: tuple[str, asyncio.Task] | None = None
+        self._skipped_invocation_id: str | None = None
+
+    def __getstate__(self):
+        # Listing tasks belong to a running event loop and cannot be pickled.
+        return {**self.__dict__, "_listing": None, "_skipped_invocation_id": None}
+
+    async def _list_tools(self, readonly_context) -> list:
+        try:
+            return await asyncio.wait_for(self.toolset.get_tools(readonly_context), timeout=self.timeout_seconds)
+        except Exception as e:
+            reason = f"no answer within {self.timeout_seconds:g}s" if isinstance(e, asyncio.TimeoutError) else str(e)
+            logger.warning(f"[MCP] Skipping server '{self.server_label}' for this run: {reason}")
+            self._skipped_invocation_id = getattr(readonly_context, "invocation_id", None)
+            return []
+
+    async def get_tools(self, readonly_context=None) -> list:
+        invocation_id = getattr(readonly_context, "invocation_id", None)
+        if invocation_id is None:
+            return await self._list_tools(readonly_context)
+        if self._listing is None or self._listing[0] != invocation_id:
+            self._listing = (invocation_id, asyncio.ensure_future(self._list_tools(readonly_context)))
+        return await asyncio.shield(self._listing[1])
+
+    def skipped_in(self, invocation_id: str) -> bool:
+        return self._skipped_invocation_id == invocation_id
+
+    async def close(self) -> None:
+        await self.toolset.close()
+
+
+class McpPreconnector:
+    """
+    An ADK before-agent callback that connects to all of the agent's MCP servers concurrently before its first
+    model call, so handshakes overlap instead of running one after another inside the reasoning loop. Skipped
+    servers are recorded in session state, which ADK emits as an event of the agent.
+    """
+
+    def __init__(self, toolsets: list[PreconnectedMcpToolset]):
+        self.toolsets = toolsets
+
+    async def before_agent(self, callback_context):
+        await asyncio.gather(*(toolset.get_tools(callback_context) for toolset in self.toolsets))
+        skipped = [t.server_label for t in self.toolsets if t.skipped_in(callback_context.invocation_id)]
+        if skipped:
+            callback_context.state[MCP_PRECONNECT_STATE_KEY] = {
+                "skippedServers": skipped,
+                "warning": f"{len(skipped)} MCP server(s) could not be reached within {MCP_CONNECT_TIMEOUT_SECONDS:g}s; "
+                           f"their tools are unavailable for this run.",
+            }
+        return None
+
+
+__all__ = [
+    'MCP_CONNECT_TIMEOUT_SECONDS',
+    'MCP_PRECONNECT_STATE_KEY',
+    'PreconnectedMcpToolset',
+    'McpPreconnector',
+]
@@ -0,0 +1,96 @@
+# functions/common/agents/prompt_caching.py
+import contextvars
+from google.adk.models.lite_llm import LiteLLMClient
+
+# --- Provider Support ---
+# "explicit": the provider only caches prefixes marked with cache_control breakpoints (Anthropic, also on Bedrock).
+# "automatic": the provider caches long prefixes by itself and reports cached tokens (OpenAI, DeepSeek, Gemini).
+PROMPT_CACHE_EXPLICIT = "explicit"
+PROMPT_CACHE_AUTOMATIC = "automatic"
+_PROVIDER_PROMPT_CACHING = {
+    "anthropic": PROMPT_CACHE_EXPLICIT,
+    "openai": PROMPT_CACHE_AUTOMATIC,
+    "azure": PROMPT_CACHE_AUTOMATIC,
+    "deepseek": PROMPT_CACHE_AUTOMATIC,
+    "google_ai_studio": PROMPT_CACHE_AUTOMATIC,
+}
+
+# Breakpoints injected by LiteLLM. Anthropic orders its cache as tools -> system -> messages, so the system
+# breakpoint covers the instruction and every tool schema; the last-message breakpoint lets the next turn read the
+# whole earlier conversation from cache.
+CACHE_CONTROL_INJECTION_POINTS = (
+    {"location": "message", "role": "system"},
+    {"location": "message", "index": -1},
+)
+
+
+def prompt_caching_mode(provider_id: str, model_string: str | None) -> str | None:
+    """Returns how the provider caches prompt prefixes, or None when it does not."""
+    if provider_id == "bedrock":
+        return PROMPT_CACHE_EXPLICIT if model_string and "anthropic" in model_string else None
+    return _PROVIDER_PROMPT_CACHING.get(provider_id)
+
+
+# --- Cache Statistics ---
+# The ADK LiteLlm adapter drops the cache fields of the provider's usage data (and LiteLLM's cost estimate), so
+# they are read from the raw LiteLLM responses and accumulated per run. Runs call `start_prompt_cache_stats()`;
+# tasks spawned by parallel agents inherit the context and share the same dict.
+_prompt_cache_stats: contextvars.ContextVar[dict | None] = contextvars.ContextVar("prompt_cache_stats", default=None)
+
+
+def start_prompt_cache_stats() -> dict:
+    stats = {"llmCalls": 0, "promptTokens": 0, "cachedPromptTokens": 0, "cacheWriteTokens": 0, "cacheHitCalls": 0,
+             "costUsd": 0.0}
+    _prompt_cache_stats.set(stats)
+    return stats
+
+
+def summarize_prompt_cache_stats(stats: dict) -> dict:
+    """Adds the share of prompt tokens served from cache, for display in run metrics. Cost is reported with usage."""
+    ratio = stats["cachedPromptTokens"] / stats["promptTokens"] if stats.get("promptTokens") else 0.0
+    return {**{k: v for k, v in stats.items() if k != "costUsd"}, "cachedPromptTokenRatio": round(ratio, 4)}
+
+
+def _record_usage(usage, cost_usd: float | None = None):
+    stats = _prompt_cache_stats.get()
+    if stats is None or usage is None:
+        return
+    stats["costUsd"] += cost_usd or 0.0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", None) if details else None) or getattr(usage, "cache_read_input_tokens", 0) or 0
+    stats["llmCalls"] += 1
+    stats["promptTokens"] += getattr(usage, "prompt_tokens", 0) or 0
+    stats["cachedPromptTokens"] += cached_tokens
+    stats["cacheWriteTokens"] += getattr(usage, "cache_creation_input_tokens", 0) or 0
+    if cached_tokens:
+        stats["cacheHitCalls"] += 1
+
+
+async def _record_stream_usage(stream):
+    usage = None
+    async for chunk in stream:
+        usage = getattr(chunk, "usage", None) or usage
+        yield chunk
+    _record_usage(usage)
+
+
+class PromptCacheUsageClient(LiteLLMClient):
+    """LiteLLM client that records prompt-cache usage of every completion into the current run's stats."""
+
+    async def acompletion(self, model, messages, tools, **kwargs):
+        response = await super().acompletion(model=model, messages=messages, tools=tools, **kwargs)
+        if kwargs.get("stream"):
+            return _record_stream_usage(response)
+        _record_usage(getattr(response, "usage", None), (getattr(response, "_hidden_params", None) or {}).get("response_cost"))
+        return response
+
+
+__all__ = [
+    'CACHE_CONTROL_INJECTION_POINTS',
+    'PROMPT_CACHE_EXPLICIT',
+    'PROMPT_CACHE_AUTOMATIC',
+    'prompt_caching_mode',
+    'start_prompt_cache_stats',
+    'summarize_prompt_cache_stats',
+    'PromptCacheUsageClient',
+]
@@ -0,0 +1,198 @@
+# functions/common/agents/response_cache.py
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncGenerator
+from pydantic import ConfigDict, Field
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+
+from ..core import db, logger
+
+# --- Settings ---
+# Opt-in per model document: `responseCache: {"enabled": true, "ttlSeconds": 86400, "store": "firestore"}`.
+# Only applied at temperature 0 unless `allowNonZeroTemperature` is also set.
+RESPONSE_CACHE_STORE_MEMORY = "memory"
+RESPONSE_CACHE_STORE_FIRESTORE = "firestore"
+RESPONSE_CACHE_DEFAULT_TTL_SECONDS = 24 * 3600
+RESPONSE_CACHE_COLLECTION = "llmResponseCache"
+MEMORY_RESPONSE_CACHE_MAX_ENTRIES = 1024
+# Cached turns must fit in one Firestore document with room for the bookkeeping fields.
+MAX_FIRESTORE_CACHED_BYTES = 900 * 1024
+
+
+class MemoryResponseStore:
+    """Per-instance LRU of cached responses. Expired entries are dropped when read."""
+
+    def __init__(self, max_entries: int = MEMORY_RESPONSE_CACHE_MAX_ENTRIES):
+        self._entries: "OrderedDict[str, tuple[float, list[dict]]]" = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> list[dict] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    async def put(self, key: str, responses: list[dict], ttl_seconds: float, model: str):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl_seconds, responses)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+class FirestoreResponseStore:
+    """
+    Cached responses shared by all instances, one document per request hash. `expiresAt` is checked on read;
+    a Firestore TTL policy on that field removes stale documents.
+    """
+
+    def __init__(self, collection_name: str = RESPONSE_CACHE_COLLECTION):
+        self._collection = db.collection(collection_name)
+
+    async def get(self, key: str) -> list[dict] | None:
+        snap = await asyncio.to_thread(self._collection.document(key).get)
+        if not snap.exists:
+            return None
+        cached = snap.to_dict()
+        expires_at = cached.get("expiresAt")
+        if isinstance(expires_at, datetime) and expires_at < datetime.now(timezone.utc):
+            return None
+        return json.loads(cached["responses"])
+
+    async def put(self, key: str, responses: list[dict], ttl_seconds: float, model: str):
+        payload = json.dumps(responses)
+        if len(payload.encode("utf-8")) > MAX_FIRESTORE_CACHED_BYTES:
+            logger.info(f"[ResponseCache] Response for {model} is too large to cache in Firestore; skipping.")
+            return
+        # Stored as a JSON string so nested arrays in tool schemas/args never hit Firestore's type limits.
+        await asyncio.to_thread(self._collection.document(key).set, {
+            "model": model,
+            "responses": payload,
+            "createdAt": datetime.now(timezone.utc),
+            "expiresAt": datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds),
+        })
+
+
+_memory_store = MemoryResponseStore()
+_firestore_store = None
+
+
+def get_response_store(store_name: str):
+    """Returns the shared store instance for `store_name` ("memory" or "firestore")."""
+    global _firestore_store
+    if store_name == RESPONSE_CACHE_STORE_FIRESTORE:
+        if _firestore_store is None:
+            _firestore_store = FirestoreResponseStore()
+        return _firestore_store
+    return _memory_store
+
+
+def response_cache_key(model: str, llm_request: LlmRequest) -> str:
+    """Hashes everything that determines the response: model string, messages, tools and generation params."""
+    request_fingerprint = {
+        "model": model,
+        "contents": [content.model_dump(mode="json", exclude_none=True) for content in llm_request.contents],
+        # The config carries the system instruction, tool declarations and generation parameters.
+        "config": llm_request.config.model_dump(mode="json", exclude_none=True) if llm_request.config else None,
+    }
+    encoded = json.dumps(request_fingerprint, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResponseCachingLlm(BaseLlm):
+    """
+    Wraps a model and replays stored responses for byte-identical requests. Only complete, error-free turns
+    are cached; replayed responses carry `custom_metadata.responseCache = "hit"` so their events show it.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    inner: BaseLlm
+    ttl_seconds: float = RESPONSE_CACHE_DEFAULT_TTL_SECONDS
+    store: Any = Field(default=None, exclude=True)
+
+    @classmethod
+    def supported_models(cls) -> list[str]:
+        return []
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        try:
+            key = response_cache_key(self.inner.model, llm_request)
+        except Exception as e:
+            logger.warn(f"[ResponseCache] Could not fingerprint request for {self.inner.model}; calling the model directly: {e}")
+            async for response in self.inner.generate_content_async(llm_request, stream=stream):
+                yield response
+            return
+
+        cached = None
+        try:
+            cached = await self.store.get(key)
+        except Exception as e:
+            logger.warn(f"[ResponseCache] Lookup failed for {self.inner.model}: {e}")
+        if cached:
+            logger.info(f"[ResponseCache] Hit for {self.inner.model} ({key[:12]}).")
+            for response_data in cached:
+                # Validated from JSON so base64 fields (inline data, thought signatures) decode back to bytes.
+                response = LlmResponse.model_validate_json(json.dumps(response_data))
+                response.custom_metadata = {**(response.custom_metadata or {}), "responseCache": "hit"}
+                yield response
+            return
+
+        # Partial chunks are streamed through but not stored; the complete responses are replayed as one turn.
+        complete_responses, cacheable = [], True
+        async for response in self.inner.generate_content_async(llm_request, stream=stream):
+            if response.error_code or response.interrupted:
+                cacheable = False
+            if not response.partial:
+                complete_responses.append(response.model_dump(mode="json", exclude_none=True))
+            yield response
+
+        if cacheable and complete_responses:
+            try:
+                await self.store.put(key, complete_responses, self.ttl_seconds, self.inner.model)
+            except Exception as e:
+                logger.warn(f"[ResponseCache] Failed to store response for {self.inner.model}: {e}")
+
+
+def wrap_with_response_cache(llm: BaseLlm, cache_config: dict | None, temperature: float | None = None,
+                             for_deploy: bool = False) -> BaseLlm:
+    """
+    Wraps `llm` when the model config opts into response caching and the request is deterministic (temperature 0,
+    or explicitly overridden); returns it unchanged otherwise. Deploy builds are never wrapped: the wrapper's class
+    and its store can't be loaded in Agent Engine.
+    """
+    if not cache_config or not cache_config.get("enabled"):
+        return llm
+    if for_deploy:
+        logger.info(f"[ResponseCache] Not caching responses of {llm.model} in a deployed agent.")
+        return llm
+    if temperature != 0 and not cache_config.get("allowNonZeroTemperature"):
+        logger.warn(f"[ResponseCache] Caching is enabled for {llm.model} but temperature is {temperature}; "
+                    f"not caching, since every repeat would get the same sampled reply. "
+                    f"Set temperature to 0 or `allowNonZeroTemperature` to cache anyway.")
+        return llm
+    store_name = cache_config.get("store") or RESPONSE_CACHE_STORE_MEMORY
+    return ResponseCachingLlm(
+        model=llm.model, inner=llm,
+        ttl_seconds=float(cache_config.get("ttlSeconds") or RESPONSE_CACHE_DEFAULT_TTL_SECONDS),
+        store=get_response_store(store_name),
+    )
+
+
+__all__ = [
+    'ResponseCachingLlm',
+    'wrap_with_response_cache',
+    'response_cache_key',
+]
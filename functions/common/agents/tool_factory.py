@@ -1,12 +1,85 @@
 # functions/common/agents/tool_factory.py
+import hashlib
 import importlib
+import json
+import os
+import threading
 import traceback
+from collections import OrderedDict
+from firebase_admin import firestore
 from fastapi.openapi.models import APIKey, APIKeyIn, HTTPBearer
 from google.adk.auth.auth_schemes import AuthScheme
 from google.adk.auth.auth_credential import AuthCredential, AuthCredentialTypes, HttpAuth, HttpCredentials
 from google.adk.tools.mcp_tool.mcp_session_manager import StreamableHTTPConnectionParams, SseServerParams
 from google.adk.tools.mcp_tool.mcp_toolset import MCPToolset
-from ..core import logger
+from ..core import db, logger
+from .tool_memoization import memo_namespace, memo_ttl_seconds
+from .mcp_preconnect import PreconnectedMcpToolset
+
+# --- Tool Registry ---
+# Tool classes are resolved once per instance. Instances are only reused for tools whose config marks them
+# `stateless`, keyed by module, class and a hash of their configuration.
+TOOL_INSTANCE_CACHE_MAX_ENTRIES = int(os.environ.get("TOOL_INSTANCE_CACHE_MAX_ENTRIES", "128"))
+# Number of recently updated agents whose custom tool modules are pre-imported at instance start (0 = off).
+TOOL_WARMUP_AGENT_LIMIT = int(os.environ.get("TOOL_WARMUP_AGENT_LIMIT", "0"))
+_tool_class_cache: dict[tuple[str, str], type] = {}
+_tool_instance_cache: "OrderedDict[tuple, object]" = OrderedDict()
+_tool_cache_lock = threading.Lock()
+
+
+def _load_tool_class(module_path: str, class_name: str) -> type:
+    key = (module_path, class_name)
+    tool_class = _tool_class_cache.get(key)
+    if tool_class is None:
+        tool_class = getattr(importlib.import_module(module_path), class_name)
+        with _tool_cache_lock:
+            _tool_class_cache[key] = tool_class
+    return tool_class
+
+
+def _configuration_hash(configuration: dict) -> str:
+    return hashlib.sha256(json.dumps(configuration, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _collect_tool_module_paths(agent_config: dict, module_paths: set):
+    for tool_config in agent_config.get("tools") or []:
+        if isinstance(tool_config, dict) and tool_config.get("type") == "custom_repo" and tool_config.get("module_path"):
+            module_paths.add(tool_config["module_path"])
+    for child_config in agent_config.get("childAgents") or []:
+        _collect_tool_module_paths(child_config, module_paths)
+
+
+def warm_up_tool_modules(agent_limit: int = TOOL_WARMUP_AGENT_LIMIT) -> int:
+    """Imports the custom tool modules used by the most recently updated agents. Returns how many were imported."""
+    module_paths = set()
+    recent_agents = db.collection("agents").order_by("updatedAt", direction=firestore.Query.DESCENDING).limit(agent_limit)
+    for agent_snap in recent_agents.stream():
+        _collect_tool_module_paths(agent_snap.to_dict() or {}, module_paths)
+
+    imported = 0
+    for module_path in sorted(module_paths):
+        try:
+            importlib.import_module(module_path)
+            imported += 1
+        except Exception as e:
+            logger.warn(f"Tool warm-up: could not import '{module_path}': {e}")
+    logger.info(f"Tool warm-up: imported {imported}/{len(module_paths)} tool modules from {agent_limit} recent agents.")
+    return imported
+
+
+def start_tool_warm_up_in_background():
+    """Runs `warm_up_tool_modules` on a daemon thread so instance start-up isn't delayed. No-op when the limit is 0."""
+    if TOOL_WARMUP_AGENT_LIMIT <= 0:
+        return
+
+    def warm_up():
+        try:
+            warm_up_tool_modules()
+        except Exception as e:
+            logger.warn(f"Tool warm-up failed: {e}")
+
+    threading.Thread(target=warm_up, name="tool-warm-up", daemon=True).start()
+
 
 def _create_mcp_auth_objects(auth_config: dict | None) -> tuple[AuthScheme | None, AuthCredential | None]:
     """
@@ -59,9 +132,16 @@ def instantiate_tool(tool_config):
 
     if module_path and class_name:
         try:
-            module = importlib.import_module(module_path)
-            ToolClass = getattr(module, class_name)
+            ToolClass = _load_tool_class(module_path, class_name)
             instance_specific_kwargs = tool_config.get('configuration', {})
+            instance_key = (module_path, class_name, _configuration_hash(instance_specific_kwargs)) if tool_config.get('stateless') else None
+            if instance_key:
+                with _tool_cache_lock:
+                    cached_tool = _tool_instance_cache.get(instance_key)
+                    if cached_tool is not None:
+                        _tool_instance_cache.move_to_end(instance_key)
+                        logger.info(f"Reusing cached instance of stateless tool '{tool_config.get('id', class_name)}'.")
+                        return cached_tool
             if instance_specific_kwargs:
                 logger.info(f"Instantiating tool '{tool_config.get('id', class_name)}' with specific configuration keys: {list(instance_specific_kwargs.keys())}")
             else:
@@ -69,9 +149,15 @@ def instantiate_tool(tool_config):
 
             instance = ToolClass(**instance_specific_kwargs)
             if hasattr(instance, 'export_to_adk') and callable(instance.export_to_adk):
-                return instance.export_to_adk()
+                tool = instance.export_to_adk()
             else:
-                return instance
+                tool = instance
+            if instance_key:
+                with _tool_cache_lock:
+                    _tool_instance_cache[instance_key] = tool
+                    if len(_tool_instance_cache) > TOOL_INSTANCE_CACHE_MAX_ENTRIES:
+                        _tool_instance_cache.popitem(last=False)
+            return tool
         except Exception as e:
             tool_id_for_log = tool_config.get('id', class_name or 'N/A')
             if isinstance(e, (ImportError, ModuleNotFoundError)):
@@ -83,9 +169,12 @@ def instantiate_tool(tool_config):
         raise ValueError(f"Unsupported or incomplete tool configuration for Custom tool ID '{tool_config.get('id', 'N/A')}' (type: {tool_type}). Missing module_path/class_name.")
 
 
-async def prepare_tools_from_config(merged_agent_and_model_config: dict, adk_agent_name: str) -> list:
+async def prepare_tools_from_config(merged_agent_and_model_config: dict, adk_agent_name: str,
+                                    memoizable_tools: dict | None = None) -> list:
     """
     Parses the tool configuration and instantiates all specified tools (MCP, custom, etc.).
+    When `memoizable_tools` is given, it is filled with the ADK names of tools flagged `idempotent`, mapped to
+    their memo namespace and TTL.
     """
     instantiated_tools = []
     mcp_tools_by_server_and_auth = {}
@@ -103,11 +192,19 @@ async def prepare_tools_from_config(merged_agent_and_model_config: dict, adk_age
                 if dict_key not in mcp_tools_by_server_and_auth:
                     mcp_tools_by_server_and_auth[dict_key] = []
                 mcp_tools_by_server_and_auth[dict_key].append(tool_name_on_server)
+                if memoizable_tools is not None and tc.get('idempotent'):
+                    memoizable_tools[tool_name_on_server] = (memo_namespace(tc), memo_ttl_seconds(tc))
             else:
                 logger.warn(f"Skipping MCP tool for agent '{adk_agent_name}' due to missing mcpServerUrl or mcpToolName: {tc}")
         elif tool_type == 'custom_repo':
             try:
-                instantiated_tools.append(instantiate_tool(tc))
+                tool = instantiate_tool(tc)
+                instantiated_tools.append(tool)
+                if memoizable_tools is not None and tc.get('idempotent'):
+                    if getattr(tool, 'name', None):
+                        memoizable_tools[tool.name] = (memo_namespace(tc), memo_ttl_seconds(tc))
+                    else:
+                        logger.warn(f"Tool '{tc.get('id')}' is flagged idempotent but exports no single named ADK tool; its results won't be memoized.")
             except ValueError as e:
                 logger.warn(f"Skipping tool for agent '{adk_agent_name}' due to error: {e}")
         else:
@@ -123,7 +220,7 @@ async def prepare_tools_from_config(merged_agent_and_model_config: dict, adk_age
                 connection_params=conn_params, tool_filter=unique_tool_filter,
                 auth_scheme=auth_scheme, auth_credential=auth_credential, errlog=None
             )
-            instantiated_tools.append(toolset)
+            instantiated_tools.append(PreconnectedMcpToolset(toolset, server_label=server_url))
             logger.info(f"Successfully created and added MCPToolset for server '{server_url}' with {len(unique_tool_filter)} tools.")
         except Exception as e_mcp_toolset:
             logger.error(f"Failed to create MCPToolset for server '{server_url}': {e_mcp_toolset}")
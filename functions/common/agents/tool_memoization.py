@@ -0,0 +1,194 @@
+# functions/common/agents/tool_memoization.py
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Agents are pickled by value into Agent Engine on deployment (see `register_pickle_by_value` in the deploy
+# handler), so this module only depends on the standard library and logs through `logging`.
+logger = logging.getLogger(__name__)
+
+# --- Settings ---
+# Opt-in per tool config: `idempotent: true`, optionally with `memoTtlSeconds`.
+TOOL_MEMO_DEFAULT_TTL_SECONDS = float(os.environ.get("TOOL_MEMO_DEFAULT_TTL_SECONDS", "600"))
+TOOL_MEMO_MAX_ENTRIES = int(os.environ.get("TOOL_MEMO_MAX_ENTRIES", "1024"))
+# Results whose JSON form is larger than this are passed through without being stored.
+TOOL_MEMO_MAX_RESULT_CHARS = int(os.environ.get("TOOL_MEMO_MAX_RESULT_CHARS", "200000"))
+# Invocation-scoped state key holding the run's hit/miss counts; `temp:` keeps them out of the persisted session.
+TOOL_MEMO_STATE_KEY = "temp:toolMemo"
+# ADK strips `temp:` keys from the events it emits, so model responses carry a copy in their custom metadata.
+TOOL_MEMO_METADATA_KEY = "toolMemo"
+_MAX_TRACKED_INVOCATIONS = 256
+
+
+class _MemoStore:
+    """
+    Per-process LRU of tool results with per-entry expiry, plus the hit/miss counts of recent invocations.
+    Pickles as an empty store, so a deployed agent starts with a fresh cache of its own.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, tuple[float, object]]" = OrderedDict()
+        self._invocation_stats: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        return _MemoStore, ()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, response, ttl_seconds: float):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl_seconds, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > TOOL_MEMO_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def count(self, invocation_id: str, tool_name: str, hit: bool) -> dict:
+        """Counts one lookup for the invocation and returns a snapshot of its stats."""
+        outcome = "hits" if hit else "misses"
+        with self._lock:
+            stats = self._invocation_stats.get(invocation_id)
+            if stats is None:
+                stats = self._invocation_stats[invocation_id] = {"invocationId": invocation_id, "hits": 0, "misses": 0, "byTool": {}}
+                while len(self._invocation_stats) > _MAX_TRACKED_INVOCATIONS:
+                    self._invocation_stats.popitem(last=False)
+            stats[outcome] += 1
+            tool_stats = stats["byTool"].setdefault(tool_name, {"hits": 0, "misses": 0})
+            tool_stats[outcome] += 1
+            return copy.deepcopy(stats)
+
+
+_memo_store = _MemoStore()
+
+
+def memo_namespace(tool_config: dict) -> str:
+    """
+    Identifies where a tool's results come from, so equal calls to the same tool name on different MCP servers,
+    credentials or custom tool configurations never share cache entries.
+    """
+    if tool_config.get("type") == "mcp":
+        source = {"server": tool_config.get("mcpServerUrl"), "auth": tool_config.get("auth")}
+    else:
+        source = {"module": tool_config.get("module_path"), "class": tool_config.get("class_name"),
+                  "configuration": tool_config.get("configuration") or {}}
+    return hashlib.sha256(json.dumps(source, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _memo_key(namespace: str, tool_name: str, args: dict) -> str:
+    canonical_args = json.dumps(args or {}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{namespace}\0{tool_name}\0{canonical_args}".encode("utf-8")).hexdigest()
+
+
+def _is_error_response(tool_response) -> bool:
+    if isinstance(tool_response, dict):
+        return bool(tool_response.get("error") or tool_response.get("isError"))
+    return bool(getattr(tool_response, "isError", False))
+
+
+def _response_size(tool_response) -> int:
+    if hasattr(tool_response, "model_dump_json"):
+        return len(tool_response.model_dump_json())
+    return len(json.dumps(tool_response, default=str))
+
+
+class ToolResultMemoizer:
+    """
+    ADK before/after-tool callbacks that replay stored results for tools flagged idempotent, keyed by tool name
+    and canonical arguments. The cache is shared by every agent in the process, so it serves repeated calls
+    within a run (e.g. across loop iterations) as well as across runs while entries are fresh.
+    """
+
+    def __init__(self, memoizable_tools: dict[str, tuple[str, float]]):
+        # Tool name -> (memo namespace, TTL in seconds).
+        self.memoizable_tools = memoizable_tools
+
+    def _record(self, tool_name: str, tool_context, hit: bool):
+        stats = _memo_store.count(tool_context.invocation_id, tool_name, hit)
+        tool_context.state[TOOL_MEMO_STATE_KEY] = stats
+
+    def before_tool(self, tool, args: dict, tool_context):
+        memo = self.memoizable_tools.get(tool.name)
+        if memo is None:
+            return None
+        try:
+            cached = _memo_store.get(_memo_key(memo[0], tool.name, args))
+        except Exception as e:
+            logger.warning(f"[ToolMemo] Lookup failed for tool '{tool.name}': {e}")
+            return None
+        self._record(tool.name, tool_context, hit=cached is not None)
+        if cached is None:
+            return None
+        logger.info(f"[ToolMemo] Replaying stored result of tool '{tool.name}'.")
+        cached = copy.deepcopy(cached)
+        # ADK wraps non-dict tool results the same way before building the function response.
+        return cached if isinstance(cached, dict) else {"result": cached}
+
+    def after_model(self, callback_context, llm_response):
+        """Copies the invocation's latest counts onto the model response, where they survive into the event."""
+        snapshot = callback_context.state.get(TOOL_MEMO_STATE_KEY)
+        if snapshot:
+            llm_response.custom_metadata = {**(llm_response.custom_metadata or {}), TOOL_MEMO_METADATA_KEY: snapshot}
+        return None
+
+    def after_tool(self, tool, args: dict, tool_context, tool_response):
+        memo = self.memoizable_tools.get(tool.name)
+        if memo is None or tool_response is None or _is_error_response(tool_response):
+            return None
+        try:
+            if _response_size(tool_response) > TOOL_MEMO_MAX_RESULT_CHARS:
+                logger.info(f"[ToolMemo] Result of tool '{tool.name}' is too large to store; skipping.")
+                return None
+            _memo_store.put(_memo_key(memo[0], tool.name, args), copy.deepcopy(tool_response), memo[1])
+        except Exception as e:
+            logger.warning(f"[ToolMemo] Could not store result of tool '{tool.name}': {e}")
+        return None
+
+
+def memo_ttl_seconds(tool_config: dict) -> float:
+    try:
+        return float(tool_config.get("memoTtlSeconds") or TOOL_MEMO_DEFAULT_TTL_SECONDS)
+    except (TypeError, ValueError):
+        return TOOL_MEMO_DEFAULT_TTL_SECONDS
+
+
+def summarize_tool_memo_events(all_events: list) -> dict | None:
+    """
+    Reads the run's tool memo counts back from the `toolMemo` snapshots in the model response events' custom
+    metadata. The fullest snapshot wins, since parallel calls of one step are counted before the next model call.
+    None when no call was eligible.
+    """
+    summary = None
+    for event in all_events:
+        snapshot = (event.get("custom_metadata") or {}).get(TOOL_MEMO_METADATA_KEY)
+        if not isinstance(snapshot, dict):
+            continue
+        if summary is None or snapshot.get("hits", 0) + snapshot.get("misses", 0) > summary["hits"] + summary["misses"]:
+            summary = {"hits": snapshot.get("hits", 0), "misses": snapshot.get("misses", 0), "byTool": snapshot.get("byTool") or {}}
+    if summary is None:
+        return None
+    lookups = summary["hits"] + summary["misses"]
+    return {**summary, "hitRate": round(summary["hits"] / lookups, 4) if lookups else 0.0}
+
+
+__all__ = [
+    'TOOL_MEMO_STATE_KEY',
+    'TOOL_MEMO_METADATA_KEY',
+    'ToolResultMemoizer',
+    'memo_namespace',
+    'memo_ttl_seconds',
+    'summarize_tool_memo_events',
+]
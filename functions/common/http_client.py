@@ -0,0 +1,218 @@
+# functions/common/http_client.py
+import asyncio
+import random
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import httpx
+from .core import logger
+
+# --- Pool Configuration ---
+DEFAULT_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+DEFAULT_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0)
+MAX_CONNECTIONS_PER_HOST = 10
+DEFAULT_MAX_RETRIES = 2
+RETRY_BASE_DELAY_SECONDS = 0.5
+RETRY_MAX_DELAY_SECONDS = 8.0
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+try:
+    import h2  # noqa: F401 -- httpx only needs it importable to negotiate HTTP/2.
+    HTTP2_ENABLED = True
+except ImportError:
+    HTTP2_ENABLED = False
+    logger.warn("Package 'h2' is not installed; outbound HTTP clients will use HTTP/1.1 only.")
+
+_sync_client: httpx.Client | None = None
+_sync_client_lock = threading.Lock()
+_sync_host_semaphores: dict[str, threading.BoundedSemaphore] = {}
+
+# Async clients are bound to the event loop that created them, so they are pooled per loop only. Every task run or
+# async callable gets a fresh loop from `asyncio.run`, so connections are reused within one run, never across runs;
+# `run_and_close_async_http_client` closes the loop's client before the loop goes away.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_async_host_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+
+def get_http_client() -> httpx.Client:
+    """Returns the process-wide pooled sync client (HTTP/2 and keep-alive). It is thread-safe and must not be closed by callers."""
+    global _sync_client
+    if _sync_client is None or _sync_client.is_closed:
+        with _sync_client_lock:
+            if _sync_client is None or _sync_client.is_closed:
+                _sync_client = httpx.Client(http2=HTTP2_ENABLED, timeout=DEFAULT_TIMEOUT, limits=DEFAULT_LIMITS)
+                logger.info(f"Created pooled sync HTTP client (http2={HTTP2_ENABLED}).")
+    return _sync_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Returns the pooled async client for the running event loop. It must not be closed by callers; the loop's owner
+    closes it through `aclose_async_http_client` (see `run_and_close_async_http_client`).
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(http2=HTTP2_ENABLED, timeout=DEFAULT_TIMEOUT, limits=DEFAULT_LIMITS)
+        _async_clients[loop] = client
+        logger.info(f"Created pooled async HTTP client (http2={HTTP2_ENABLED}).")
+    return client
+
+
+async def aclose_async_http_client():
+    """Closes the running loop's async client, if one was created, so its connections don't wait for GC."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.pop(loop, None)
+    _async_host_semaphores.pop(loop, None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+def run_and_close_async_http_client(coroutine):
+    """`asyncio.run` for task runs and async callables that closes the loop's async HTTP client before the loop ends."""
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await aclose_async_http_client()
+    return asyncio.run(run())
+
+
+def _host_key(url) -> str:
+    parts = urlsplit(str(url))
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _sync_host_semaphore(url) -> threading.BoundedSemaphore:
+    key = _host_key(url)
+    with _sync_client_lock:
+        if key not in _sync_host_semaphores:
+            _sync_host_semaphores[key] = threading.BoundedSemaphore(MAX_CONNECTIONS_PER_HOST)
+        return _sync_host_semaphores[key]
+
+
+def _async_host_semaphore(url) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphores = _async_host_semaphores.setdefault(loop, {})
+    key = _host_key(url)
+    if key not in semaphores:
+        semaphores[key] = asyncio.Semaphore(MAX_CONNECTIONS_PER_HOST)
+    return semaphores[key]
+
+
+def _retry_delay(attempt: int, response: httpx.Response | None = None) -> float:
+    """Exponential backoff with full jitter, honouring a numeric Retry-After header when present."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), RETRY_MAX_DELAY_SECONDS)
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * (2 ** attempt)))
+
+
+def _should_retry_error(error: Exception, method: str, retry_non_idempotent: bool) -> bool:
+    # A failed connect means nothing reached the server, so it is safe to retry any method.
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    return isinstance(error, httpx.TransportError) and (method in IDEMPOTENT_METHODS or retry_non_idempotent)
+
+
+def _should_retry_response(response: httpx.Response, method: str, retry_non_idempotent: bool) -> bool:
+    if response.status_code not in RETRYABLE_STATUS_CODES:
+        return False
+    return method in IDEMPOTENT_METHODS or retry_non_idempotent or response.status_code == 429
+
+
+def request_with_retry(method: str, url, *, max_retries: int = DEFAULT_MAX_RETRIES, retry_non_idempotent: bool = False,
+                       client: httpx.Client | None = None, **kwargs) -> httpx.Response:
+    """
+    Sends a request through the pooled sync client, retrying transient failures with jittered backoff.
+    The final response is returned as-is; callers remain responsible for `raise_for_status()`.
+    """
+    method = method.upper()
+    client = client or get_http_client()
+    attempt = 0
+    while True:
+        try:
+            with _sync_host_semaphore(url):
+                response = client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            if attempt >= max_retries or not _should_retry_error(e, method, retry_non_idempotent):
+                raise
+            delay = _retry_delay(attempt)
+            logger.warn(f"[HTTP] {method} {url} failed with {type(e).__name__}; retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries}).")
+        else:
+            if attempt >= max_retries or not _should_retry_response(response, method, retry_non_idempotent):
+                return response
+            delay = _retry_delay(attempt, response)
+            logger.warn(f"[HTTP] {method} {url} returned {response.status_code}; retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries}).")
+            response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+async def arequest_with_retry(method: str, url, *, max_retries: int = DEFAULT_MAX_RETRIES, retry_non_idempotent: bool = False,
+                              client: httpx.AsyncClient | None = None, **kwargs) -> httpx.Response:
+    """Async counterpart of `request_with_retry`, using the pooled client of the running event loop."""
+    method = method.upper()
+    client = client or get_async_http_client()
+    attempt = 0
+    while True:
+        try:
+            async with _async_host_semaphore(url):
+                response = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            if attempt >= max_retries or not _should_retry_error(e, method, retry_non_idempotent):
+                raise
+            delay = _retry_delay(attempt)
+            logger.warn(f"[HTTP] {method} {url} failed with {type(e).__name__}; retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries}).")
+        else:
+            if attempt >= max_retries or not _should_retry_response(response, method, retry_non_idempotent):
+                return response
+            delay = _retry_delay(attempt, response)
+            logger.warn(f"[HTTP] {method} {url} returned {response.status_code}; retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries}).")
+            await response.aclose()
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+@contextmanager
+def stream_with_retry(method: str, url, *, max_retries: int = DEFAULT_MAX_RETRIES, **kwargs):
+    """
+    Opens a streaming response through the pooled sync client. Only connection establishment is
+    retried; once the body starts streaming, errors propagate to the caller.
+    """
+    method = method.upper()
+    client = get_http_client()
+    attempt = 0
+    with _sync_host_semaphore(url):
+        while True:
+            try:
+                request = client.build_request(method, url, **{k: v for k, v in kwargs.items() if k != "follow_redirects"})
+                response = client.send(request, stream=True, follow_redirects=kwargs.get("follow_redirects", False))
+                break
+            except httpx.TransportError as e:
+                if attempt >= max_retries or not _should_retry_error(e, method, False):
+                    raise
+                delay = _retry_delay(attempt)
+                logger.warn(f"[HTTP] {method} {url} failed with {type(e).__name__}; retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries}).")
+                time.sleep(delay)
+                attempt += 1
+        try:
+            yield response
+        finally:
+            response.close()
+
+
+__all__ = [
+    'get_http_client',
+    'get_async_http_client',
+    'aclose_async_http_client',
+    'run_and_close_async_http_client',
+    'request_with_retry',
+    'arequest_with_retry',
+    'stream_with_retry',
+]
@@ -0,0 +1,235 @@
+# functions/common/retrieval.py
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+from .core import logger
+
+# --- Configuration ---
+RETRIEVAL_MIN_CHARS = int(os.environ.get("CONTEXT_RETRIEVAL_MIN_CHARS", "20000"))
+RETRIEVAL_TOP_K = int(os.environ.get("CONTEXT_RETRIEVAL_TOP_K", "8"))
+RETRIEVAL_CHUNK_CHARS = 1500
+RETRIEVAL_CHUNK_OVERLAP = 200
+# "auto" uses an index whenever one exists; "off" always stuffs full content.
+RETRIEVAL_MODE = os.environ.get("CONTEXT_RETRIEVAL_MODE", "auto").lower()
+HASHING_EMBEDDING_DIM = 512
+_EMBEDDING_BATCH_SIZE = 64
+_INDEX_CACHE_MAX_ENTRIES = 32
+
+# An embedding function maps a list of texts to a (len(texts), dim) float matrix.
+EmbeddingFunction = Callable[[list[str]], np.ndarray]
+
+
+# --- Embedding Functions ---
+def hashing_embedding(texts: list[str], dim: int = HASHING_EMBEDDING_DIM) -> np.ndarray:
+    """
+    Deterministic, dependency-free bag-of-words embedding using signed feature hashing.
+    Works fully offline, which makes it the default when no embedding model is configured and in tests.
+    """
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in re.findall(r"[a-z0-9_]+", text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            matrix[row, value % dim] += 1.0 if (value >> 63) & 1 else -1.0
+    return matrix
+
+
+def _litellm_embedding_function(model: str) -> EmbeddingFunction:
+    def embed(texts: list[str]) -> np.ndarray:
+        import litellm
+        vectors = []
+        for start in range(0, len(texts), _EMBEDDING_BATCH_SIZE):
+            response = litellm.embedding(model=model, input=texts[start:start + _EMBEDDING_BATCH_SIZE])
+            vectors.extend(item["embedding"] for item in response.data)
+        return np.asarray(vectors, dtype=np.float32)
+    return embed
+
+
+_embedding_registry: dict[str, EmbeddingFunction] = {f"hashing-{HASHING_EMBEDDING_DIM}": hashing_embedding}
+_default_embedding_name: str | None = None
+
+
+def register_embedding_function(name: str, fn: EmbeddingFunction, make_default: bool = False):
+    """Registers a custom embedding function, e.g. a local model or a stub in tests."""
+    global _default_embedding_name
+    _embedding_registry[name] = fn
+    if make_default:
+        _default_embedding_name = name
+
+
+def get_default_embedding_name() -> str:
+    """The embedding used for new indexes: the registered default, else CONTEXT_EMBEDDING_MODEL via LiteLLM, else hashing."""
+    if _default_embedding_name:
+        return _default_embedding_name
+    model = os.environ.get("CONTEXT_EMBEDDING_MODEL")
+    return f"litellm:{model}" if model else f"hashing-{HASHING_EMBEDDING_DIM}"
+
+
+def resolve_embedding_function(name: str) -> EmbeddingFunction:
+    """Returns the embedding function an index was built with, so queries land in the same vector space."""
+    if name in _embedding_registry:
+        return _embedding_registry[name]
+    if name.startswith("litellm:"):
+        fn = _litellm_embedding_function(name.split(":", 1)[1])
+        _embedding_registry[name] = fn
+        return fn
+    raise ValueError(f"Unknown embedding function '{name}'.")
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+# --- Chunking ---
+def chunk_text(text: str, file_separator: str | None = None) -> list[dict]:
+    """
+    Splits text into overlapping windows. When `file_separator` is given (git repo blobs), chunks never
+    span two files and carry the file path (the first line of each file section) as their label.
+    Offsets are UTF-8 byte offsets so chunks can be fetched with ranged GCS reads.
+    """
+    sections = []
+    if file_separator and file_separator in text:
+        position = 0
+        for section in text.split(file_separator):
+            sections.append((position, section, section.split("\n", 1)[0][:200]))
+            position += len(section) + len(file_separator)
+    else:
+        sections.append((0, text, None))
+
+    chunks = []
+    step = RETRIEVAL_CHUNK_CHARS - RETRIEVAL_CHUNK_OVERLAP
+    # Chunk starts only move forward, so byte offsets are tracked incrementally instead of re-encoding the prefix.
+    last_char, last_byte = 0, 0
+    for section_start, section, label in sections:
+        for offset in range(0, max(len(section), 1), step):
+            window = section[offset:offset + RETRIEVAL_CHUNK_CHARS]
+            if not window.strip():
+                continue
+            char_start = section_start + offset
+            byte_start = last_byte + len(text[last_char:char_start].encode("utf-8"))
+            last_char, last_byte = char_start, byte_start
+            byte_end = byte_start + len(window.encode("utf-8"))
+            chunks.append({"start": byte_start, "end": byte_end, "label": label, "text": window})
+            if offset + RETRIEVAL_CHUNK_CHARS >= len(section):
+                break
+    return chunks
+
+
+# --- Index Build / Storage ---
+def build_retrieval_index(text: str, file_separator: str | None = None, embedding_name: str | None = None) -> tuple[np.ndarray, dict]:
+    """Chunks and embeds text, returning (row-normalized float32 matrix, metadata with chunk offsets)."""
+    embedding_name = embedding_name or get_default_embedding_name()
+    chunks = chunk_text(text, file_separator=file_separator)
+    matrix = _normalize_rows(resolve_embedding_function(embedding_name)([c["text"] for c in chunks]))
+    meta = {
+        "embedding": embedding_name,
+        "dim": int(matrix.shape[1]) if matrix.size else 0,
+        "chunks": [{"start": c["start"], "end": c["end"], "label": c["label"]} for c in chunks],
+    }
+    return matrix, meta
+
+
+def save_retrieval_index(bucket, blob_name: str, matrix: np.ndarray, meta: dict) -> dict:
+    """Stores the index next to its source blob as `<blob>.index.npy` and `<blob>.index.json`; returns the part reference."""
+    matrix_buffer = io.BytesIO()
+    np.save(matrix_buffer, matrix, allow_pickle=False)
+    matrix_blob = bucket.blob(f"{blob_name}.index.npy")
+    matrix_blob.upload_from_string(matrix_buffer.getvalue(), content_type="application/octet-stream")
+    meta_blob = bucket.blob(f"{blob_name}.index.json")
+    meta_blob.upload_from_string(json.dumps(meta), content_type="application/json")
+    return {
+        "matrix_uri": f"gs://{bucket.name}/{matrix_blob.name}",
+        "chunks_uri": f"gs://{bucket.name}/{meta_blob.name}",
+        "embedding": meta["embedding"],
+        "chunk_count": len(meta["chunks"]),
+    }
+
+
+_index_cache: "OrderedDict[str, tuple[np.ndarray, dict]]" = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def _split_gcs_uri(uri: str) -> tuple[str, str]:
+    bucket_name, blob_name = uri.split('/', 3)[2:]
+    return bucket_name, blob_name
+
+
+def load_retrieval_index(storage_client, index_ref: dict) -> tuple[np.ndarray, dict]:
+    """Loads an index from GCS through a small per-instance LRU cache."""
+    cache_key = index_ref["matrix_uri"]
+    with _index_cache_lock:
+        if cache_key in _index_cache:
+            _index_cache.move_to_end(cache_key)
+            return _index_cache[cache_key]
+
+    bucket_name, matrix_blob_name = _split_gcs_uri(index_ref["matrix_uri"])
+    matrix = np.load(io.BytesIO(storage_client.bucket(bucket_name).blob(matrix_blob_name).download_as_bytes()), allow_pickle=False)
+    bucket_name, meta_blob_name = _split_gcs_uri(index_ref["chunks_uri"])
+    meta = json.loads(storage_client.bucket(bucket_name).blob(meta_blob_name).download_as_text())
+
+    with _index_cache_lock:
+        _index_cache[cache_key] = (matrix, meta)
+        while len(_index_cache) > _INDEX_CACHE_MAX_ENTRIES:
+            _index_cache.popitem(last=False)
+    return matrix, meta
+
+
+# --- Query ---
+def top_k_chunk_indices(matrix: np.ndarray, query_vector: np.ndarray, k: int) -> list[int]:
+    """Cosine top-k over a row-normalized matrix, returned in document order."""
+    if matrix.size == 0:
+        return []
+    query = query_vector.astype(np.float32).ravel()
+    norm = np.linalg.norm(query)
+    if norm == 0:
+        return list(range(min(k, matrix.shape[0])))
+    scores = matrix @ (query / norm)
+    k = min(k, scores.shape[0])
+    top = np.argpartition(-scores, k - 1)[:k]
+    return sorted(int(i) for i in top)
+
+
+def retrieve_relevant_text(storage_client, blob, index_ref: dict, query: str, k: int = RETRIEVAL_TOP_K) -> str:
+    """
+    Returns the top-k chunks of `blob` most relevant to `query`, fetched with ranged reads and joined
+    in document order with their labels. Raises on any failure so callers can fall back to full content.
+    """
+    matrix, meta = load_retrieval_index(storage_client, index_ref)
+    query_vector = resolve_embedding_function(meta["embedding"])([query])[0]
+    selected = top_k_chunk_indices(matrix, query_vector, k)
+    pieces = []
+    for i in selected:
+        chunk = meta["chunks"][i]
+        # GCS ranged reads are end-inclusive.
+        text = blob.download_as_bytes(start=chunk["start"], end=chunk["end"] - 1).decode("utf-8", errors="ignore")
+        header = f"[{chunk['label']}]" if chunk.get("label") else f"[chunk {i + 1}/{len(meta['chunks'])}]"
+        pieces.append(f"{header}\n{text}")
+    logger.info(f"[Retrieval] Selected {len(selected)} of {len(meta['chunks'])} chunks for {blob.name}.")
+    return "\n\n...\n\n".join(pieces)
+
+
+__all__ = [
+    'RETRIEVAL_MIN_CHARS',
+    'RETRIEVAL_MODE',
+    'RETRIEVAL_TOP_K',
+    'EmbeddingFunction',
+    'hashing_embedding',
+    'register_embedding_function',
+    'get_default_embedding_name',
+    'resolve_embedding_function',
+    'chunk_text',
+    'build_retrieval_index',
+    'save_retrieval_index',
+    'load_retrieval_index',
+    'top_k_chunk_indices',
+    'retrieve_relevant_text',
+]
@@ -0,0 +1,240 @@
+# functions/common/text_extraction.py
+import re
+from html.parser import HTMLParser
+
+# Elements whose content is never useful as prompt context.
+_SKIPPED_TAGS = {
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe", "object", "embed",
+    "nav", "header", "footer", "aside", "form", "button", "select", "textarea", "dialog"
+}
+# ARIA roles and class/id fragments that typically mark navigation, banners, cookie notices, etc.
+_SKIPPED_ROLES = {"navigation", "banner", "contentinfo", "complementary", "search", "menu", "menubar", "dialog", "alert"}
+_BOILERPLATE_HINTS = re.compile(
+    r"(^|[\s_-])(nav|navbar|menu|sidebar|breadcrumbs?|cookie|consent|banner|footer|header|social|share|subscribe|newsletter|advert|ads?|popup|modal)($|[\s_-])",
+    re.IGNORECASE
+)
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+_BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "blockquote", "table", "tr", "ul", "ol", "dl", "dt", "dd",
+    "figure", "figcaption", "details", "summary", "address"
+}
+_HEADING_LEVELS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+# Skipped even without boilerplate filtering: these never hold readable text.
+_NON_TEXT_TAGS = {"script", "style", "noscript", "template", "svg", "canvas", "iframe", "object", "embed"}
+# When filtering keeps less than this share of a page's text (and the page has at least the minimum), the
+# filters most likely hit a wrapper around the content, and the unfiltered text is used instead.
+_MIN_FILTERED_TEXT_RATIO = 0.2
+_MIN_TEXT_FOR_FALLBACK = 500
+
+
+def _is_content_root(tag: str, attrs: dict) -> bool:
+    return tag in ("main", "article") or (attrs.get("role") or "").lower() == "main"
+
+
+class _ContentRootScanner(HTMLParser):
+    """
+    First pass: finds the elements enclosing a content root (`main`, `article`, `[role=main]`), identified by
+    start tag ordinal. Class/id hints are never applied to them, since site wrappers such as ReadTheDocs'
+    `wy-nav-content-wrap` or `page has-sidebar` often enclose the whole page body.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.content_ancestors: set[int] = set()
+        self._ordinal = 0
+        self._open: list[tuple[str, int]] = []
+
+    def handle_starttag(self, tag, attrs):
+        ordinal = self._ordinal
+        self._ordinal += 1
+        if _is_content_root(tag, dict(attrs)):
+            self.content_ancestors.update(open_ordinal for _, open_ordinal in self._open)
+        if tag not in _VOID_TAGS:
+            self._open.append((tag, ordinal))
+
+    def handle_startendtag(self, tag, attrs):
+        self._ordinal += 1
+        if _is_content_root(tag, dict(attrs)):
+            self.content_ancestors.update(open_ordinal for _, open_ordinal in self._open)
+
+    def handle_endtag(self, tag):
+        if any(open_tag == tag for open_tag, _ in self._open):
+            while self._open and self._open.pop()[0] != tag:
+                pass
+
+
+class _ReadableTextParser(HTMLParser):
+    """Collects readable text from HTML as lightweight markdown, dropping boilerplate elements."""
+
+    def __init__(self, content_ancestors: set[int] | None = None, filter_boilerplate: bool = True):
+        super().__init__(convert_charrefs=True)
+        self._content_ancestors = content_ancestors or set()
+        self._filter_boilerplate = filter_boilerplate
+        self._ordinal = 0  # Start tag ordinal, counted the same way as in _ContentRootScanner.
+        self.title = ""
+        self._in_title = False
+        self._skip_stack = []  # Tags that opened a skipped subtree; content is ignored while non-empty.
+        self._main_depth = 0  # >0 while inside <main> or <article>.
+        self._pre_depth = 0
+        self._all_blocks, self._main_blocks = [], []
+        self._current = []
+        self._current_in_main = False
+        self._li_marker_pending = False  # Set at <li> until its first block has been emitted with the "- " marker.
+
+    def _is_boilerplate(self, tag: str, attrs: dict, ordinal: int) -> bool:
+        if not self._filter_boilerplate:
+            return tag in _NON_TEXT_TAGS
+        if tag == "header" and self._main_depth > 0:
+            return False  # An article's own header usually carries its title.
+        if tag in _SKIPPED_TAGS:
+            return True
+        if attrs.get("hidden") is not None or attrs.get("aria-hidden") == "true":
+            return True
+        if (attrs.get("role") or "").lower() in _SKIPPED_ROLES:
+            return True
+        if ordinal in self._content_ancestors or _is_content_root(tag, attrs):
+            return False
+        hint_source = f"{attrs.get('id') or ''} {attrs.get('class') or ''}"
+        return bool(hint_source.strip()) and bool(_BOILERPLATE_HINTS.search(hint_source))
+
+    def _flush(self, prefix: str = ""):
+        text = "".join(self._current)
+        self._current = []
+        if self._pre_depth == 0:
+            text = re.sub(r"\s+", " ", text).strip()
+        elif not text.strip():
+            text = ""
+        if text:
+            if self._li_marker_pending and not prefix:
+                # The first block of a list item keeps the marker even when it is wrapped in <p> or <div>.
+                prefix = "- "
+            self._li_marker_pending = False
+            block = f"{prefix}{text}"
+            self._all_blocks.append(block)
+            if self._current_in_main:
+                self._main_blocks.append(block)
+        self._current_in_main = self._main_depth > 0
+
+    def handle_starttag(self, tag, attrs):
+        ordinal = self._ordinal
+        self._ordinal += 1
+        if self._skip_stack:
+            if tag not in _VOID_TAGS:
+                self._skip_stack.append(tag)
+            return
+        attrs = dict(attrs)
+        if tag == "title":
+            self._in_title = True
+            return
+        if tag not in _VOID_TAGS and tag not in ("html", "body", "main", "article") and self._is_boilerplate(tag, attrs, ordinal):
+            self._skip_stack.append(tag)
+            return
+        if tag in ("main", "article"):
+            self._flush()
+            self._main_depth += 1
+            self._current_in_main = True
+        elif tag in _HEADING_LEVELS or tag in _BLOCK_TAGS:
+            self._flush()
+        elif tag == "li":
+            self._flush()
+            self._li_marker_pending = True
+        elif tag == "br":
+            self._current.append("\n" if self._pre_depth else " ")
+        elif tag == "pre":
+            self._flush()
+            self._pre_depth += 1
+        elif tag in ("td", "th"):
+            self._current.append(" | ")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if self._skip_stack:
+            # Close the innermost matching open tag; tolerate unclosed children in sloppy markup.
+            if tag in self._skip_stack:
+                while self._skip_stack and self._skip_stack.pop() != tag:
+                    pass
+            return
+        if tag == "title":
+            self._in_title = False
+        elif tag in _HEADING_LEVELS:
+            self._flush(prefix="#" * _HEADING_LEVELS[tag] + " ")
+        elif tag == "li":
+            self._flush()
+            self._li_marker_pending = False
+        elif tag == "pre":
+            text = "".join(self._current).strip("\n")
+            self._current = []
+            if text.strip():
+                block = f"```\n{text}\n```"
+                self._all_blocks.append(block)
+                if self._main_depth > 0:
+                    self._main_blocks.append(block)
+            self._pre_depth = max(0, self._pre_depth - 1)
+        elif tag in ("main", "article"):
+            self._flush()
+            self._main_depth = max(0, self._main_depth - 1)
+            self._current_in_main = self._main_depth > 0
+        elif tag in _BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+            return
+        if self._skip_stack:
+            return
+        if not self._current:
+            self._current_in_main = self._main_depth > 0
+        self._current.append(data)
+
+    def result(self) -> tuple[str, list[str]]:
+        self._flush()
+        # Prefer the page's main content when the document marks it up explicitly.
+        blocks = self._main_blocks if sum(len(b) for b in self._main_blocks) > 200 else self._all_blocks
+        return re.sub(r"\s+", " ", self.title).strip(), blocks
+
+
+def _parse(html: str, parser: HTMLParser) -> HTMLParser:
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        # HTMLParser is lenient, but never let a malformed page fail the whole extraction.
+        pass
+    return parser
+
+
+def _join_blocks(blocks: list[str]) -> str:
+    # Drop consecutive duplicate blocks (repeated link lists, "Read more", etc.).
+    deduped = []
+    for block in blocks:
+        if not deduped or deduped[-1] != block:
+            deduped.append(block)
+    return "\n\n".join(deduped)
+
+
+def html_to_text(html: str, max_chars: int | None = None) -> str:
+    """
+    Converts an HTML document into readable markdown-style text, stripping scripts, styles,
+    navigation and other boilerplate. The result is truncated to `max_chars` if given.
+    """
+    scanner = _parse(html, _ContentRootScanner())
+    title, blocks = _parse(html, _ReadableTextParser(scanner.content_ancestors)).result()
+    text = _join_blocks(blocks)
+
+    _, unfiltered_blocks = _parse(html, _ReadableTextParser(filter_boilerplate=False)).result()
+    unfiltered_text = _join_blocks(unfiltered_blocks)
+    if len(unfiltered_text) >= _MIN_TEXT_FOR_FALLBACK and len(text) < _MIN_FILTERED_TEXT_RATIO * len(unfiltered_text):
+        text = unfiltered_text
+
+    if title and not text.startswith("# "):
+        text = f"# {title}\n\n{text}" if text else f"# {title}"
+
+    if max_chars is not None and len(text) > max_chars:
+        text = text[:max_chars].rstrip() + "\n... [PAGE CONTENT TRUNCATED]"
+    return text
+
+
+__all__ = ['html_to_text']
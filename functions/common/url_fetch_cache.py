@@ -0,0 +1,96 @@
+# functions/common/url_fetch_cache.py
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from .core import db, logger
+
+URL_FETCH_CACHE_COLLECTION = "urlFetchCache"
+URL_FETCH_CACHE_TTL_SECONDS = int(os.environ.get("URL_FETCH_CACHE_TTL_SECONDS", "3600"))
+_TRACKING_QUERY_PREFIXES = ("utm_",)
+_TRACKING_QUERY_KEYS = {"gclid", "fbclid", "mc_cid", "mc_eid"}
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalizes a URL for cache keying: lowercases scheme and host, drops default ports, fragments
+    and common tracking parameters, and sorts the remaining query parameters.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    netloc = host
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{parts.port}"
+    query_pairs = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in _TRACKING_QUERY_KEYS and not k.lower().startswith(_TRACKING_QUERY_PREFIXES)
+    ]
+    return urlunsplit((scheme, netloc, parts.path or "/", urlencode(sorted(query_pairs)), ""))
+
+
+def url_cache_key(normalized_url: str) -> str:
+    return hashlib.sha256(normalized_url.encode("utf-8")).hexdigest()
+
+
+def get_cached_fetch(normalized_url: str) -> dict | None:
+    """Returns the cache entry for a normalized URL, or None. Errors are logged and treated as a miss."""
+    try:
+        snap = db.collection(URL_FETCH_CACHE_COLLECTION).document(url_cache_key(normalized_url)).get()
+        return snap.to_dict() if snap.exists else None
+    except Exception as e:
+        logger.warn(f"[UrlFetchCache] Failed to read cache entry for {normalized_url}: {e}")
+        return None
+
+
+def is_cache_entry_fresh(entry: dict) -> bool:
+    fetched_at = entry.get("fetchedAt")
+    if not isinstance(fetched_at, datetime):
+        return False
+    return datetime.now(timezone.utc) - fetched_at < timedelta(seconds=URL_FETCH_CACHE_TTL_SECONDS)
+
+
+def conditional_request_headers(entry: dict | None) -> dict:
+    """Builds If-None-Match / If-Modified-Since headers from a stale cache entry."""
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("lastModified"):
+            headers["If-Modified-Since"] = entry["lastModified"]
+    return headers
+
+
+def store_cached_fetch(normalized_url: str, entry: dict):
+    """Writes (or replaces) the cache entry for a normalized URL. Failures never break the fetch."""
+    try:
+        db.collection(URL_FETCH_CACHE_COLLECTION).document(url_cache_key(normalized_url)).set({
+            **entry,
+            "normalizedUrl": normalized_url,
+            "fetchedAt": datetime.now(timezone.utc),
+        })
+    except Exception as e:
+        logger.warn(f"[UrlFetchCache] Failed to write cache entry for {normalized_url}: {e}")
+
+
+def mark_cache_entry_revalidated(normalized_url: str):
+    """Restarts the TTL window of an entry after the origin answered 304 Not Modified."""
+    try:
+        db.collection(URL_FETCH_CACHE_COLLECTION).document(url_cache_key(normalized_url)).update({
+            "fetchedAt": datetime.now(timezone.utc),
+        })
+    except Exception as e:
+        logger.warn(f"[UrlFetchCache] Failed to refresh cache entry for {normalized_url}: {e}")
+
+
+__all__ = [
+    'normalize_url',
+    'url_cache_key',
+    'get_cached_fetch',
+    'is_cache_entry_fresh',
+    'conditional_request_headers',
+    'store_cached_fetch',
+    'mark_cache_entry_revalidated',
+]
@@ -4,13 +4,63 @@ import base64
 import uuid
 import httpx
 import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import storage
-from google.cloud import firestore as gcf
 from google.cloud.firestore_v1 import SERVER_TIMESTAMP
 from pypdf import PdfReader
 
 from firebase_functions import https_fn
-from common.core import logger
+from common.core import db, logger
+from common.text_extraction import html_to_text
+from common.http_client import get_http_client, request_with_retry, stream_with_retry
+from common.retrieval import RETRIEVAL_MIN_CHARS, RETRIEVAL_MODE, build_retrieval_index, save_retrieval_index
+from common.url_fetch_cache import (
+    normalize_url, url_cache_key, get_cached_fetch, is_cache_entry_fresh,
+    conditional_request_headers, store_cached_fetch, mark_cache_entry_revalidated
+)
+
+
+# --- Context Bucket Helper ---
+_context_bucket = None
+
+def _get_context_bucket() -> storage.Bucket:
+    """Returns the context uploads bucket, creating it on first use. Cached for the lifetime of the instance."""
+    global _context_bucket
+    if _context_bucket is None:
+        from common.config import get_gcp_project_config
+        project_id, _, _ = get_gcp_project_config()
+        bucket_name = f"{project_id}-context-uploads"
+        storage_client = storage.Client()
+        bucket = storage_client.bucket(bucket_name)
+        if not bucket.exists():
+            logger.warn(f"Storage bucket '{bucket_name}' not found. Creating it with default settings.")
+            bucket = storage_client.create_bucket(bucket, location=os.environ.get("FUNCTION_REGION", "us-central1"))
+        _context_bucket = bucket
+    return _context_bucket
+
+
+# --- Ingestion Byte Budget ---
+class _ContextByteBudget:
+    """Thread-safe cap on the total bytes a single ingestion call may pull into memory."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._lock = threading.Lock()
+
+    def consume(self, num_bytes: int, label: str):
+        with self._lock:
+            if self.used_bytes + num_bytes > self.max_bytes:
+                raise https_fn.HttpsError(
+                    code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED,
+                    message=f"Byte budget of {self.max_bytes} bytes exceeded while processing {label}."
+                )
+            self.used_bytes += num_bytes
+
+    def remaining(self) -> int:
+        with self._lock:
+            return self.max_bytes - self.used_bytes
 
 
 # --- Generic GCS Uploader Helper ---
@@ -20,23 +70,18 @@ def _upload_bytes_to_gcs(
         file_name: str,
         mime_type: str,
         context_type: str,
-        make_public: bool = False
+        make_public: bool = False,
+        blob_path: str | None = None
 ):
-    """Uploads a byte string to GCS and returns a structured response."""
+    """Uploads a byte string to GCS and returns a structured response. Defaults to a unique path under the user's files."""
     logger.info(f"Uploading context file for user {user_id} to GCS: {file_name}, type: {context_type}, mimeType: {mime_type}")
-    from common.config import get_gcp_project_config
     try:
-        project_id, _, _ = get_gcp_project_config()
-        bucket_name = f"{project_id}-context-uploads"
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        if not bucket.exists():
-            logger.warn(f"Storage bucket '{bucket_name}' not found. Creating it with default settings.")
-            bucket = storage_client.create_bucket(bucket, location=os.environ.get("FUNCTION_REGION", "us-central1"))
+        bucket = _get_context_bucket()
 
-        _, file_extension = os.path.splitext(file_name)
-        unique_filename = f"{uuid.uuid4().hex}{file_extension}"
-        blob_path = f"users/{user_id}/files/{unique_filename}"
+        if not blob_path:
+            _, file_extension = os.path.splitext(file_name)
+            unique_filename = f"{uuid.uuid4().hex}{file_extension}"
+            blob_path = f"users/{user_id}/files/{unique_filename}"
         blob = bucket.blob(blob_path)
 
         blob.upload_from_string(file_bytes, content_type=mime_type)
@@ -65,31 +110,62 @@ def _upload_bytes_to_gcs(
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to upload context file: {e}")
 
 
+def _build_retrieval_index_fields(upload_result: dict, text: str, file_separator: str | None = None) -> dict | None:
+    """
+    Chunks, embeds and stores a retrieval index next to a large text context blob, returning the extra part
+    fields that point at it. Indexing is best-effort: on failure the context is simply stuffed in full.
+    """
+    if RETRIEVAL_MODE == "off" or len(text) < RETRIEVAL_MIN_CHARS:
+        return None
+    try:
+        blob_name = upload_result["storageUrl"].split('/', 3)[3]
+        matrix, meta = build_retrieval_index(text, file_separator=file_separator)
+        index_ref = save_retrieval_index(_get_context_bucket(), blob_name, matrix, meta)
+        logger.info(f"Built retrieval index with {index_ref['chunk_count']} chunks for {upload_result['storageUrl']}.")
+        return {"retrieval_index": index_ref}
+    except Exception as e:
+        logger.warn(f"Failed to build retrieval index for {upload_result.get('storageUrl')}: {e}")
+        return None
+
+
+def _context_message_data(
+        user_id: str,
+        parent_message_id: str,
+        file_uri: str,
+        mime_type: str,
+        preview_map: dict,
+        extra_part_fields: dict | None = None
+) -> dict:
+    """Builds the Firestore document for a 'context_stuffed' message."""
+    return {
+        "participant": "context_stuffed",
+        "parts": [{
+            "file_data": {
+                "file_uri": file_uri,
+                "mime_type": mime_type
+            },
+            "preview": preview_map,
+            **(extra_part_fields or {})
+        }],
+        "parentMessageId": parent_message_id,
+        "timestamp": SERVER_TIMESTAMP,
+        "createdBy": f"user:{user_id}"
+    }
+
+
 def _create_context_message(
         user_id: str,
         chat_id: str,
         parent_message_id: str,
         file_uri: str,
         mime_type: str,
-        preview_map: dict
+        preview_map: dict,
+        extra_part_fields: dict | None = None
 ) -> str:
     """Create a 'context_stuffed' message in Firestore and return its ID."""
     try:
-        db = gcf.Client()
         messages = db.collection("chats").document(chat_id).collection("messages")
-        data = {
-            "participant": "context_stuffed",
-            "parts": [{
-                "file_data": {
-                    "file_uri": file_uri,
-                    "mime_type": mime_type
-                },
-                "preview": preview_map
-            }],
-            "parentMessageId": parent_message_id,
-            "timestamp": SERVER_TIMESTAMP,
-            "createdBy": f"user:{user_id}"
-        }
+        data = _context_message_data(user_id, parent_message_id, file_uri, mime_type, preview_map, extra_part_fields)
         doc_ref = messages.document()
         doc_ref.set(data)
         logger.info(f"Created context message {doc_ref.id} in chat {chat_id}")
@@ -100,6 +176,139 @@ def _create_context_message(
 
 
 # --- Web Page Fetching ---
+MAX_WEB_PAGE_FETCH_BYTES = 10 * 1024 * 1024
+MAX_WEB_PAGE_TEXT_LENGTH = 200 * 1024
+HTML_MIME_TYPES = ("text/html", "application/xhtml+xml")
+# Fetched pages are anonymous public content, so cached copies are shared across users outside their file folders.
+WEB_PAGE_CACHE_PREFIX = "shared/webpages"
+
+def _context_result_from_cache(entry: dict) -> tuple[dict, dict, dict | None]:
+    upload_result = {
+        "success": True,
+        "name": entry.get("name"),
+        "storageUrl": entry["storageUrl"],
+        "type": "webpage",
+        "mimeType": entry["mimeType"],
+        "publicUrl": None,
+        "rawStorageUrl": entry.get("rawStorageUrl"),
+        "cached": True
+    }
+    extra_part_fields = {}
+    if entry.get("rawStorageUrl"):
+        extra_part_fields["raw_file_data"] = {"file_uri": entry["rawStorageUrl"], "mime_type": entry.get("rawMimeType")}
+    if entry.get("retrievalIndex"):
+        extra_part_fields["retrieval_index"] = entry["retrievalIndex"]
+    return upload_result, {"type": "text", "value": entry.get("previewText", "")}, extra_part_fields or None
+
+def _build_web_page_context(user_id: str, url: str, keep_raw: bool = False, budget: _ContextByteBudget | None = None) -> tuple[dict, dict, dict | None]:
+    """
+    Fetches a web page and stores its readable text in GCS, returning (upload_result, preview_map, extra_part_fields).
+    Repeat fetches of the same normalized URL are served from the URL fetch cache: within the TTL the stored
+    object is reused outright, after it the origin is revalidated with a conditional GET.
+    """
+    normalized_url = normalize_url(url)
+    cache_entry = get_cached_fetch(normalized_url)
+    if cache_entry and keep_raw and not cache_entry.get("rawStorageUrl"):
+        cache_entry = None  # The cached copy has no raw HTML, so it cannot satisfy this request.
+    if cache_entry and is_cache_entry_fresh(cache_entry):
+        logger.info(f"[WebPageCache] Fresh cache hit for {normalized_url}; skipping fetch and upload.")
+        return _context_result_from_cache(cache_entry)
+
+    try:
+        headers = {'User-Agent': 'AgentLab-ContextFetcher/1.0', **conditional_request_headers(cache_entry)}
+        logger.info(f"[_build_web_page_context] Fetching web page content from URL: {url}")
+        with stream_with_retry("GET", url, headers=headers, timeout=20.0, follow_redirects=True) as response:
+            if response.status_code == 304 and cache_entry:
+                logger.info(f"[WebPageCache] {normalized_url} not modified; reusing cached object.")
+                mark_cache_entry_revalidated(normalized_url)
+                return _context_result_from_cache(cache_entry)
+            response.raise_for_status()
+            body = bytearray()
+            for chunk in response.iter_bytes():
+                body.extend(chunk)
+                if budget:
+                    budget.consume(len(chunk), url)
+                if len(body) > MAX_WEB_PAGE_FETCH_BYTES:
+                    raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"Web page exceeds the {MAX_WEB_PAGE_FETCH_BYTES // (1024 * 1024)} MB fetch limit.")
+            raw_content_bytes = bytes(body)
+            encoding = response.charset_encoding or "utf-8"
+            mime_type = response.headers.get('Content-Type', 'text/plain; charset=utf-8').split(';')[0].strip().lower()
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+            cacheable = "no-store" not in response.headers.get("Cache-Control", "").lower()
+        file_name_from_url = url.rstrip('/').split('/')[-1] or "webpage.html"
+        logger.info(f"Fetched web page content from {url}, size: {len(raw_content_bytes)} bytes, mimeType: {mime_type}")
+    except httpx.HTTPError as err:
+        logger.error(f"Error fetching web page {url}: {err}")
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to fetch web page: {str(err)}")
+
+    # Cached objects live at fixed paths per URL, so a refetch overwrites the copy it replaces instead of leaving it
+    # behind; uncacheable pages go to the user's files as before.
+    object_prefix = f"{WEB_PAGE_CACHE_PREFIX}/{url_cache_key(normalized_url)}" if cacheable else None
+
+    # Only readable text goes into the prompt; markup, scripts and navigation are dropped before upload.
+    raw_upload_result = None
+    if mime_type in HTML_MIME_TYPES or mime_type.startswith("text/"):
+        decoded = raw_content_bytes.decode(encoding, errors='replace')
+        if mime_type in HTML_MIME_TYPES:
+            extracted_text = html_to_text(decoded, max_chars=MAX_WEB_PAGE_TEXT_LENGTH)
+            context_mime_type = "text/markdown"
+            context_file_name = f"{os.path.splitext(file_name_from_url)[0] or 'webpage'}.md"
+            if keep_raw:
+                raw_upload_result = _upload_bytes_to_gcs(
+                    user_id=user_id,
+                    file_bytes=raw_content_bytes,
+                    file_name=file_name_from_url,
+                    mime_type=mime_type,
+                    context_type='webpage_raw',
+                    make_public=False,
+                    blob_path=f"{object_prefix}/raw" if object_prefix else None
+                )
+        else:
+            extracted_text = decoded
+            if len(extracted_text) > MAX_WEB_PAGE_TEXT_LENGTH:
+                extracted_text = extracted_text[:MAX_WEB_PAGE_TEXT_LENGTH] + "\n... [PAGE CONTENT TRUNCATED]"
+            context_mime_type, context_file_name = mime_type, file_name_from_url
+        content_bytes = extracted_text.encode('utf-8')
+        preview_text = extracted_text[:1000]
+        indexable_text = extracted_text
+        logger.info(f"Reduced web page {url} from {len(raw_content_bytes)} to {len(content_bytes)} bytes of readable text.")
+    else:
+        content_bytes, context_mime_type, context_file_name = raw_content_bytes, mime_type, file_name_from_url
+        preview_text = ""
+        indexable_text = ""
+
+    upload_result = _upload_bytes_to_gcs(
+        user_id=user_id,
+        file_bytes=content_bytes,
+        file_name=context_file_name,
+        mime_type=context_mime_type,
+        context_type='webpage',
+        make_public=False,
+        blob_path=f"{object_prefix}/content" if object_prefix else None
+    )
+    upload_result["rawStorageUrl"] = raw_upload_result["storageUrl"] if raw_upload_result else None
+    extra_part_fields = _build_retrieval_index_fields(upload_result, indexable_text) or {}
+    if raw_upload_result:
+        # The raw copy is kept for reference only; the history builder reads `file_data` exclusively.
+        extra_part_fields["raw_file_data"] = {"file_uri": raw_upload_result["storageUrl"], "mime_type": raw_upload_result["mimeType"]}
+
+    if cacheable:
+        store_cached_fetch(normalized_url, {
+            "url": url,
+            "etag": etag,
+            "lastModified": last_modified,
+            "name": context_file_name,
+            "storageUrl": upload_result["storageUrl"],
+            "mimeType": context_mime_type,
+            "rawStorageUrl": upload_result["rawStorageUrl"],
+            "rawMimeType": mime_type if raw_upload_result else None,
+            "previewText": preview_text,
+            "contentLength": len(content_bytes),
+            "retrievalIndex": extra_part_fields.get("retrieval_index")
+        })
+
+    return upload_result, {"type": "text", "value": preview_text}, extra_part_fields or None
+
 def _fetch_web_page_content_logic(req: https_fn.CallableRequest):
     logger.info(f"[_fetch_web_page_content_logic] Function called with data keys: {list(req.data.keys()) if isinstance(req.data, dict) else 'Non-dict data'}")
     if not req.auth:
@@ -108,56 +317,29 @@ def _fetch_web_page_content_logic(req: https_fn.CallableRequest):
     url = req.data.get("url")
     chat_id = req.data.get("chatId")
     parent_message_id = req.data.get("parentMessageId")
+    keep_raw = bool(req.data.get("keepRaw", False))
     if not url:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="URL is required.")
     if not chat_id:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
 
-    try:
-        headers = {'User-Agent': 'AgentLab-ContextFetcher/1.0'}
-        logger.info(f"[_fetch_web_page_content_logic] Fetching web page content from URL: {url}")
-        with httpx.Client(timeout=20.0) as client:
-            response = client.get(url, headers=headers)
-            response.raise_for_status()
-            raw_content_bytes = response.content
-            mime_type = response.headers.get('Content-Type', 'text/plain; charset=utf-8').split(';')[0]
-            file_name_from_url = url.split('/')[-1] or "webpage.html"
-        logger.info(f"Fetched web page content from {url}, size: {len(raw_content_bytes)} bytes, mimeType: {mime_type}")
-
-        # Create a text preview (first 1000 chars)
-        try:
-            preview_text = raw_content_bytes.decode('utf-8', errors='ignore')[:1000]
-        except Exception:
-            preview_text = ""
-
-        upload_result = _upload_bytes_to_gcs(
-            user_id=req.auth.uid,
-            file_bytes=raw_content_bytes,
-            file_name=file_name_from_url,
-            mime_type=mime_type,
-            context_type='webpage',
-            make_public=False
-        )
-
-        preview_map = {"type": "text", "value": preview_text}
-        message_id = _create_context_message(
-            user_id=req.auth.uid,
-            chat_id=chat_id,
-            parent_message_id=parent_message_id,
-            file_uri=upload_result["storageUrl"],
-            mime_type=upload_result["mimeType"],
-            preview_map=preview_map
-        )
+    upload_result, preview_map, extra_part_fields = _build_web_page_context(req.auth.uid, url, keep_raw)
+    message_id = _create_context_message(
+        user_id=req.auth.uid,
+        chat_id=chat_id,
+        parent_message_id=parent_message_id,
+        file_uri=upload_result["storageUrl"],
+        mime_type=upload_result["mimeType"],
+        preview_map=preview_map,
+        extra_part_fields=extra_part_fields
+    )
 
-        return {
-            **upload_result,
-            "success": True,
-            "messageId": message_id,
-            "preview": preview_map
-        }
-    except httpx.RequestError as err:
-        logger.error(f"Error fetching web page {url}: {err}")
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to fetch web page: {str(err)}")
+    return {
+        **upload_result,
+        "success": True,
+        "messageId": message_id,
+        "preview": preview_map
+    }
 
 
 # --- Git Repository Fetching ---
@@ -173,7 +355,7 @@ def fetch_repo_file_content(session: httpx.Client, owner, repo, path, token, bra
         headers["Authorization"] = f"token {token}"
     file_url = f"{GITHUB_API_BASE}/repos/{owner}/{repo}/contents/{path}?ref={branch}"
     try:
-        response = session.get(file_url, headers=headers, timeout=15)
+        response = request_with_retry("GET", file_url, client=session, headers=headers, timeout=15)
         response.raise_for_status()
         return response.text
     except httpx.RequestError as e:
@@ -188,7 +370,7 @@ def list_repo_files_recursive(session: httpx.Client, owner, repo, path, token, i
     contents_url_path_part = f"/{path.strip('/')}" if path.strip('/') else ""
     contents_url = f"{GITHUB_API_BASE}/repos/{owner}/{repo}/contents{contents_url_path_part}?ref={branch}"
     try:
-        response = session.get(contents_url, headers=headers, timeout=20)
+        response = request_with_retry("GET", contents_url, client=session, headers=headers, timeout=20)
         response.raise_for_status()
         contents = response.json()
         if not isinstance(contents, list): return
@@ -213,25 +395,19 @@ def list_repo_files_recursive(session: httpx.Client, owner, repo, path, token, i
             return
         raise
 
-def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
-    if not req.auth:
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
-    data = req.data
+def _build_git_repo_context(user_id: str, data: dict, budget: _ContextByteBudget | None = None) -> tuple[dict, dict, dict | None]:
+    """Fetches the matching files of a GitHub repository into one text blob in GCS, returning (upload_result, preview_map, extra_part_fields)."""
     org_user, repo_name = data.get("orgUser"), data.get("repoName")
-    chat_id = data.get("chatId")
-    parent_message_id = data.get("parentMessageId")
     branch = data.get("branch") or "main"
     if not org_user or not repo_name:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Organization/User and Repository Name are required.")
-    if not chat_id:
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
 
     auth_token = data.get("gitToken") or get_github_token()
     files_to_fetch_meta, processed_paths = [], set()
     try:
-        with httpx.Client() as session:
-            directory = data.get('directory', "")
-            list_repo_files_recursive(session, org_user, repo_name, directory, auth_token, data.get("includeExt", []), data.get("excludeExt", []), files_to_fetch_meta, processed_paths, branch)
+        session = get_http_client()
+        directory = data.get('directory', "")
+        list_repo_files_recursive(session, org_user, repo_name, directory, auth_token, data.get("includeExt", []), data.get("excludeExt", []), files_to_fetch_meta, processed_paths, branch)
     except Exception as e_list:
         logger.error(f"Critical error during repo file listing for {org_user}/{repo_name} branch {branch}: {e_list}")
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to list repository files: {str(e_list)}")
@@ -241,11 +417,13 @@ def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
 
     content_chunks = []
     total_content_size, MAX_TOTAL_CONTENT_SIZE = 0, 5 * 1024 * 1024
-    with httpx.Client() as session:
-        fetched_contents = []
-        for file_meta in files_to_fetch_meta:
-            content = fetch_repo_file_content(session, org_user, repo_name, file_meta["path"], auth_token, branch)
-            fetched_contents.append(content)
+    session = get_http_client()
+    fetched_contents = []
+    for file_meta in files_to_fetch_meta:
+        content = fetch_repo_file_content(session, org_user, repo_name, file_meta["path"], auth_token, branch)
+        if content and budget:
+            budget.consume(len(content), f"{org_user}/{repo_name}")
+        fetched_contents.append(content)
 
     for i, content in enumerate(fetched_contents):
         file_meta = files_to_fetch_meta[i]
@@ -263,7 +441,7 @@ def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
     logger.info(f"Fetched {len(files_to_fetch_meta)} files from {org_user}/{repo_name} branch {branch}, total content size: {total_content_size} bytes.")
 
     upload_result = _upload_bytes_to_gcs(
-        user_id=req.auth.uid,
+        user_id=user_id,
         file_bytes=monolithic_content.encode('utf-8'),
         file_name=file_name,
         mime_type='text/plain',
@@ -277,15 +455,29 @@ def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
         preview_value = f"{len(files_to_fetch_meta)} files loaded from repository."
     else:
         preview_value = "\n".join([meta["path"] for meta in files_to_fetch_meta])
-    preview_map = {"type": "file_list", "value": preview_value}
+    index_fields = _build_retrieval_index_fields(upload_result, monolithic_content, file_separator=NEW_FILE_SEPARATOR)
+    return upload_result, {"type": "file_list", "value": preview_value}, index_fields
+
+def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
+    data = req.data
+    chat_id = data.get("chatId")
+    parent_message_id = data.get("parentMessageId")
+    if not data.get("orgUser") or not data.get("repoName"):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Organization/User and Repository Name are required.")
+    if not chat_id:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
 
+    upload_result, preview_map, extra_part_fields = _build_git_repo_context(req.auth.uid, data)
     message_id = _create_context_message(
         user_id=req.auth.uid,
         chat_id=chat_id,
         parent_message_id=parent_message_id,
         file_uri=upload_result["storageUrl"],
         mime_type=upload_result["mimeType"],
-        preview_map=preview_map
+        preview_map=preview_map,
+        extra_part_fields=extra_part_fields
     )
 
     return {
@@ -296,6 +488,60 @@ def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
     }
 
 # --- PDF Processing ---
+MAX_PDF_CONTENT_LENGTH = 2 * 1024 * 1024
+
+def _build_pdf_context(user_id: str, pdf_stream, pdf_source_name: str) -> tuple[dict, dict, dict | None]:
+    """
+    Extracts text from a seekable PDF stream, uploads it to GCS and returns (upload_result, preview_map, extra_part_fields).
+    The stream may be an in-memory buffer or a GCS BlobReader; PdfReader only pulls the byte ranges it needs.
+    """
+    try:
+        reader = PdfReader(pdf_stream)
+        text_content = "".join(page.extract_text() or "" for page in reader.pages)
+        if len(text_content) > MAX_PDF_CONTENT_LENGTH:
+            text_content = text_content[:MAX_PDF_CONTENT_LENGTH] + "\n... [PDF CONTENT TRUNCATED]"
+        logger.info(f"Extracted {len(text_content)} characters from PDF: {pdf_source_name}")
+
+        # Preview is first 1000 characters of extracted text
+        preview_text = (text_content or "")[:1000]
+
+        upload_result = _upload_bytes_to_gcs(
+            user_id=user_id,
+            file_bytes=text_content.encode('utf-8'),
+            file_name=f"{os.path.splitext(pdf_source_name)[0]}.txt",
+            mime_type='text/plain',
+            context_type='pdf',
+            make_public=False
+        )
+        index_fields = _build_retrieval_index_fields(upload_result, text_content)
+        return upload_result, {"type": "text", "value": preview_text}, index_fields
+    except https_fn.HttpsError:
+        raise
+    except Exception as e:
+        if "encrypted" in str(e).lower():
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.FAILED_PRECONDITION, message="PDF is encrypted and cannot be processed.")
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to process PDF: {str(e)}")
+
+def _fetch_pdf_bytes(url: str, budget: _ContextByteBudget | None = None) -> bytes:
+    """Streams a PDF into memory, charging the budget per chunk so an oversized file is abandoned early."""
+    try:
+        with stream_with_retry("GET", url, headers={'User-Agent': 'AgentLab-ContextFetcher/1.0'}, timeout=30, follow_redirects=True) as response:
+            response.raise_for_status()
+            content_length = response.headers.get("Content-Length", "")
+            if budget and content_length.isdigit() and int(content_length) > budget.remaining():
+                raise https_fn.HttpsError(
+                    code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED,
+                    message=f"{url} declares {content_length} bytes, more than the {budget.remaining()} left in the byte budget."
+                )
+            body = bytearray()
+            for chunk in response.iter_bytes():
+                if budget:
+                    budget.consume(len(chunk), url)
+                body.extend(chunk)
+    except httpx.RequestError as e:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to fetch PDF from URL: {str(e)}")
+    return bytes(body)
+
 def _process_pdf_content_logic(req: https_fn.CallableRequest):
     if not req.auth:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
@@ -308,14 +554,9 @@ def _process_pdf_content_logic(req: https_fn.CallableRequest):
     pdf_bytes, pdf_source_name = None, "Uploaded PDF"
     if url:
         pdf_source_name = url.split('/')[-1]
-        try:
-            with httpx.Client() as client:
-                response = client.get(url, headers={'User-Agent': 'AgentLab-ContextFetcher/1.0'}, timeout=30)
-                response.raise_for_status()
-                pdf_bytes = response.content
-        except httpx.RequestError as e:
-            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to fetch PDF from URL: {str(e)}")
+        pdf_bytes = _fetch_pdf_bytes(url)
     elif file_data_base64:
+        # Legacy inline path. New clients upload directly to GCS and call finalizeContextUpload instead.
         pdf_source_name = file_name_from_client or "Uploaded PDF"
         try:
             pdf_bytes = base64.b64decode(file_data_base64)
@@ -327,46 +568,23 @@ def _process_pdf_content_logic(req: https_fn.CallableRequest):
     if not pdf_bytes:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message="Could not load PDF data.")
 
-    try:
-        reader = PdfReader(io.BytesIO(pdf_bytes))
-        text_content = "".join(page.extract_text() or "" for page in reader.pages)
-        MAX_PDF_CONTENT_LENGTH = 2 * 1024 * 1024
-        if len(text_content) > MAX_PDF_CONTENT_LENGTH:
-            text_content = text_content[:MAX_PDF_CONTENT_LENGTH] + "\n... [PDF CONTENT TRUNCATED]"
-        logger.info(f"Extracted {len(text_content)} characters from PDF: {pdf_source_name}")
-
-        # Preview is first 1000 characters of extracted text
-        preview_text = (text_content or "")[:1000]
-
-        upload_result = _upload_bytes_to_gcs(
-            user_id=req.auth.uid,
-            file_bytes=text_content.encode('utf-8'),
-            file_name=f"{os.path.splitext(pdf_source_name)[0]}.txt",
-            mime_type='text/plain',
-            context_type='pdf',
-            make_public=False
-        )
-
-        preview_map = {"type": "text", "value": preview_text}
-        message_id = _create_context_message(
-            user_id=req.auth.uid,
-            chat_id=chat_id,
-            parent_message_id=parent_message_id,
-            file_uri=upload_result["storageUrl"],
-            mime_type=upload_result["mimeType"],
-            preview_map=preview_map
-        )
+    upload_result, preview_map, extra_part_fields = _build_pdf_context(req.auth.uid, io.BytesIO(pdf_bytes), pdf_source_name)
+    message_id = _create_context_message(
+        user_id=req.auth.uid,
+        chat_id=chat_id,
+        parent_message_id=parent_message_id,
+        file_uri=upload_result["storageUrl"],
+        mime_type=upload_result["mimeType"],
+        preview_map=preview_map,
+        extra_part_fields=extra_part_fields
+    )
 
-        return {
-            **upload_result,
-            "success": True,
-            "messageId": message_id,
-            "preview": preview_map
-        }
-    except Exception as e:
-        if "encrypted" in str(e).lower():
-            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.FAILED_PRECONDITION, message="PDF is encrypted and cannot be processed.")
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to process PDF: {str(e)}")
+    return {
+        **upload_result,
+        "success": True,
+        "messageId": message_id,
+        "preview": preview_map
+    }
 
 # --- Image Upload ---
 def _upload_image_and_get_uri_logic(req: https_fn.CallableRequest):
@@ -382,6 +600,7 @@ def _upload_image_and_get_uri_logic(req: https_fn.CallableRequest):
     if not chat_id:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
     try:
+        # Legacy inline path. New clients upload directly to GCS and call finalizeContextUpload instead.
         image_bytes = base64.b64decode(file_data_base64)
         upload_result = _upload_bytes_to_gcs(
             user_id=user_id,
@@ -413,10 +632,227 @@ def _upload_image_and_get_uri_logic(req: https_fn.CallableRequest):
         # The helper will raise the HttpsError as needed
         raise
 
+# --- Direct-to-GCS Uploads ---
+# Large files are uploaded by the browser straight into the context bucket through a resumable upload
+# session, then processed in place. This keeps file bytes out of the callable JSON body entirely.
+DIRECT_UPLOAD_PREFIX = "uploads"
+MAX_DIRECT_UPLOAD_SIZE = 100 * 1024 * 1024
+STREAMING_READ_CHUNK_SIZE = 1024 * 1024
+
+def _validate_direct_upload_type(context_type: str, mime_type: str):
+    if context_type == "pdf":
+        if mime_type != "application/pdf":
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="PDF uploads must have mimeType 'application/pdf'.")
+    elif context_type == "image":
+        if not mime_type.startswith("image/"):
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Image uploads must have an 'image/*' mimeType.")
+    else:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"Unsupported contextType for direct upload: {context_type}.")
+
+def _create_context_upload_session_logic(req: https_fn.CallableRequest):
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
+    data = req.data
+    file_name, mime_type, context_type = data.get("fileName"), data.get("mimeType"), data.get("contextType")
+    size = data.get("size")
+    if not all([file_name, mime_type, context_type]):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Missing required fields: fileName, mimeType, contextType.")
+    _validate_direct_upload_type(context_type, mime_type)
+    if size is not None and (not isinstance(size, int) or size <= 0 or size > MAX_DIRECT_UPLOAD_SIZE):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"File size must be between 1 byte and {MAX_DIRECT_UPLOAD_SIZE} bytes.")
+
+    user_id = req.auth.uid
+    _, file_extension = os.path.splitext(file_name)
+    blob_path = f"users/{user_id}/{DIRECT_UPLOAD_PREFIX}/{uuid.uuid4().hex}{file_extension}"
+    try:
+        bucket = _get_context_bucket()
+        blob = bucket.blob(blob_path)
+        # The browser PUTs to this session URI directly; the Origin is needed for the CORS response headers.
+        origin = req.raw_request.headers.get("Origin") if req.raw_request is not None else None
+        upload_url = blob.create_resumable_upload_session(content_type=mime_type, size=size, origin=origin)
+    except Exception as e:
+        logger.error(f"Failed to create resumable upload session for user {user_id}: {e}", exc_info=True)
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to create upload session: {e}")
+
+    logger.info(f"Created resumable upload session for user {user_id} at gs://{bucket.name}/{blob_path} ({context_type}).")
+    return {
+        "success": True,
+        "uploadUrl": upload_url,
+        "objectPath": blob_path,
+        "storageUrl": f"gs://{bucket.name}/{blob_path}"
+    }
+
+def _build_uploaded_file_context(user_id: str, object_path: str, context_type: str, file_name: str | None,
+                                 budget: _ContextByteBudget | None = None) -> tuple[dict, dict, dict | None]:
+    """Processes a file the browser already uploaded through a resumable session, returning (upload_result, preview_map, extra_part_fields)."""
+    if not object_path.startswith(f"users/{user_id}/{DIRECT_UPLOAD_PREFIX}/") or ".." in object_path:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.PERMISSION_DENIED, message="The upload does not belong to the current user.")
+
+    bucket = _get_context_bucket()
+    blob = bucket.get_blob(object_path)
+    if blob is None:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message="Uploaded file not found. The upload may not have completed.")
+    if blob.size and blob.size > MAX_DIRECT_UPLOAD_SIZE:
+        blob.delete()
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"Uploaded file exceeds {MAX_DIRECT_UPLOAD_SIZE} bytes.")
+    mime_type = blob.content_type or "application/octet-stream"
+    _validate_direct_upload_type(context_type, mime_type)
+    file_name = file_name or os.path.basename(object_path)
+    logger.info(f"Finalizing direct upload for user {user_id}: {object_path} ({context_type}, {blob.size} bytes).")
+
+    if context_type == "pdf":
+        if budget:
+            budget.consume(blob.size or 0, file_name)
+        with blob.open("rb", chunk_size=STREAMING_READ_CHUNK_SIZE) as pdf_stream:
+            upload_result, preview_map, extra_part_fields = _build_pdf_context(user_id, pdf_stream, file_name)
+        # Only the extracted text is used as context, so the source PDF is not kept.
+        try:
+            blob.delete()
+        except Exception as e:
+            logger.warn(f"Failed to delete source PDF {object_path} after extraction: {e}")
+        return upload_result, preview_map, extra_part_fields
+
+    # Images are referenced in place and never read by the function.
+    public_url = None
+    try:
+        blob.make_public()
+        public_url = blob.public_url
+    except Exception as e:
+        logger.warn(f"Failed to make blob public: {e}")
+    upload_result = {
+        "success": True,
+        "name": file_name,
+        "storageUrl": f"gs://{bucket.name}/{blob.name}",
+        "type": "image",
+        "mimeType": mime_type,
+        "publicUrl": public_url
+    }
+    return upload_result, {"type": "image_url", "value": public_url}, None
+
+def _finalize_context_upload_logic(req: https_fn.CallableRequest):
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
+    data = req.data
+    object_path, context_type, file_name = data.get("objectPath"), data.get("contextType"), data.get("fileName")
+    chat_id = data.get("chatId")
+    parent_message_id = data.get("parentMessageId")
+    user_id = req.auth.uid
+    if not object_path or not context_type:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Missing required fields: objectPath, contextType.")
+    if not chat_id:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
+
+    upload_result, preview_map, extra_part_fields = _build_uploaded_file_context(user_id, object_path, context_type, file_name)
+    message_id = _create_context_message(
+        user_id=user_id,
+        chat_id=chat_id,
+        parent_message_id=parent_message_id,
+        file_uri=upload_result["storageUrl"],
+        mime_type=upload_result["mimeType"],
+        preview_map=preview_map,
+        extra_part_fields=extra_part_fields
+    )
+
+    return {
+        **upload_result,
+        "success": True,
+        "messageId": message_id,
+        "preview": preview_map
+    }
+
+# --- Batch Ingestion ---
+MAX_BATCH_ITEMS = 20
+MAX_BATCH_TOTAL_BYTES = 25 * 1024 * 1024
+MAX_BATCH_WORKERS = 8
+
+def _build_batch_item_context(user_id: str, item: dict, budget: _ContextByteBudget) -> tuple[dict, dict, dict | None]:
+    """Dispatches one batch item to the matching single-item builder."""
+    item_type = item.get("type")
+    if item_type == "webpage":
+        if not item.get("url"):
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="URL is required.")
+        return _build_web_page_context(user_id, item["url"], bool(item.get("keepRaw", False)), budget=budget)
+    if item_type == "gitrepo":
+        return _build_git_repo_context(user_id, item, budget=budget)
+    if item_type in ("pdf", "image") and item.get("objectPath"):
+        return _build_uploaded_file_context(user_id, item["objectPath"], item_type, item.get("fileName"), budget=budget)
+    if item_type == "pdf" and item.get("url"):
+        url = item["url"]
+        pdf_bytes = _fetch_pdf_bytes(url, budget=budget)
+        return _build_pdf_context(user_id, io.BytesIO(pdf_bytes), url.split('/')[-1])
+    raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"Unsupported batch item: type '{item_type}' requires a url or objectPath.")
+
+def _ingest_context_batch_logic(req: https_fn.CallableRequest):
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
+    items = req.data.get("items")
+    chat_id = req.data.get("chatId")
+    parent_message_id = req.data.get("parentMessageId")
+    user_id = req.auth.uid
+    if not chat_id:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
+    if not isinstance(items, list) or not items:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="'items' must be a non-empty list.")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"At most {MAX_BATCH_ITEMS} items can be ingested per call.")
+
+    budget = _ContextByteBudget(MAX_BATCH_TOTAL_BYTES)
+
+    def process(index_and_item):
+        index, item = index_and_item
+        if not isinstance(item, dict):
+            return index, None, "Item must be an object."
+        try:
+            return index, _build_batch_item_context(user_id, item, budget), None
+        except https_fn.HttpsError as e:
+            return index, None, e.message
+        except Exception as e:
+            logger.error(f"[BatchIngest] Unexpected error on item {index} for user {user_id}: {e}", exc_info=True)
+            return index, None, f"Failed to process item: {e}"
+
+    with ThreadPoolExecutor(max_workers=min(MAX_BATCH_WORKERS, len(items))) as executor:
+        outcomes = sorted(executor.map(process, enumerate(items)), key=lambda outcome: outcome[0])
+
+    # Context messages are chained in input order, exactly as if each item had been attached one by one.
+    messages = db.collection("chats").document(chat_id).collection("messages")
+    batch = db.batch()
+    results, current_parent_id = [], parent_message_id
+    for index, built, error in outcomes:
+        item_type = items[index].get("type") if isinstance(items[index], dict) else None
+        if error:
+            results.append({"index": index, "type": item_type, "success": False, "error": error})
+            continue
+        upload_result, preview_map, extra_part_fields = built
+        doc_ref = messages.document()
+        batch.set(doc_ref, _context_message_data(
+            user_id, current_parent_id, upload_result["storageUrl"], upload_result["mimeType"], preview_map, extra_part_fields
+        ))
+        current_parent_id = doc_ref.id
+        results.append({**upload_result, "index": index, "type": item_type, "success": True, "messageId": doc_ref.id, "preview": preview_map})
+
+    succeeded = sum(1 for r in results if r["success"])
+    if succeeded:
+        try:
+            batch.commit()
+        except Exception as e:
+            logger.error(f"[BatchIngest] Failed to commit context messages for chat {chat_id}: {e}", exc_info=True)
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to create context messages: {e}")
+    logger.info(f"[BatchIngest] Ingested {succeeded}/{len(items)} items into chat {chat_id} using {budget.used_bytes} bytes of budget.")
+
+    return {
+        "success": succeeded > 0,
+        "results": results,
+        "lastMessageId": current_parent_id if succeeded else None,
+        "bytesProcessed": budget.used_bytes
+    }
+
 # This __all__ list makes the functions importable by main.py
 __all__ = [
     '_fetch_web_page_content_logic',
     '_fetch_git_repo_contents_logic',
     '_process_pdf_content_logic',
-    '_upload_image_and_get_uri_logic'
-]
\ No newline at end of file
+    '_upload_image_and_get_uri_logic',
+    '_create_context_upload_session_logic',
+    '_finalize_context_upload_logic',
+    '_ingest_context_batch_logic'
+]
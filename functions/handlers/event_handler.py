@@ -0,0 +1,88 @@
+# functions/handlers/event_handler.py
+import asyncio
+import base64
+from firebase_functions import https_fn
+from common.core import db, logger
+from common.adk_helpers import get_adk_artifact_service
+from handlers.vertex.task.event_writer import OFFLOADABLE_EVENT_FIELDS, load_event_payload
+from handlers.vertex.task.session_service import ADK_SESSION_APP_NAME, SESSION_SEGMENTS_SUBCOLLECTION
+
+
+def _get_event_payload_logic(req: https_fn.CallableRequest):
+    """Returns the full payload of an event field that was offloaded to GCS because it was too large for Firestore."""
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
+    data = req.data
+    chat_id, message_id, event_id, field = data.get("chatId"), data.get("messageId"), data.get("eventId"), data.get("field")
+    if not chat_id or not message_id or not event_id:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId, messageId and eventId are required.")
+    if field not in OFFLOADABLE_EVENT_FIELDS:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"field must be one of {list(OFFLOADABLE_EVENT_FIELDS)}.")
+
+    event_snap = (db.collection("chats").document(chat_id).collection("messages").document(message_id)
+                  .collection("events").document(event_id).get())
+    if not event_snap.exists:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message="Event not found.")
+
+    # Only URIs recorded on the event itself are served, so callers cannot read arbitrary objects.
+    payload_ref = (event_snap.to_dict().get("offloadedPayloads") or {}).get(field)
+    if not payload_ref or not payload_ref.get("uri"):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message=f"Event field '{field}' was not offloaded.")
+
+    try:
+        payload = load_event_payload(payload_ref["uri"])
+    except Exception as e:
+        logger.error(f"Failed to load offloaded payload {payload_ref['uri']}: {e}")
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message="Failed to load the full event payload.")
+    return {"success": True, "field": field, "payload": payload}
+
+
+def _get_event_artifact_logic(req: https_fn.CallableRequest):
+    """Loads an artifact version referenced by an event's `actions.artifact_delta` from the chat's artifact store."""
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
+    data = req.data
+    chat_id, message_id, event_id, filename = data.get("chatId"), data.get("messageId"), data.get("eventId"), data.get("filename")
+    if not chat_id or not message_id or not event_id or not filename:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId, messageId, eventId and filename are required.")
+
+    chat_ref = db.collection("chats").document(chat_id)
+    event_snap = chat_ref.collection("messages").document(message_id).collection("events").document(event_id).get()
+    if not event_snap.exists:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message="Event not found.")
+    event = event_snap.to_dict()
+    actions = event.get("actions") or {}
+    offloaded_actions = (event.get("offloadedPayloads") or {}).get("actions")
+    if offloaded_actions and offloaded_actions.get("uri"):
+        actions = load_event_payload(offloaded_actions["uri"]) or {}
+
+    # Only artifact versions recorded on the event are served.
+    version = (actions.get("artifact_delta") or {}).get(filename)
+    if version is None:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message=f"Event has no artifact '{filename}'.")
+    session_snap = chat_ref.collection(SESSION_SEGMENTS_SUBCOLLECTION).document(message_id).get()
+    if not session_snap.exists:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message="The run that produced this artifact has no session.")
+
+    async def load_artifact():
+        artifact_service = (await get_adk_artifact_service()).scoped(chat_id)
+        return await artifact_service.load_artifact(
+            app_name=ADK_SESSION_APP_NAME, user_id=session_snap.to_dict().get("userId"),
+            session_id=message_id, filename=filename, version=int(version)
+        )
+
+    try:
+        part = asyncio.run(load_artifact())
+    except Exception as e:
+        logger.error(f"Failed to load artifact '{filename}' v{version} of chat {chat_id}: {e}")
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message="Failed to load the artifact.")
+    if part is None:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message=f"Artifact '{filename}' v{version} not found.")
+
+    if part.inline_data is not None:
+        return {"success": True, "filename": filename, "version": int(version), "mimeType": part.inline_data.mime_type,
+                "data": base64.b64encode(part.inline_data.data or b"").decode("ascii")}
+    return {"success": True, "filename": filename, "version": int(version), "mimeType": "text/plain", "text": part.text or ""}
+
+
+__all__ = ['_get_event_payload_logic', '_get_event_artifact_logic']
@@ -73,7 +73,9 @@ async def _list_mcp_server_tools_logic_async(req: https_fn.CallableRequest):
                         "name": tool_obj.name,
                         "description": tool_obj.description,
                         "title": get_display_name(tool_obj), # Use get_display_name here
-                        "input_schema": tool_obj.inputSchema
+                        "input_schema": tool_obj.inputSchema,
+                        # Read-only tools are memoized by default when selected for an agent.
+                        "readOnly": bool(tool_obj.annotations and tool_obj.annotations.readOnlyHint)
                     })
                 logger.info(f"Successfully listed {len(tools_for_client)} tools from MCP server: {server_url}")
                 return {"success": True, "tools": tools_for_client, "serverUrl": server_url}
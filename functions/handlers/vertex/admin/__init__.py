@@ -9,14 +9,17 @@ from google.cloud.aiplatform_v1beta1 import ReasoningEngineServiceClient
 from google.cloud.aiplatform_v1beta1.types import ReasoningEngine as ReasoningEngineProto
 from vertexai import agent_engines as deployed_agent_engines
 import os
+import cloudpickle
 
 from common.core import db, logger
 from common.config import get_gcp_project_config
 from common.utils import initialize_vertex_ai
-from common.adk_helpers import generate_vertex_deployment_display_name
+from common.adk_helpers import generate_vertex_deployment_display_name, invalidate_remote_agent_engine
 # UPDATED IMPORT: Pointing to the new refactored agent builder
 from common.agents import instantiate_adk_agent_from_config
-from common.agents.llm_config import BACKEND_LITELLM_PROVIDER_CONFIG
+from common.agents.llm_config import BACKEND_LITELLM_PROVIDER_CONFIG, deploy_build_scope
+from common.agents import mcp_preconnect, tool_memoization
+from ..orchestrator.scheduling import RUN_CLASS_DEPLOY, admit_run
 
 
 # --- Deployment Logic ---
@@ -28,6 +31,10 @@ def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest):
     if not agent_config_data or not agent_doc_id:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Agent config (agentConfig) and Firestore document ID (agentDocId) are required.")
 
+    if req.auth:
+        # Deploys run inside this callable, so they are only rate-limited per user, never queued.
+        admit_run(req.auth.uid, RUN_CLASS_DEPLOY)
+
     original_config_name = agent_config_data.get('name', 'N/A')
     logger.info(f"Initiating deployment for agent '{agent_doc_id}'. Config name: '{original_config_name}'")
 
@@ -45,10 +52,11 @@ def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest):
     initialize_vertex_ai()
 
     try:
-        adk_agent = asyncio.run(instantiate_adk_agent_from_config(
-            agent_config_data,
-            parent_adk_name_for_context=f"root_{agent_doc_id[:4]}"
-        ))
+        with deploy_build_scope():
+            adk_agent = asyncio.run(instantiate_adk_agent_from_config(
+                agent_config_data,
+                parent_adk_name_for_context=f"root_{agent_doc_id[:4]}"
+            ))
         logger.info(f"Root ADK Agent object '{adk_agent.name}' of type {type(adk_agent).__name__} prepared for deployment.")
     except ValueError as e_instantiate:
         error_msg = f"Failed to instantiate agent hierarchy for '{agent_doc_id}' (Original Name: '{original_config_name}'): {str(e_instantiate)}"
@@ -99,6 +107,11 @@ def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest):
 
     logger.info(f"Attempting to deploy ADK agent '{adk_agent.name}' to Vertex AI with display_name: '{deployment_display_name}'. Requirements: {requirements_list}. Environment Variables for Vertex: {list(vertex_env_vars.keys())}")
 
+    # The agent's tool memo callbacks and MCP toolset wrappers live in this codebase, which Agent Engine doesn't
+    # install; ship them by value.
+    cloudpickle.register_pickle_by_value(tool_memoization)
+    cloudpickle.register_pickle_by_value(mcp_preconnect)
+
     try:
         remote_app = deployed_agent_engines.create(
             agent_engine=adk_agent,
@@ -137,6 +150,7 @@ def _delete_vertex_agent_logic(req: https_fn.CallableRequest):
     logger.info(f"Attempting to delete Vertex AI agent '{resource_name}' (FS doc: '{agent_doc_id}').")
     initialize_vertex_ai()
 
+    invalidate_remote_agent_engine(resource_name)
     try:
         try:
             agent_to_delete = deployed_agent_engines.get(resource_name)
@@ -199,6 +213,7 @@ def _check_vertex_agent_deployment_status_logic(req: https_fn.CallableRequest):
             except Exception as e:
                 logger.info(f"Failed to get engine by stored resource_name '{current_stored_resource_name}': {e}.")
                 if "NotFound" in str(e):
+                    invalidate_remote_agent_engine(current_stored_resource_name)
                     agent_doc_ref.update({"vertexAiResourceName": firestore.DELETE_FIELD, "deploymentStatus": "error_resource_vanished"})
                     current_stored_resource_name = None
 
@@ -209,6 +224,7 @@ def _check_vertex_agent_deployment_status_logic(req: https_fn.CallableRequest):
             if engine_list_results:
                 found_engine_proto = engine_list_results[0]
                 if current_stored_resource_name != found_engine_proto.name:
+                    if current_stored_resource_name: invalidate_remote_agent_engine(current_stored_resource_name)
                     agent_doc_ref.update({"vertexAiResourceName": found_engine_proto.name})
 
         firestore_update_payload = {"lastStatusCheckAt": firestore.SERVER_TIMESTAMP}
@@ -233,6 +249,8 @@ def _check_vertex_agent_deployment_status_logic(req: https_fn.CallableRequest):
                 firestore_update_payload["deploymentError"] = error_details[:1000]
             else:
                 final_status_to_report = f"unknown_vertex_state_{current_engine_vertex_state.name.lower()}"
+            if final_status_to_report != "deployed":
+                invalidate_remote_agent_engine(found_engine_proto.name)
             firestore_update_payload["deploymentStatus"] = final_status_to_report
         else:
             current_fs_status = agent_data.get("deploymentStatus")
@@ -240,6 +258,7 @@ def _check_vertex_agent_deployment_status_logic(req: https_fn.CallableRequest):
                 final_status_to_report = "error_resource_vanished"
             firestore_update_payload["deploymentStatus"] = final_status_to_report
             firestore_update_payload["vertexAiResourceName"] = firestore.DELETE_FIELD
+            if current_stored_resource_name: invalidate_remote_agent_engine(current_stored_resource_name)
 
         agent_doc_ref.update(firestore_update_payload)
         return {"success": True, "status": final_status_to_report, "resourceName": vertex_resource_name, "vertexState": vertex_state}
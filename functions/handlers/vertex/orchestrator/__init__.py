@@ -1,18 +1,16 @@
 # functions/handlers/vertex/orchestrator/__init__.py
-import json
-from google.cloud import tasks_v2
-
 from firebase_admin import firestore
 from firebase_functions import https_fn
 
 from common.core import db, logger
-from common.config import get_gcp_project_config
 from common.utils import initialize_vertex_ai
+from .scheduling import classify_run, admit_run
+from .dispatcher import dispatch_agent_run
 
 def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
     """
     IMMEDIATE RESPONSE: Validates request, creates a placeholder message in Firestore (and a user message if content is provided),
-    enqueues a Cloud Task, and returns the new assistant messageId.
+    dispatches the run (Cloud Tasks by default, see dispatcher.py), and returns the new assistant messageId.
     """
     data = req.data
     agent_id = data.get("agentId")
@@ -34,7 +32,11 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Either agentId or modelId must be provided.")
 
     initialize_vertex_ai()
-    project_id, location, _ = get_gcp_project_config()
+
+    # Admission happens before any message is created, so a rejected run leaves no placeholder behind.
+    participant_config = db.collection("agents").document(agent_id).get().to_dict() if agent_id else None
+    run_class = classify_run(data.get("runClass"), participant_config)
+    admission_delay_seconds = admit_run(firebase_auth_uid, run_class)
 
     batch = db.batch()
     chat_ref = db.collection("chats").document(chat_id)
@@ -88,6 +90,7 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
         "parentMessageId": effective_parent_id,
         "childMessageIds": [],
         "parts": [],
+        "runClass": run_class,
         "timestamp": firestore.SERVER_TIMESTAMP,
     }
     batch.set(assistant_message_ref, assistant_message_data)
@@ -101,9 +104,6 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
     logger.info(f"[Orchestrator] Created placeholder assistant message {assistant_message_id} for chat {chat_id}.")
 
     try:
-        tasks_client = tasks_v2.CloudTasksClient()
-        queue_path = tasks_client.queue_path(project_id, location, "executeAgentRunTask") # lowercase for queue name
-
         task_payload = {
             "chatId": chat_id,
             "assistantMessageId": assistant_message_id,
@@ -112,17 +112,8 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
             "adkUserId": adk_user_id,
             "firebaseAuthUid": firebase_auth_uid,
         }
-
-        task = {
-            "http_request": {
-                "http_method": tasks_v2.HttpMethod.POST,
-                "url": f"https://{location}-{project_id}.cloudfunctions.net/executeAgentRunTask",
-                "headers": {"Content-type": "application/json"},
-                "body": json.dumps({"data": task_payload}).encode(),
-            }
-        }
-        tasks_client.create_task(parent=queue_path, task=task)
-        logger.info(f"[Orchestrator] Enqueued task for assistantMessageId: {assistant_message_id}")
+        dispatch_agent_run(task_payload, run_class, admission_delay_seconds)
+        logger.info(f"[Orchestrator] Dispatched {run_class} run for assistantMessageId: {assistant_message_id} (delay {admission_delay_seconds:.1f}s)")
 
     except Exception as e:
         logger.error(f"[Orchestrator] CRITICAL: Failed to enqueue task for message {assistant_message_id}: {e}")
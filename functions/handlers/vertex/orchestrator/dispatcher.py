@@ -0,0 +1,143 @@
+# functions/handlers/vertex/orchestrator/dispatcher.py
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from google.cloud import tasks_v2
+from google.protobuf import timestamp_pb2
+
+from common.core import logger
+from common.config import get_gcp_project_config
+from .scheduling import (
+    RUN_CLASS_TASK_FUNCTIONS, RUN_CLASS_BATCH,
+    INTERACTIVE_MAX_CONCURRENT_DISPATCHES, BATCH_MAX_CONCURRENT_DISPATCHES
+)
+
+# --- Dispatch Modes ---
+# "cloud_tasks": HTTP task on the run class's Cloud Tasks queue (production default).
+# "task_queue":  Firebase Admin SDK task queue; honours CLOUD_TASKS_EMULATOR_HOST, so it works in the emulator suite.
+# "inline":      runs the task on a bounded thread pool inside the calling instance (self-hosted / dev). It skips the
+#                dispatch hop, but the instance must keep CPU allocated after responding for the run to progress.
+DISPATCH_MODE_CLOUD_TASKS = "cloud_tasks"
+DISPATCH_MODE_TASK_QUEUE = "task_queue"
+DISPATCH_MODE_INLINE = "inline"
+INLINE_RETRY_MIN_BACKOFF_SECONDS = 10
+
+
+class CloudTasksDispatcher:
+    """Creates an HTTP task targeting the run class's task function."""
+
+    def __init__(self):
+        self._client = tasks_v2.CloudTasksClient()
+
+    def dispatch(self, task_payload: dict, run_class: str, delay_seconds: float = 0.0):
+        project_id, location, _ = get_gcp_project_config()
+        task_function_name = RUN_CLASS_TASK_FUNCTIONS[run_class]
+        queue_path = self._client.queue_path(project_id, location, task_function_name)
+        task = {
+            "http_request": {
+                "http_method": tasks_v2.HttpMethod.POST,
+                "url": f"https://{location}-{project_id}.cloudfunctions.net/{task_function_name}",
+                "headers": {"Content-type": "application/json"},
+                "body": json.dumps({"data": task_payload}).encode(),
+            }
+        }
+        if delay_seconds > 0:
+            schedule_time = timestamp_pb2.Timestamp()
+            schedule_time.FromDatetime(datetime.now(timezone.utc) + timedelta(seconds=delay_seconds))
+            task["schedule_time"] = schedule_time
+        self._client.create_task(parent=queue_path, task=task)
+
+
+class TaskQueueDispatcher:
+    """Enqueues through the Firebase Admin SDK task queue API, which the Functions emulator also serves."""
+
+    def dispatch(self, task_payload: dict, run_class: str, delay_seconds: float = 0.0):
+        from firebase_admin import functions
+        _, location, _ = get_gcp_project_config()
+        queue = functions.task_queue(f"locations/{location}/functions/{RUN_CLASS_TASK_FUNCTIONS[run_class]}")
+        options = functions.TaskOptions(schedule_delay_seconds=int(delay_seconds)) if delay_seconds > 0 else None
+        queue.enqueue(task_payload, options)
+
+
+class InlineDispatcher:
+    """
+    Runs tasks on per-class bounded thread pools in this instance, with the same concurrency limits,
+    admission delay and retry count as the Cloud Tasks queues.
+    """
+
+    def __init__(self):
+        self._executors = {
+            run_class: ThreadPoolExecutor(
+                max_workers=BATCH_MAX_CONCURRENT_DISPATCHES if run_class == RUN_CLASS_BATCH else INTERACTIVE_MAX_CONCURRENT_DISPATCHES,
+                thread_name_prefix=f"agent-run-{run_class}"
+            )
+            for run_class in RUN_CLASS_TASK_FUNCTIONS
+        }
+
+    @staticmethod
+    def _run(task_payload: dict, delay_seconds: float):
+        from handlers.vertex.task import run_agent_task_wrapper
+        from handlers.vertex.task.run_ledger import MAX_RUN_ATTEMPTS
+        if delay_seconds > 0:
+            time.sleep(delay_seconds)
+        for attempt in range(1, MAX_RUN_ATTEMPTS + 1):
+            try:
+                run_agent_task_wrapper(task_payload)
+                return
+            except Exception as e:
+                if attempt == MAX_RUN_ATTEMPTS:
+                    logger.error(f"[Dispatcher] Inline run for {task_payload.get('assistantMessageId')} failed after {attempt} attempts: {e}")
+                    return
+                logger.warn(f"[Dispatcher] Inline run attempt {attempt} failed ({e}); retrying.")
+                time.sleep(INLINE_RETRY_MIN_BACKOFF_SECONDS * (2 ** (attempt - 1)))
+
+    def dispatch(self, task_payload: dict, run_class: str, delay_seconds: float = 0.0):
+        self._executors[run_class].submit(self._run, task_payload, delay_seconds)
+
+
+_DISPATCHERS = {
+    DISPATCH_MODE_CLOUD_TASKS: CloudTasksDispatcher,
+    DISPATCH_MODE_TASK_QUEUE: TaskQueueDispatcher,
+    DISPATCH_MODE_INLINE: InlineDispatcher,
+}
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatch_mode() -> str:
+    """AGENT_RUN_DISPATCH_MODE if set; otherwise the task queue API under the emulator and Cloud Tasks elsewhere."""
+    mode = os.environ.get("AGENT_RUN_DISPATCH_MODE")
+    if mode:
+        return mode.lower()
+    return DISPATCH_MODE_TASK_QUEUE if os.environ.get("FUNCTIONS_EMULATOR") == "true" else DISPATCH_MODE_CLOUD_TASKS
+
+
+def get_agent_run_dispatcher():
+    """Returns the per-instance dispatcher for the configured mode."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                mode = get_dispatch_mode()
+                if mode not in _DISPATCHERS:
+                    raise ValueError(f"Unknown AGENT_RUN_DISPATCH_MODE '{mode}'. Expected one of {list(_DISPATCHERS)}.")
+                _dispatcher = _DISPATCHERS[mode]()
+                logger.info(f"[Dispatcher] Using '{mode}' dispatch mode for agent runs.")
+    return _dispatcher
+
+
+def dispatch_agent_run(task_payload: dict, run_class: str, delay_seconds: float = 0.0):
+    get_agent_run_dispatcher().dispatch(task_payload, run_class, delay_seconds)
+
+
+__all__ = [
+    'DISPATCH_MODE_CLOUD_TASKS',
+    'DISPATCH_MODE_TASK_QUEUE',
+    'DISPATCH_MODE_INLINE',
+    'get_dispatch_mode',
+    'get_agent_run_dispatcher',
+    'dispatch_agent_run',
+]
@@ -0,0 +1,112 @@
+# functions/handlers/vertex/orchestrator/scheduling.py
+import os
+from datetime import datetime, timezone
+from firebase_admin import firestore
+from firebase_functions import https_fn
+
+from common.core import db, logger
+
+# --- Run Classes ---
+RUN_CLASS_INTERACTIVE = "interactive"
+RUN_CLASS_BATCH = "batch"
+RUN_CLASS_DEPLOY = "deploy"
+# Multi-agent workflows fan out into many model calls, so they never compete with interactive chat turns.
+BATCH_AGENT_TYPES = {"ParallelAgent", "LoopAgent"}
+
+# Each class that runs through Cloud Tasks has its own task function, and therefore its own queue and
+# concurrency limit (see main.py). Deploys run inside their callable and are only rate-limited.
+RUN_CLASS_TASK_FUNCTIONS = {
+    RUN_CLASS_INTERACTIVE: "executeAgentRunTask",
+    RUN_CLASS_BATCH: "executeBatchAgentRunTask",
+}
+INTERACTIVE_MAX_CONCURRENT_DISPATCHES = 10
+BATCH_MAX_CONCURRENT_DISPATCHES = 4
+
+
+def _bucket_setting(run_class: str, name: str, default: float) -> float:
+    return float(os.environ.get(f"RUN_ADMISSION_{run_class.upper()}_{name}", default))
+
+
+# Per-user token buckets: `capacity` is the burst size, `refill_per_second` the sustained rate, and
+# `max_delay_seconds` how far into the future a run may be scheduled before it is rejected outright.
+RUN_ADMISSION_BUCKETS = {
+    RUN_CLASS_INTERACTIVE: {
+        "capacity": _bucket_setting(RUN_CLASS_INTERACTIVE, "CAPACITY", 20),
+        "refill_per_second": _bucket_setting(RUN_CLASS_INTERACTIVE, "REFILL_PER_SECOND", 0.5),
+        "max_delay_seconds": _bucket_setting(RUN_CLASS_INTERACTIVE, "MAX_DELAY_SECONDS", 10),
+    },
+    RUN_CLASS_BATCH: {
+        "capacity": _bucket_setting(RUN_CLASS_BATCH, "CAPACITY", 10),
+        "refill_per_second": _bucket_setting(RUN_CLASS_BATCH, "REFILL_PER_SECOND", 0.1),
+        "max_delay_seconds": _bucket_setting(RUN_CLASS_BATCH, "MAX_DELAY_SECONDS", 1800),
+    },
+    RUN_CLASS_DEPLOY: {
+        "capacity": _bucket_setting(RUN_CLASS_DEPLOY, "CAPACITY", 3),
+        "refill_per_second": _bucket_setting(RUN_CLASS_DEPLOY, "REFILL_PER_SECOND", 1 / 300),
+        "max_delay_seconds": _bucket_setting(RUN_CLASS_DEPLOY, "MAX_DELAY_SECONDS", 0),
+    },
+}
+RUN_ADMISSION_COLLECTION = "runAdmission"
+
+
+def classify_run(requested_class: str | None, participant_config: dict | None) -> str:
+    """
+    Classifies a chat run as interactive or batch. Clients may ask for batch, but cannot make a
+    multi-agent workflow interactive.
+    """
+    if participant_config and participant_config.get("agentType") in BATCH_AGENT_TYPES:
+        return RUN_CLASS_BATCH
+    if requested_class == RUN_CLASS_BATCH:
+        return RUN_CLASS_BATCH
+    return RUN_CLASS_INTERACTIVE
+
+
+def admit_run(user_id: str, run_class: str) -> float:
+    """
+    Takes one token from the user's bucket for `run_class` and returns how many seconds the run should be
+    delayed (0 when a token was available). Tokens may go negative up to the class's maximum delay, which
+    reserves a later slot for the run; beyond that the request is rejected with RESOURCE_EXHAUSTED.
+    """
+    bucket = RUN_ADMISSION_BUCKETS[run_class]
+    bucket_ref = db.collection(RUN_ADMISSION_COLLECTION).document(f"{user_id}_{run_class}")
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def take_token(transaction) -> float:
+        snap = bucket_ref.get(transaction=transaction)
+        now = datetime.now(timezone.utc)
+        state = snap.to_dict() if snap.exists else {}
+        tokens = state.get("tokens", bucket["capacity"])
+        if isinstance(state.get("updatedAt"), datetime):
+            elapsed = max(0.0, (now - state["updatedAt"]).total_seconds())
+            tokens = min(bucket["capacity"], tokens + elapsed * bucket["refill_per_second"])
+
+        tokens -= 1
+        delay_seconds = 0.0 if tokens >= 0 else -tokens / bucket["refill_per_second"]
+        if delay_seconds > bucket["max_delay_seconds"]:
+            return -1.0
+        transaction.set(bucket_ref, {"userId": user_id, "runClass": run_class, "tokens": tokens, "updatedAt": now})
+        return delay_seconds
+
+    delay_seconds = take_token(transaction)
+    if delay_seconds < 0:
+        logger.warn(f"[Scheduling] Rejected {run_class} run for user {user_id}: rate limit exceeded.")
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED,
+            message=f"Too many {run_class} runs. Please wait a moment and try again."
+        )
+    if delay_seconds > 0:
+        logger.info(f"[Scheduling] Delaying {run_class} run for user {user_id} by {delay_seconds:.1f}s.")
+    return delay_seconds
+
+
+__all__ = [
+    'RUN_CLASS_INTERACTIVE',
+    'RUN_CLASS_BATCH',
+    'RUN_CLASS_DEPLOY',
+    'RUN_CLASS_TASK_FUNCTIONS',
+    'INTERACTIVE_MAX_CONCURRENT_DISPATCHES',
+    'BATCH_MAX_CONCURRENT_DISPATCHES',
+    'classify_run',
+    'admit_run',
+]
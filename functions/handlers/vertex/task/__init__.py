@@ -4,12 +4,19 @@ import traceback
 from firebase_admin import firestore
 
 from common.core import db, logger
+from common.http_client import run_and_close_async_http_client
 from common.agents import instantiate_adk_agent_from_config
 from .history_builder import get_full_message_history, _build_adk_content_from_history
-from .agent_runner import _run_adk_agent, _run_vertex_agent, _run_a2a_agent
+from .agent_runner import _run_adk_agent, _run_vertex_agent, _run_a2a_agent, A2ARemoteTaskPending
+from .session_service import find_resumable_session
+from .usage_accounting import record_run_usage
+from .run_ledger import (
+    MAX_RUN_ATTEMPTS, claim_run_attempt, renew_run_lease_periodically, release_run_lease, discard_attempt_events
+)
 
 
-async def _execute_agent_run(chat_id: str, assistant_message_id: str, agent_id: str | None, model_id: str | None, adk_user_id: str):
+async def _execute_agent_run(chat_id: str, assistant_message_id: str, agent_id: str | None, model_id: str | None, adk_user_id: str,
+                             run_ledger: dict | None = None):
     """The core logic that runs in the background task, now acting as an orchestrator."""
     logger.info(f"Starting execution for message {assistant_message_id} in chat {chat_id}.")
     messages_ref = db.collection("chats").document(chat_id).collection("messages")
@@ -19,53 +26,99 @@ async def _execute_agent_run(chat_id: str, assistant_message_id: str, agent_id:
     assistant_message = assistant_message_ref.get().to_dict()
     if not assistant_message: raise ValueError(f"Assistant message {assistant_message_id} not found.")
 
-    parent_id = assistant_message.get("parentMessageId")
-    history = await get_full_message_history(chat_id, parent_id)
-    adk_content, char_count = await _build_adk_content_from_history(history)
-    assistant_message_ref.update({"inputCharacterCount": char_count})
-
     participant_ref = db.collection("agents").document(agent_id) if agent_id else db.collection("models").document(model_id)
     participant_config = participant_ref.get().to_dict()
     if not participant_config: raise ValueError(f"Participant config not found for ID: {agent_id or model_id}")
 
+    parent_id = assistant_message.get("parentMessageId")
+    history = await get_full_message_history(chat_id, parent_id)
+    # Local model runs keep their ADK session in Firestore; a follow-up turn only sends what was added since.
+    parent_session_id, history_for_run = (None, history)
+    if model_id and not agent_id:
+        parent_session_id, history_for_run = find_resumable_session(history, f"model:{model_id}")
+    adk_content, char_count = await _build_adk_content_from_history(history_for_run)
+    assistant_message_ref.update({"inputCharacterCount": char_count})
+
     agent_platform = participant_config.get("platform")
 
+    # A retried attempt either continues a remote A2A task (keeping its events) or starts over cleanly.
+    event_start_index = 0
+    if run_ledger and run_ledger.get("lastCommittedEventIndex", -1) >= 0:
+        if agent_id and agent_platform == 'a2a' and run_ledger.get("hasRemoteA2ATask"):
+            event_start_index = run_ledger["lastCommittedEventIndex"] + 1
+        else:
+            discard_attempt_events(assistant_message_ref, events_collection_ref)
+
     if agent_id and agent_platform == 'a2a':
-        return await _run_a2a_agent(participant_config, adk_content, events_collection_ref)
+        return await _run_a2a_agent(participant_config, adk_content, events_collection_ref, event_start_index=event_start_index)
 
     if agent_id and agent_platform == 'google_vertex':
         resource_name = participant_config.get("vertexAiResourceName")
         if not resource_name or participant_config.get("deploymentStatus") != "deployed":
             raise ValueError(f"Agent {agent_id} is not successfully deployed.")
-        return await _run_vertex_agent(resource_name, adk_content, adk_user_id, events_collection_ref)
+        return await _run_vertex_agent(resource_name, adk_content, adk_user_id, events_collection_ref,
+                                       deployment_version=participant_config.get("lastDeployedAt"))
 
     if model_id:
         model_agent_config = {"name": f"model_run_{model_id[:6]}", "agentType": "Agent", "modelId": model_id, "tools": []}
         local_adk_agent = await instantiate_adk_agent_from_config(model_agent_config)
-        return await _run_adk_agent(local_adk_agent, adk_content, adk_user_id, events_collection_ref)
+        return await _run_adk_agent(local_adk_agent, adk_content, adk_user_id, events_collection_ref,
+                                    chat_id=chat_id, session_id=assistant_message_id, parent_session_id=parent_session_id)
 
     return {"finalParts": [], "errorDetails": [f"No valid execution path for agentId: {agent_id}, modelId: {model_id}"]}
 
 
+def _record_usage_aggregates(data: dict, usage: dict, errored: bool):
+    """Best-effort update of the per-user and per-agent daily usage counters; never fails the run."""
+    participant_id = f"agent:{data['agentId']}" if data.get("agentId") else f"model:{data.get('modelId')}"
+    try:
+        record_run_usage(data.get("firebaseAuthUid"), participant_id, usage, errored=errored)
+    except Exception as e:
+        logger.warn(f"Failed to record usage aggregates for message {data.get('assistantMessageId')}: {e}")
+
+
 async def _run_agent_task_logic(data: dict):
     """Async logic for the task, with error handling."""
     chat_id, assistant_message_id = data.get("chatId"), data.get("assistantMessageId")
     assistant_message_ref = db.collection("chats").document(chat_id).collection("messages").document(assistant_message_id)
+    run_ledger, lease_task = None, None
     try:
-        assistant_message_ref.update({"status": "running"})
+        run_ledger = await claim_run_attempt(assistant_message_ref)
+        if run_ledger is None:
+            # A redelivered task for a run that already finished or is running elsewhere; never re-run (or re-bill) it.
+            logger.info(f"Message {assistant_message_id} already finished or is running elsewhere; skipping duplicate task delivery.")
+            return
+        lease_task = asyncio.create_task(renew_run_lease_periodically(assistant_message_ref, run_ledger["attemptId"]))
+        logger.info(f"Message {assistant_message_id}: starting attempt {run_ledger['attemptCount']} ({run_ledger['attemptId']}).")
         result = await _execute_agent_run(
             chat_id=chat_id, assistant_message_id=assistant_message_id,
             agent_id=data.get("agentId"), model_id=data.get("modelId"),
-            adk_user_id=data.get("adkUserId")
+            adk_user_id=data.get("adkUserId"), run_ledger=run_ledger
         )
         final_update = {
             "parts": result.get("finalParts", []),
             "status": "error" if result.get("errorDetails") else "completed",
             "errorDetails": result.get("errorDetails"),
-            "completedTimestamp": firestore.SERVER_TIMESTAMP
+            "completedTimestamp": firestore.SERVER_TIMESTAMP,
+            "runLedger.completedAttemptId": run_ledger["attemptId"]
         }
+        if result.get("adkSessionId"):
+            final_update["adkSessionId"] = result["adkSessionId"]
+        if result.get("runMetrics"):
+            final_update["runMetrics"] = result["runMetrics"]
         assistant_message_ref.update(final_update)
         logger.info(f"Message {assistant_message_id} completed with status: {final_update['status']}")
+        _record_usage_aggregates(data, (result.get("runMetrics") or {}).get("usage") or {}, errored=bool(result.get("errorDetails")))
+    except A2ARemoteTaskPending as e:
+        if run_ledger["attemptCount"] < MAX_RUN_ATTEMPTS:
+            # Leave the message running and fail the Cloud Task so its retry resumes the same remote task.
+            logger.warn(f"Message {assistant_message_id}: {e} Deferring to a task retry.")
+            raise
+        logger.error(f"Message {assistant_message_id}: {e} No task retries left.")
+        assistant_message_ref.update({
+            "status": "error", "errorDetails": firestore.ArrayUnion([str(e)]),
+            "completedTimestamp": firestore.SERVER_TIMESTAMP
+        })
     except Exception as e:
         error_msg = f"Task handler exception for message {assistant_message_id}: {type(e).__name__} - {e}"
         logger.error(f"{error_msg}\n{traceback.format_exc()}")
@@ -73,7 +126,15 @@ async def _run_agent_task_logic(data: dict):
             "status": "error", "errorDetails": firestore.ArrayUnion([error_msg]),
             "completedTimestamp": firestore.SERVER_TIMESTAMP
         })
+    finally:
+        if lease_task:
+            lease_task.cancel()
+            try:
+                await lease_task
+            except asyncio.CancelledError:
+                pass
+            release_run_lease(assistant_message_ref, run_ledger["attemptId"])
 
 def run_agent_task_wrapper(data: dict):
     """Synchronous wrapper to be called by the Cloud Task entry point."""
-    asyncio.run(_run_agent_task_logic(data))
\ No newline at end of file
+    run_and_close_async_http_client(_run_agent_task_logic(data))
\ No newline at end of file
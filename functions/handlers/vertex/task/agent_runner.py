@@ -1,45 +1,112 @@
 # functions/handlers/vertex/task/agent_runner.py
+import asyncio
 import json
+import os
+import random
+import threading
+import time
 import traceback
 import uuid
 import httpx
 from a2a.types import Message as A2AMessage, TextPart
 from firebase_admin import firestore
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
 from google.adk.memory import InMemoryMemoryService
-from google.adk.artifacts import InMemoryArtifactService
-from vertexai import agent_engines
 import collections.abc
-from common.core import db, logger
+from common.core import logger
+from common.adk_helpers import get_adk_artifact_service, get_remote_agent_engine, invalidate_remote_agent_engine
+from common.agents.prompt_caching import start_prompt_cache_stats, summarize_prompt_cache_stats
+from common.agents.tool_memoization import summarize_tool_memo_events
+from common.http_client import arequest_with_retry, get_async_http_client
+from .event_writer import EventWriter
+from .session_service import ADK_SESSION_APP_NAME, FirestoreSessionService
+from .usage_accounting import summarize_event_usage
+
+
+# A synchronous event source (e.g. a remote `stream_query`) runs in a worker thread and hands events
+# over through this many buffered slots, so the event loop stays free for persistence and heartbeats.
+SYNC_EVENT_BUFFER_SIZE = 32
+RUN_HEARTBEAT_INTERVAL_SECONDS = 10.0
+
+
+async def _iterate_in_thread(sync_iterable, max_buffered: int = SYNC_EVENT_BUFFER_SIZE):
+    """Adapts a blocking iterable into an async iterator backed by a bounded queue filled from a worker thread."""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffered)
+    stop_requested = threading.Event()
+    end_marker = object()
+
+    def produce():
+        try:
+            for item in sync_iterable:
+                asyncio.run_coroutine_threadsafe(queue.put((item, None)), loop).result()
+                if stop_requested.is_set():
+                    return
+            asyncio.run_coroutine_threadsafe(queue.put((end_marker, None)), loop).result()
+        except Exception as e_produce:
+            if not stop_requested.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put((end_marker, e_produce)), loop).result()
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is end_marker:
+                break
+            yield item
+    finally:
+        stop_requested.set()
+        # Unblock a producer waiting on a full queue so its thread can exit.
+        while not queue.empty():
+            queue.get_nowait()
+        if producer.done():
+            producer.exception()
+
+
+async def _heartbeat_while_running(event_writer: EventWriter, message_ref):
+    """Periodically persists pending events and marks the assistant message as alive while the agent runs."""
+    while True:
+        await asyncio.sleep(RUN_HEARTBEAT_INTERVAL_SECONDS)
+        await event_writer.flush()
+        try:
+            await asyncio.to_thread(message_ref.update, {
+                "lastHeartbeatAt": firestore.SERVER_TIMESTAMP, "persistedEventCount": event_writer.written_count
+            })
+        except Exception as e_heartbeat:
+            logger.warn(f"Failed to update run heartbeat on {message_ref.path}: {e_heartbeat}")
 
 
 async def _run_agent_and_collect_events(agent_run_coroutine, events_collection_ref) -> tuple[list, list]:
-    """Generic runner that executes an agent, collects all events, and stores them in Firestore."""
+    """Generic runner that executes an agent, collects all events, and stores them in Firestore as they arrive."""
     all_events, errors = [], []
+    event_writer = EventWriter(events_collection_ref)
+    if not isinstance(agent_run_coroutine, collections.abc.AsyncIterable):
+        agent_run_coroutine = _iterate_in_thread(agent_run_coroutine)
+    heartbeat_task = asyncio.create_task(_heartbeat_while_running(event_writer, events_collection_ref.parent))
+    last_event_at = time.monotonic()
     try:
-        if isinstance(agent_run_coroutine, collections.abc.AsyncIterable):
-            async for event_obj in agent_run_coroutine:
-                event_dict = event_obj.model_dump() if hasattr(event_obj, 'model_dump') else event_obj
-                all_events.append(event_dict)
-        else:
-            for event_obj in agent_run_coroutine:
-                event_dict = event_obj.model_dump() if hasattr(event_obj, 'model_dump') else event_obj
-                all_events.append(event_dict)
+        async for event_obj in agent_run_coroutine:
+            event_dict = event_obj.model_dump() if hasattr(event_obj, 'model_dump') else event_obj
+            # Time since the previous event (or the run start), rolled up into the run's usage metrics.
+            now = time.monotonic()
+            event_dict["latencyMs"] = round((now - last_event_at) * 1000)
+            last_event_at = now
+            all_events.append(event_dict)
+            event_writer.add(event_dict)
+            event_writer.flush_in_background_if_due()
     except Exception as e_run:
         logger.error(f"Error during agent run: {e_run}\n{traceback.format_exc()}")
         errors.append(f"Agent run failed: {str(e_run)}")
+    finally:
+        heartbeat_task.cancel()
+        try:
+            await heartbeat_task
+        except asyncio.CancelledError:
+            pass
 
-    if all_events:
-        batch = db.batch()
-        for index, event_dict in enumerate(all_events):
-            try:
-                sanitized_event_dict = json.loads(json.dumps(event_dict, default=str))
-                event_with_meta = {**sanitized_event_dict, "eventIndex": index, "timestamp": firestore.SERVER_TIMESTAMP}
-                batch.set(events_collection_ref.document(), event_with_meta)
-            except Exception as e_json:
-                logger.error(f"Could not sanitize event at index {index}. Error: {e_json}. Skipping.")
-        batch.commit()
+    errors.extend(await event_writer.close())
     return all_events, errors
 
 
@@ -57,59 +124,331 @@ def _find_final_response_from_events(all_events: list) -> list:
     return []
 
 
-async def _run_adk_agent(local_adk_agent, adk_content_for_run, adk_user_id, events_collection_ref):
-    """Runs a locally instantiated ADK agent."""
+async def _run_adk_agent(local_adk_agent, adk_content_for_run, adk_user_id, events_collection_ref,
+                         chat_id, session_id, parent_session_id=None):
+    """
+    Runs a locally instantiated ADK agent on a persistent session. With a `parent_session_id` the turn continues
+    that session, so `adk_content_for_run` only needs to carry the messages added since.
+    """
+    session_service = FirestoreSessionService(chat_id)
     runner = Runner(
-        agent=local_adk_agent, app_name=local_adk_agent.name,
-        session_service=InMemorySessionService(),
-        artifact_service=InMemoryArtifactService(),
+        agent=local_adk_agent, app_name=ADK_SESSION_APP_NAME,
+        session_service=session_service,
+        # Artifacts go to GCS under the chat; events only carry their versions in `actions.artifact_delta`.
+        artifact_service=(await get_adk_artifact_service()).scoped(chat_id),
         memory_service=InMemoryMemoryService()
     )
-    session = await runner.session_service.create_session(app_name=runner.app_name, user_id=adk_user_id)
-    run_coro = runner.run_async(user_id=adk_user_id, session_id=session.id, new_message=adk_content_for_run)
+    if parent_session_id:
+        await session_service.fork_session(app_name=runner.app_name, user_id=adk_user_id,
+                                           parent_session_id=parent_session_id, session_id=session_id)
+    else:
+        await session_service.create_session(app_name=runner.app_name, user_id=adk_user_id, session_id=session_id)
+    prompt_cache_stats = start_prompt_cache_stats()
+    run_coro = runner.run_async(user_id=adk_user_id, session_id=session_id, new_message=adk_content_for_run)
 
     all_events, errors = await _run_agent_and_collect_events(run_coro, events_collection_ref)
     final_parts = _find_final_response_from_events(all_events)
-    return {"finalParts": final_parts, "errorDetails": errors}
+    usage = summarize_event_usage(all_events)
+    # Cost and cached tokens come from the raw LiteLLM responses, which carry more than the events do.
+    usage["costUsd"] = round(prompt_cache_stats["costUsd"], 6)
+    usage["cachedPromptTokens"] = max(usage["cachedPromptTokens"], prompt_cache_stats["cachedPromptTokens"])
+    result = {"finalParts": final_parts, "errorDetails": errors,
+              "runMetrics": {"usage": usage, "promptCache": summarize_prompt_cache_stats(prompt_cache_stats)}}
+    tool_memo = summarize_tool_memo_events(all_events)
+    if tool_memo:
+        result["runMetrics"]["toolMemo"] = tool_memo
+    if not errors:
+        # Only a cleanly finished session may be continued by the next turn.
+        result["adkSessionId"] = session_id
+    return result
+
 
+def _vertex_message_from_content(adk_content_for_run):
+    """
+    Converts the run's Content into the `message` argument of a deployed AdkApp. Multimodal turns are sent as a
+    Content dict so images and file references reach the remote agent; text-only turns stay a plain string.
+    """
+    parts = adk_content_for_run.parts or []
+    if all(getattr(p, 'text', None) is not None for p in parts):
+        return "\n".join(p.text for p in parts if p.text)
+    return adk_content_for_run.model_dump(mode="json", exclude_none=True)
 
-async def _run_vertex_agent(resource_name, adk_content_for_run, adk_user_id, events_collection_ref):
-    """Runs a deployed Vertex AI Reasoning Engine."""
-    remote_app = agent_engines.get(resource_name)
-    message_text_for_vertex = "\n".join([p.text for p in adk_content_for_run.parts if hasattr(p, 'text') and p.text])
-    if not message_text_for_vertex: # Handle image-only case
-        image_count = sum(1 for p in adk_content_for_run.parts if hasattr(p, 'file_data'))
-        if image_count > 0: message_text_for_vertex = f"[Image Content Provided ({image_count})]"
 
-    run_coro = remote_app.stream_query(message=message_text_for_vertex, user_id=adk_user_id)
+async def _run_vertex_agent(resource_name, adk_content_for_run, adk_user_id, events_collection_ref, deployment_version=None):
+    """Runs a deployed Vertex AI Reasoning Engine, streaming its events without blocking the event loop."""
+    remote_app = get_remote_agent_engine(resource_name, deployment_version)
+    message_for_vertex = _vertex_message_from_content(adk_content_for_run)
+
+    if hasattr(remote_app, "async_stream_query"):
+        run_coro = remote_app.async_stream_query(message=message_for_vertex, user_id=adk_user_id)
+    else:
+        # Engines deployed before async operations were registered only expose the blocking generator.
+        run_coro = remote_app.stream_query(message=message_for_vertex, user_id=adk_user_id)
     all_events, errors = await _run_agent_and_collect_events(run_coro, events_collection_ref)
+    if any("NotFound" in error for error in errors):
+        # The engine was deleted or replaced behind our back; don't keep serving the stale handle.
+        invalidate_remote_agent_engine(resource_name)
     final_parts = _find_final_response_from_events(all_events)
-    return {"finalParts": final_parts, "errorDetails": errors}
+    run_metrics = {"usage": summarize_event_usage(all_events)}
+    tool_memo = summarize_tool_memo_events(all_events)
+    if tool_memo:
+        run_metrics["toolMemo"] = tool_memo
+    return {"finalParts": final_parts, "errorDetails": errors, "runMetrics": run_metrics}
+
+
+# --- A2A ---
+A2A_UNARY_TIMEOUT_SECONDS = 120.0
+# Streaming runs may be long; only the gap between two SSE events is bounded.
+A2A_STREAM_TIMEOUT = httpx.Timeout(30.0, connect=10.0, read=300.0)
+A2A_PROGRESS_UPDATE_INTERVAL_SECONDS = 1.0
+# Long-running remote tasks are followed until a terminal state, within the worker's own time limit;
+# past the deadline the Cloud Task is retried and resumes the same remote task.
+A2A_TASK_WAIT_DEADLINE_SECONDS = float(os.environ.get("A2A_TASK_WAIT_DEADLINE_SECONDS", "420"))
+A2A_POLL_INITIAL_DELAY_SECONDS = 1.0
+A2A_POLL_MAX_DELAY_SECONDS = 15.0
+A2A_TERMINAL_TASK_STATES = {"completed", "canceled", "failed", "rejected"}
+# The remote agent is waiting on the user; there is nothing more to wait for in this turn.
+A2A_INTERRUPTED_TASK_STATES = {"input-required", "auth-required"}
+
+
+class A2ARemoteTaskPending(Exception):
+    """Raised when a remote A2A task is still running at the wait deadline, so the run is retried and resumed."""
+
+    def __init__(self, task_id: str, state: str | None):
+        super().__init__(f"Remote A2A task {task_id} is still '{state}' after {A2A_TASK_WAIT_DEADLINE_SECONDS:.0f}s.")
+        self.task_id = task_id
+        self.state = state
+
+
+def _a2a_text_from_parts(parts: list) -> str:
+    return "\n".join(t for t in (part.get("text", "") or part.get("text-delta", "") for part in parts or []) if t)
+
+
+class _A2AResultAccumulator:
+    """Folds A2A results (Task, Message, status and artifact updates) into the text shown to the user."""
+
+    def __init__(self):
+        self.artifacts: dict[str, str] = {}
+        self.status_text = ""
+        self.message_text = ""
+
+    def _set_artifact(self, artifact: dict, append: bool = False):
+        artifact_id = artifact.get("artifactId") or str(len(self.artifacts))
+        text = _a2a_text_from_parts(artifact.get("parts"))
+        # Appended chunks continue the same artifact, so they are concatenated as-is.
+        self.artifacts[artifact_id] = self.artifacts.get(artifact_id, "") + text if append else text
+
+    def apply(self, result: dict):
+        kind = result.get("kind")
+        if kind == "artifact-update":
+            self._set_artifact(result.get("artifact", {}), append=bool(result.get("append")))
+        elif kind == "message" or (kind is None and "parts" in result):
+            self.message_text = _a2a_text_from_parts(result.get("parts"))
+        else:
+            status_message = (result.get("status") or {}).get("message") or {}
+            if status_text := _a2a_text_from_parts(status_message.get("parts")):
+                self.status_text = status_text
+            for artifact in result.get("artifacts") or []:
+                self._set_artifact(artifact)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(t for t in self.artifacts.values() if t) or self.message_text or self.status_text
 
 
-async def _run_a2a_agent(participant_config, adk_content_for_run, events_collection_ref):
-    """Runs an A2A agent (unary)."""
+async def _iterate_sse_json(response: httpx.Response):
+    """Yields the JSON payload of each server-sent event in a streaming response."""
+    data_lines = []
+    async for line in response.aiter_lines():
+        if line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+        elif not line.strip() and data_lines:
+            yield json.loads("\n".join(data_lines))
+            data_lines = []
+    if data_lines:
+        yield json.loads("\n".join(data_lines))
+
+
+async def _iterate_json_response(response: httpx.Response):
+    yield json.loads(await response.aread())
+
+
+class _A2ARunState:
+    """
+    Shared state of one A2A run: persists results as events, tracks the remote task (mirrored on the assistant
+    message as `a2aTask` so a retried run can resume it) and pushes progressive text to the assistant message.
+    """
+
+    def __init__(self, events_collection_ref, endpoint_url: str, event_start_index: int = 0):
+        self.message_ref = events_collection_ref.parent
+        self.endpoint_url = endpoint_url
+        self.event_writer = EventWriter(events_collection_ref, start_index=event_start_index)
+        self.accumulator = _A2AResultAccumulator()
+        self.task_id, self.context_id, self.state = None, None, None
+        self._last_progress_update, self._last_progress_text = 0.0, ""
+
+    @property
+    def is_done(self) -> bool:
+        return self.state in A2A_TERMINAL_TASK_STATES or self.state in A2A_INTERRUPTED_TASK_STATES
+
+    async def load_resumable_task(self) -> bool:
+        """Picks up a remote task started by a previous attempt of this run, if it has not finished."""
+        message = (await asyncio.to_thread(self.message_ref.get)).to_dict() or {}
+        a2a_task = message.get("a2aTask") or {}
+        if not a2a_task.get("taskId") or a2a_task.get("endpointUrl") != self.endpoint_url:
+            return False
+        self.task_id, self.context_id, self.state = a2a_task["taskId"], a2a_task.get("contextId"), a2a_task.get("state")
+        if self.is_done:
+            # The previous attempt saw the end but failed before finishing; fetch the final task once more.
+            self.state = None
+        return True
+
+    async def handle(self, result: dict, event_type: str, persist_event: bool = True):
+        if persist_event:
+            self.event_writer.add({"type": event_type, "kind": result.get("kind"), "result": result})
+            self.event_writer.flush_in_background_if_due()
+        self.accumulator.apply(result)
+
+        kind = result.get("kind")
+        task_id = result.get("id") if kind == "task" or (kind is None and "status" in result) else result.get("taskId")
+        state = (result.get("status") or {}).get("state") or self.state
+        if (task_id and task_id != self.task_id) or state != self.state:
+            self.task_id, self.state = task_id or self.task_id, state
+            self.context_id = result.get("contextId") or self.context_id
+            if self.task_id:
+                await self._update_message({"a2aTask": {
+                    "taskId": self.task_id, "contextId": self.context_id, "endpointUrl": self.endpoint_url,
+                    "state": self.state, "updatedAt": firestore.SERVER_TIMESTAMP
+                }})
+
+        now, current_text = time.monotonic(), self.accumulator.text
+        if current_text != self._last_progress_text and now - self._last_progress_update >= A2A_PROGRESS_UPDATE_INTERVAL_SECONDS:
+            self._last_progress_update, self._last_progress_text = now, current_text
+            await self._update_message({"parts": [{"text": current_text}]})
+
+    async def _update_message(self, update: dict):
+        try:
+            await asyncio.to_thread(self.message_ref.update, update)
+        except Exception as e_update:
+            logger.warn(f"Failed to update A2A run state on {self.message_ref.path}: {e_update}")
+
+
+async def _consume_a2a_stream(rpc_payload: dict, run_state: _A2ARunState, event_type: str) -> list:
+    """Runs a streaming JSON-RPC method (`message/stream`, `tasks/resubscribe`) and handles each SSE result."""
+    errors = []
+    async with get_async_http_client().stream(
+            "POST", run_state.endpoint_url, json=rpc_payload, headers={"Accept": "text/event-stream"}, timeout=A2A_STREAM_TIMEOUT
+    ) as response:
+        response.raise_for_status()
+        # Some servers answer a streaming request with a single JSON-RPC response instead of SSE.
+        is_sse = "text/event-stream" in response.headers.get("content-type", "")
+        rpc_messages = _iterate_sse_json(response) if is_sse else _iterate_json_response(response)
+        async for rpc_message in rpc_messages:
+            if error := rpc_message.get("error"):
+                errors.append(f"A2A RPC error: {error}")
+                continue
+            await run_state.handle(rpc_message.get("result") or {}, event_type)
+    return errors
+
+
+async def _wait_for_a2a_task(run_state: _A2ARunState, prefer_resubscribe: bool):
+    """Follows a non-terminal remote task via `tasks/resubscribe` or `tasks/get` polling with backoff until it ends."""
+    deadline = time.monotonic() + A2A_TASK_WAIT_DEADLINE_SECONDS
+    delay = A2A_POLL_INITIAL_DELAY_SECONDS
+    while not run_state.is_done:
+        if time.monotonic() >= deadline:
+            raise A2ARemoteTaskPending(run_state.task_id, run_state.state)
+        params = {"id": run_state.task_id}
+        if prefer_resubscribe:
+            try:
+                rpc_payload = {"jsonrpc": "2.0", "method": "tasks/resubscribe", "id": str(uuid.uuid4()), "params": params}
+                if await _consume_a2a_stream(rpc_payload, run_state, "a2a_stream_event"):
+                    prefer_resubscribe = False
+                    logger.info(f"A2A agent at {run_state.endpoint_url} rejected tasks/resubscribe; polling tasks/get instead.")
+            except Exception as e:
+                logger.warn(f"A2A resubscribe for task {run_state.task_id} failed ({e}); polling tasks/get instead.")
+                prefer_resubscribe = False
+            if run_state.is_done:
+                break
+        else:
+            rpc_payload = {"jsonrpc": "2.0", "method": "tasks/get", "id": str(uuid.uuid4()), "params": params}
+            # tasks/get is read-only, so every transient failure may be retried.
+            response = await arequest_with_retry("POST", run_state.endpoint_url, json=rpc_payload,
+                                                 retry_non_idempotent=True, timeout=A2A_UNARY_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            rpc_response = response.json()
+            if error := rpc_response.get("error"):
+                raise RuntimeError(f"A2A tasks/get error: {error}")
+            task = rpc_response.get("result") or {}
+            previous_state = run_state.state
+            new_state = (task.get("status") or {}).get("state")
+            # Only state transitions are logged as events; identical polls would just bloat the trace.
+            await run_state.handle(task, "a2a_task_poll", persist_event=new_state != previous_state)
+            if run_state.is_done:
+                break
+        await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())) * random.uniform(0.8, 1.2))
+        delay = min(A2A_POLL_MAX_DELAY_SECONDS, delay * 2)
+
+
+async def _run_a2a_agent(participant_config, adk_content_for_run, events_collection_ref, event_start_index: int = 0):
+    """
+    Runs an A2A agent, streaming over `message/stream` when its AgentCard advertises it and falling back to unary.
+    Remote tasks that are still running are followed to completion; a retried run resumes the stored task.
+    """
     endpoint_url = participant_config.get("endpointUrl")
     if not endpoint_url: raise ValueError("A2A agent config is missing 'endpointUrl'.")
+    endpoint_url = endpoint_url.rstrip('/')
 
-    message_text = "".join([p.text for p in adk_content_for_run.parts if hasattr(p, 'text') and p.text])
+    message_text = "\n".join([p.text for p in adk_content_for_run.parts if hasattr(p, 'text') and p.text])
     a2a_message = A2AMessage(messageId=str(uuid.uuid4()), role="user", parts=[TextPart(text=message_text)])
+    message_params = {"message": a2a_message.model_dump(exclude_none=True)}
+    supports_streaming = bool(((participant_config.get("agentCard") or {}).get("capabilities") or {}).get("streaming"))
+    run_state = _A2ARunState(events_collection_ref, endpoint_url, event_start_index=event_start_index)
     errors, final_parts = [], []
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        try:
-            rpc_payload = {"jsonrpc": "2.0", "method": "message/send", "id": str(uuid.uuid4()), "params": {"message": a2a_message.model_dump(exclude_none=True)}}
-            response = await client.post(endpoint_url.rstrip('/'), json=rpc_payload)
-            response.raise_for_status()
-            rpc_response = response.json()
+    try:
+        resumed = await run_state.load_resumable_task()
+        if resumed:
+            logger.info(f"Resuming remote A2A task {run_state.task_id} instead of re-sending the message.")
+        else:
+            sent = False
+            if supports_streaming:
+                try:
+                    rpc_payload = {"jsonrpc": "2.0", "method": "message/stream", "id": str(uuid.uuid4()), "params": message_params}
+                    errors.extend(await _consume_a2a_stream(rpc_payload, run_state, "a2a_stream_event"))
+                    sent = True
+                except Exception as e:
+                    if run_state.event_writer.next_index == event_start_index:
+                        logger.warn(f"A2A streaming to {endpoint_url} failed before any event ({e}); falling back to message/send.")
+                    elif run_state.task_id:
+                        # The agent already accepted the message; follow its task instead of re-sending.
+                        logger.warn(f"A2A stream for task {run_state.task_id} broke ({e}); following the task.")
+                        sent = True
+                    else:
+                        raise RuntimeError(f"A2A stream failed: {e}") from e
 
-            if task_result := rpc_response.get("result"):
-                events_collection_ref.document().set({"type": "a2a_unary_result", "result": task_result, "eventIndex": 0, "timestamp": firestore.SERVER_TIMESTAMP})
-                final_text = "".join(part.get("text", "") or part.get("text-delta", "") for artifact in task_result.get("artifacts", []) for part in artifact.get("parts", []))
-                if final_text: final_parts.append({"text": final_text})
-            elif error := rpc_response.get("error"):
-                errors.append(f"A2A RPC error: {error}")
-        except Exception as e:
-            errors.append(f"A2A communication failed: {e}")
+            if not sent:
+                rpc_payload = {"jsonrpc": "2.0", "method": "message/send", "id": str(uuid.uuid4()), "params": message_params}
+                # message/send is not idempotent, so only connection failures are retried.
+                response = await arequest_with_retry("POST", endpoint_url, json=rpc_payload, timeout=A2A_UNARY_TIMEOUT_SECONDS)
+                response.raise_for_status()
+                rpc_response = response.json()
+                if task_result := rpc_response.get("result"):
+                    await run_state.handle(task_result, "a2a_unary_result")
+                elif error := rpc_response.get("error"):
+                    errors.append(f"A2A RPC error: {error}")
+
+        if run_state.task_id and not run_state.is_done:
+            await _wait_for_a2a_task(run_state, prefer_resubscribe=supports_streaming)
+    except A2ARemoteTaskPending:
+        await run_state.event_writer.close()
+        raise
+    except Exception as e:
+        errors.append(f"A2A communication failed: {e}")
 
-    return {"finalParts": final_parts, "errorDetails": errors}
\ No newline at end of file
+    if run_state.state in {"failed", "rejected", "canceled"}:
+        errors.append(f"A2A task {run_state.task_id} ended in state '{run_state.state}'.")
+    if final_text := run_state.accumulator.text:
+        final_parts.append({"text": final_text})
+    errors.extend(await run_state.event_writer.close())
+    return {"finalParts": final_parts, "errorDetails": errors}
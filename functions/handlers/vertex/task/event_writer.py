@@ -0,0 +1,331 @@
+# functions/handlers/vertex/task/event_writer.py
+import asyncio
+import json
+import os
+import time
+from firebase_admin import firestore
+from google.cloud import storage
+from google.api_core import exceptions as gapi_exceptions
+from google.api_core import retry as gapi_retry
+
+from common.core import db, logger
+
+# --- Firestore Limits ---
+MAX_WRITES_PER_BATCH = 500
+# Commit requests are capped at 10 MiB; stay well under it to leave room for request overhead.
+MAX_BATCH_PAYLOAD_BYTES = 9 * 1024 * 1024
+MAX_CONCURRENT_COMMITS = 8
+# Events are persisted while the run is still going once this many are pending or this much time has passed.
+EVENT_FLUSH_MAX_PENDING = 100
+EVENT_FLUSH_INTERVAL_SECONDS = 2.0
+# Document IDs are 20 chars; 32 bytes of per-document overhead plus the eventIndex/timestamp fields.
+_EVENT_DOC_OVERHEAD_BYTES = 32 + 21 + len("eventIndex") + 1 + 8 + len("timestamp") + 1 + 8
+
+# --- Oversized Payload Offload ---
+# Documents are capped at 1 MiB. Larger events keep a truncated preview inline and spill the full
+# `content`/`actions` payloads to GCS, referenced from the event's `offloadedPayloads` map.
+MAX_INLINE_EVENT_BYTES = 900 * 1024
+OFFLOADABLE_EVENT_FIELDS = ("content", "actions")
+PREVIEW_STRING_CHARS = 2000
+PREVIEW_LIST_ITEMS = 20
+
+# Event documents are named after their eventIndex, so a retried batch or a re-run attempt overwrites
+# the same documents instead of appending duplicates. Retrying a commit is therefore always safe.
+_COMMIT_RETRY = gapi_retry.Retry(
+    predicate=gapi_retry.if_exception_type(
+        gapi_exceptions.Aborted, gapi_exceptions.DeadlineExceeded, gapi_exceptions.ServiceUnavailable,
+        gapi_exceptions.ResourceExhausted, gapi_exceptions.InternalServerError,
+    ),
+    initial=0.5, maximum=8.0, multiplier=2.0, timeout=60.0,
+)
+
+
+def sanitize_for_firestore(value) -> tuple[object, int]:
+    """
+    Converts a value into Firestore-safe primitives in a single pass, with the same result as
+    `json.loads(json.dumps(value, default=str))`, and returns it along with its Firestore storage size.
+    """
+    if value is None:
+        return None, 1
+    if isinstance(value, bool):
+        return bool(value), 1
+    if isinstance(value, int):
+        return int(value), 8
+    if isinstance(value, float):
+        return float(value), 8
+    if isinstance(value, str):
+        text = str.__str__(value)
+        return text, len(text.encode("utf-8")) + 1
+    if isinstance(value, dict):
+        result, size = {}, 0
+        for key, item in value.items():
+            if isinstance(key, bool) or key is None:
+                key = "true" if key is True else "false" if key is False else "null"
+            key = str.__str__(key) if isinstance(key, str) else str(key)
+            result[key], item_size = sanitize_for_firestore(item)
+            size += len(key.encode("utf-8")) + 1 + item_size
+        return result, size
+    if isinstance(value, (list, tuple)):
+        result, size = [], 0
+        for item in value:
+            sanitized_item, item_size = sanitize_for_firestore(item)
+            result.append(sanitized_item)
+            size += item_size
+        return result, size
+    return sanitize_for_firestore(str(value))
+
+
+_event_payload_bucket = None
+
+
+def _event_payload_bucket_name() -> str:
+    from common.config import get_gcp_project_config
+    project_id, _, _ = get_gcp_project_config()
+    return f"{project_id}-agent-run-events"
+
+
+def _get_event_payload_bucket() -> storage.Bucket:
+    """Returns the bucket for offloaded event payloads, creating it on first use. Cached for the lifetime of the instance."""
+    global _event_payload_bucket
+    if _event_payload_bucket is None:
+        bucket_name = _event_payload_bucket_name()
+        storage_client = storage.Client()
+        bucket = storage_client.bucket(bucket_name)
+        if not bucket.exists():
+            logger.warn(f"Storage bucket '{bucket_name}' not found. Creating it with default settings.")
+            bucket = storage_client.create_bucket(bucket, location=os.environ.get("FUNCTION_REGION", "us-central1"))
+        _event_payload_bucket = bucket
+    return _event_payload_bucket
+
+
+def _payload_preview(value):
+    """Shrinks a sanitized payload while keeping its shape, so the reasoning log can still render it."""
+    if isinstance(value, str):
+        if len(value) <= PREVIEW_STRING_CHARS:
+            return value
+        return f"{value[:PREVIEW_STRING_CHARS]}... [TRUNCATED, {len(value)} chars in full payload]"
+    if isinstance(value, dict):
+        return {key: _payload_preview(item) for key, item in value.items()}
+    if isinstance(value, list):
+        preview = [_payload_preview(item) for item in value[:PREVIEW_LIST_ITEMS]]
+        if len(value) > PREVIEW_LIST_ITEMS:
+            preview.append(f"... [{len(value) - PREVIEW_LIST_ITEMS} more items in full payload]")
+        return preview
+    return value
+
+
+def store_event_payload(blob_name: str, payload_bytes: bytes) -> str:
+    """Uploads a JSON payload to the event payload bucket and returns its `gs://` URI."""
+    blob = _get_event_payload_bucket().blob(blob_name)
+    blob.upload_from_string(payload_bytes, content_type="application/json")
+    return f"gs://{blob.bucket.name}/{blob_name}"
+
+
+def load_event_payload(uri: str):
+    """Downloads an offloaded event payload referenced by a `gs://` URI."""
+    bucket_name, blob_name = uri.split('/', 3)[2:]
+    return json.loads(storage.Client().bucket(bucket_name).blob(blob_name).download_as_bytes())
+
+
+def delete_event_payloads(events_path: str) -> int:
+    """Deletes every payload offloaded for the events collection at `events_path`. Returns how many were deleted."""
+    bucket = storage.Client().bucket(_event_payload_bucket_name())
+    try:
+        blobs = list(bucket.list_blobs(prefix=f"{events_path}/"))
+    except gapi_exceptions.NotFound:
+        return 0  # Nothing was ever offloaded in this project.
+    if blobs:
+        bucket.delete_blobs(blobs, on_error=lambda blob: None)
+    return len(blobs)
+
+
+def event_doc_id(event_index: int) -> str:
+    """Deterministic, lexicographically ordered document ID for the event at `event_index`."""
+    return f"{event_index:06d}"
+
+
+class EventWriter:
+    """
+    Buffers run events for an `events` subcollection and persists them in Firestore-compliant batches.
+    Each event is sanitized once on `add`; `flush` splits pending writes by count and payload size and
+    commits the batches concurrently, retrying transient contention errors. Events over the inline size
+    limit have their `content`/`actions` uploaded to GCS before the batch that references them is committed.
+    Flushes commit one after another in the order their events were taken; after each one
+    `runLedger.lastCommittedEventIndex` on the parent message is advanced to the flush's last event, but only
+    while every batch of the run so far has committed, so the ledger never skips a failed range.
+    """
+
+    def __init__(self, events_collection_ref, start_index: int = 0):
+        self._events_collection_ref = events_collection_ref
+        self._message_ref = events_collection_ref.parent
+        self._pending: list[tuple[object, dict, int, list]] = []
+        self._next_index = start_index
+        self._last_flush_started = time.monotonic()
+        # The most recently started flush. Each flush waits for this one, so batches commit in the order they were taken.
+        self._flush_task: asyncio.Task | None = None
+        self.written_count = 0
+        self.errors: list[str] = []
+
+    @property
+    def next_index(self) -> int:
+        return self._next_index
+
+    def add(self, event_dict: dict) -> int:
+        """Queues an event and returns its eventIndex. Events that cannot be sanitized are logged and skipped."""
+        index = self._next_index
+        self._next_index += 1
+        try:
+            sanitized, size = sanitize_for_firestore(event_dict)
+            if not isinstance(sanitized, dict):
+                sanitized = {"value": sanitized}
+        except Exception as e_sanitize:
+            logger.error(f"Could not sanitize event at index {index}. Error: {e_sanitize}. Skipping.")
+            return index
+        doc_ref = self._events_collection_ref.document(event_doc_id(index))
+        size += _EVENT_DOC_OVERHEAD_BYTES
+        offloads = []
+        if size > MAX_INLINE_EVENT_BYTES:
+            sanitized, size, offloads = self._offload_large_fields(doc_ref, sanitized, size)
+            if size > MAX_INLINE_EVENT_BYTES:
+                logger.error(f"Event at index {index} is {size} bytes even after offloading its payloads. Skipping.")
+                return index
+        document = {**sanitized, "eventIndex": index, "timestamp": firestore.SERVER_TIMESTAMP}
+        self._pending.append((doc_ref, document, size, offloads))
+        return index
+
+    @staticmethod
+    def _offload_large_fields(doc_ref, sanitized: dict, size: int) -> tuple[dict, int, list]:
+        """Replaces the largest offloadable fields with previews until the event fits inline."""
+        field_sizes = {
+            field: sanitize_for_firestore(sanitized[field])[1]
+            for field in OFFLOADABLE_EVENT_FIELDS if sanitized.get(field) is not None
+        }
+        bucket_name = _event_payload_bucket_name()
+        sanitized, offloads, offloaded_refs = dict(sanitized), [], {}
+        for field in sorted(field_sizes, key=field_sizes.get, reverse=True):
+            payload_bytes = json.dumps(sanitized[field]).encode("utf-8")
+            blob_name = f"{doc_ref.path}/{field}.json"
+            preview = _payload_preview(sanitized[field])
+            size += sanitize_for_firestore(preview)[1] - field_sizes[field]
+            sanitized[field] = preview
+            offloads.append((blob_name, payload_bytes))
+            offloaded_refs[field] = {"uri": f"gs://{bucket_name}/{blob_name}", "sizeBytes": len(payload_bytes)}
+            if size <= MAX_INLINE_EVENT_BYTES:
+                break
+        sanitized["offloadedPayloads"], refs_size = sanitize_for_firestore(offloaded_refs)
+        logger.info(f"Offloaded event fields {list(offloaded_refs)} for {doc_ref.path} to GCS.")
+        return sanitized, size + len("offloadedPayloads") + 1 + refs_size, offloads
+
+    def flush_in_background_if_due(self):
+        """
+        Starts a background flush when enough events are pending or enough time has passed, so writes overlap the run.
+        Nothing is started while a flush is in flight; events added meanwhile are picked up by the next one.
+        """
+        if not self._pending or (self._flush_task and not self._flush_task.done()):
+            return
+        if len(self._pending) < EVENT_FLUSH_MAX_PENDING and time.monotonic() - self._last_flush_started < EVENT_FLUSH_INTERVAL_SECONDS:
+            return
+        self._start_flush()
+
+    async def close(self) -> list[str]:
+        """Waits for in-flight flushes, commits anything still pending, and returns all persistence errors."""
+        await self.flush()
+        return self.errors
+
+    def _take_batches(self) -> list:
+        batches, current, current_bytes = [], [], 0
+        for write in self._pending:
+            # One write per batch is reserved for the run ledger update.
+            if current and (len(current) >= MAX_WRITES_PER_BATCH - 1 or current_bytes + write[2] > MAX_BATCH_PAYLOAD_BYTES):
+                batches.append(current)
+                current, current_bytes = [], 0
+            current.append(write)
+            current_bytes += write[2]
+        if current:
+            batches.append(current)
+        self._pending = []
+        self._last_flush_started = time.monotonic()
+        return batches
+
+    def _commit(self, writes: list, ledger_index: int | None = None):
+        # Payloads are uploaded first so a committed event never references a missing object.
+        for _, _, _, offloads in writes:
+            for blob_name, payload_bytes in offloads:
+                store_event_payload(blob_name, payload_bytes)
+        batch = db.batch()
+        for doc_ref, document, _, _ in writes:
+            batch.set(doc_ref, document)
+        if ledger_index is not None:
+            batch.update(self._message_ref, {"runLedger.lastCommittedEventIndex": ledger_index})
+        batch.commit(retry=_COMMIT_RETRY)
+
+    async def _advance_ledger(self, last_index: int):
+        # A failed update only leaves the ledger behind; the next flush moves it past these events again.
+        try:
+            await asyncio.to_thread(self._message_ref.update, {"runLedger.lastCommittedEventIndex": last_index})
+        except Exception as e:
+            logger.warn(f"Failed to advance the run ledger of {self._message_ref.path} to event {last_index}: {e}")
+
+    def _start_flush(self) -> asyncio.Task:
+        # The pending events are taken here rather than in the task, so nothing is claimed twice.
+        previous, batches = self._flush_task, self._take_batches()
+
+        async def flush_after_previous():
+            if previous:
+                await asyncio.wait([previous])
+            return await self._commit_batches(batches)
+
+        self._flush_task = asyncio.create_task(flush_after_previous())
+        return self._flush_task
+
+    async def flush(self) -> list[str]:
+        """
+        Commits all pending events after any flush already in flight. Returns error messages for batches that could
+        not be written. Cancelling the caller does not cancel the commit.
+        """
+        return await asyncio.shield(self._start_flush())
+
+    async def _commit_batches(self, batches: list) -> list[str]:
+        if not batches:
+            return []
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_COMMITS)
+        # Earlier flushes have all finished, so with no errors so far every event up to this flush's last is stored
+        # once its batches commit. A single batch carries the ledger update itself; otherwise it follows them.
+        last_index = batches[-1][-1][1]["eventIndex"]
+        ledger_in_batch = len(batches) == 1 and not self.errors
+
+        async def commit_with_limit(writes):
+            async with semaphore:
+                await asyncio.to_thread(self._commit, writes, last_index if ledger_in_batch else None)
+
+        results = await asyncio.gather(*(commit_with_limit(writes) for writes in batches), return_exceptions=True)
+        errors, written = [], 0
+        for writes, result in zip(batches, results):
+            if isinstance(result, Exception):
+                first_index, last_index = writes[0][1]["eventIndex"], writes[-1][1]["eventIndex"]
+                logger.error(f"Failed to write events {first_index}-{last_index}: {result}")
+                errors.append(f"Failed to persist events {first_index}-{last_index}: {result}")
+            else:
+                written += len(writes)
+        self.written_count += written
+        self.errors.extend(errors)
+        if written and not self.errors and not ledger_in_batch:
+            await self._advance_ledger(last_index)
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"[EventWriter] Wrote {written} events in {len(batches)} batch(es) in {elapsed:.3f}s "
+                    f"({written / elapsed if elapsed > 0 else 0:.0f} events/s).")
+        return errors
+
+
+__all__ = [
+    'MAX_INLINE_EVENT_BYTES',
+    'OFFLOADABLE_EVENT_FIELDS',
+    'sanitize_for_firestore',
+    'event_doc_id',
+    'store_event_payload',
+    'load_event_payload',
+    'delete_event_payloads',
+    'EventWriter',
+]
@@ -2,6 +2,7 @@
 from google.cloud import storage
 from google.genai.types import Content, Part
 from common.core import db, logger
+from common.retrieval import RETRIEVAL_MODE, retrieve_relevant_text
 
 
 async def get_full_message_history(chat_id: str, leaf_message_id: str | None) -> list[dict]:
@@ -18,10 +19,21 @@ async def get_full_message_history(chat_id: str, leaf_message_id: str | None) ->
     return history
 
 
+def _latest_user_text(conversation_history: list[dict]) -> str:
+    """Returns the text of the most recent user turn, used as the retrieval query for indexed context."""
+    for message in reversed(conversation_history):
+        if message.get("participant", "").startswith("user"):
+            texts = [p.get("text", "") for p in message.get("parts", []) if "text" in p]
+            if "".join(texts).strip():
+                return "\n".join(texts).strip()
+    return ""
+
+
 async def _build_adk_content_from_history(conversation_history: list[dict]) -> tuple[Content, int]:
     """Constructs a multi-part ADK Content object from the conversation history."""
     adk_parts, total_char_count = [], 0
     storage_client = storage.Client()
+    retrieval_query = _latest_user_text(conversation_history) if RETRIEVAL_MODE != "off" else ""
 
     for message in conversation_history:
         role = "model" if message.get("participant", "").startswith("assistant:") else "user"
@@ -43,8 +55,17 @@ async def _build_adk_content_from_history(conversation_history: list[dict]) -> t
                         image_bytes = blob.download_as_bytes()
                         adk_parts.append(Part.from_bytes(data=image_bytes, mime_type=mime_type))
                     elif mime_type.startswith("text/"):
-                        text_content = blob.download_as_text()
-                        adk_parts.append(Part.from_text(text=f"{role} uploaded file '{blob_name}':\n{text_content}"))
+                        text_content = None
+                        if retrieval_query and (index_ref := part_data.get("retrieval_index")):
+                            # Indexed context contributes only the chunks relevant to the current question.
+                            try:
+                                relevant_text = retrieve_relevant_text(storage_client, blob, index_ref, retrieval_query)
+                                text_content = f"{role} uploaded file '{blob_name}' (excerpts most relevant to the latest message):\n{relevant_text}"
+                            except Exception as e_retrieval:
+                                logger.warn(f"Retrieval failed for {uri}, including full content instead: {e_retrieval}")
+                        if text_content is None:
+                            text_content = f"{role} uploaded file '{blob_name}':\n{blob.download_as_text()}"
+                        adk_parts.append(Part.from_text(text=text_content))
                     else:
                         adk_parts.append(Part.from_uri(file_uri=uri, mime_type=mime_type))
                 except Exception as e:
@@ -0,0 +1,143 @@
+# functions/handlers/vertex/task/run_ledger.py
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from firebase_admin import firestore
+
+from common.core import db, logger
+from .event_writer import delete_event_payloads
+
+# Must match the RetryConfig of the executeAgentRunTask task queue.
+MAX_RUN_ATTEMPTS = 3
+TERMINAL_MESSAGE_STATUSES = {"completed", "error"}
+# The running attempt holds a lease on the run and renews it well before it lapses, so a crashed attempt
+# blocks a retry for at most RUN_LEASE_SECONDS.
+RUN_LEASE_SECONDS = 60
+RUN_LEASE_RENEW_INTERVAL_SECONDS = 15
+_MAX_DELETES_PER_BATCH = 500
+
+
+class RunLeaseHeld(Exception):
+    """Raised by `begin_run_attempt` while another attempt holds an unexpired lease on the run."""
+
+    def __init__(self, attempt_id: str, expires_in_seconds: float):
+        super().__init__(f"Attempt {attempt_id} holds the run for another {expires_in_seconds:.0f}s.")
+        self.attempt_id = attempt_id
+        self.expires_in_seconds = expires_in_seconds
+
+
+def _lease_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=RUN_LEASE_SECONDS)
+
+
+def begin_run_attempt(assistant_message_ref) -> dict | None:
+    """
+    Opens a new attempt in the assistant message's `runLedger` inside a transaction and gives it the run's lease
+    (`activeAttemptId`, `leaseExpiresAt`), so concurrent deliveries of the same Cloud Task cannot both start.
+    Returns None when the run already reached a terminal status; raises RunLeaseHeld while another attempt's
+    lease is unexpired.
+    """
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def begin(transaction):
+        snap = assistant_message_ref.get(transaction=transaction)
+        if not snap.exists:
+            raise ValueError(f"Assistant message {assistant_message_ref.id} not found.")
+        message = snap.to_dict()
+        if message.get("status") in TERMINAL_MESSAGE_STATUSES and message.get("completedTimestamp"):
+            return None
+
+        previous = message.get("runLedger") or {}
+        lease_expires_at = previous.get("leaseExpiresAt")
+        now = datetime.now(timezone.utc)
+        if previous.get("activeAttemptId") and isinstance(lease_expires_at, datetime) and lease_expires_at > now:
+            raise RunLeaseHeld(previous["activeAttemptId"], (lease_expires_at - now).total_seconds())
+
+        attempt_id = uuid.uuid4().hex
+        ledger = {
+            "attemptId": attempt_id,
+            "attemptCount": previous.get("attemptCount", 0) + 1,
+            "lastCommittedEventIndex": previous.get("lastCommittedEventIndex", -1),
+            "attemptStartedAt": firestore.SERVER_TIMESTAMP,
+            "activeAttemptId": attempt_id,
+            "leaseExpiresAt": _lease_expiry(),
+        }
+        transaction.update(assistant_message_ref, {"status": "running", "runLedger": ledger})
+        return {
+            **ledger,
+            "previousAttemptId": previous.get("attemptId"),
+            "hasRemoteA2ATask": bool((message.get("a2aTask") or {}).get("taskId")),
+        }
+
+    return begin(transaction)
+
+
+async def claim_run_attempt(assistant_message_ref) -> dict | None:
+    """
+    Begins an attempt, waiting out a held lease once: a crashed attempt's lease lapses and the run is taken over,
+    while a live attempt keeps renewing it. Returns None when the run finished or a live attempt is running it.
+    """
+    try:
+        return begin_run_attempt(assistant_message_ref)
+    except RunLeaseHeld as e:
+        logger.info(f"{assistant_message_ref.path}: {e} Waiting for the lease before retrying.")
+        await asyncio.sleep(e.expires_in_seconds + 1)
+    try:
+        return begin_run_attempt(assistant_message_ref)
+    except RunLeaseHeld as e:
+        logger.info(f"{assistant_message_ref.path}: {e} Leaving the run to that attempt.")
+        return None
+
+
+async def renew_run_lease_periodically(assistant_message_ref, attempt_id: str):
+    """Keeps the attempt's lease fresh until cancelled. Failed renewals are logged; the next one may still land."""
+    while True:
+        await asyncio.sleep(RUN_LEASE_RENEW_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(assistant_message_ref.update, {"runLedger.leaseExpiresAt": _lease_expiry()})
+        except Exception as e:
+            logger.warn(f"Failed to renew the run lease of attempt {attempt_id} on {assistant_message_ref.path}: {e}")
+
+
+def release_run_lease(assistant_message_ref, attempt_id: str):
+    """Drops the attempt's lease so a retry can start right away. Best-effort; the lease lapses on its own anyway."""
+    try:
+        assistant_message_ref.update({
+            "runLedger.activeAttemptId": firestore.DELETE_FIELD, "runLedger.leaseExpiresAt": firestore.DELETE_FIELD
+        })
+    except Exception as e:
+        logger.warn(f"Failed to release the run lease of attempt {attempt_id} on {assistant_message_ref.path}: {e}")
+
+
+def discard_attempt_events(assistant_message_ref, events_collection_ref):
+    """
+    Deletes events left by an interrupted attempt, and the payloads they offloaded to GCS, before the run starts
+    over, and resets the ledger index.
+    """
+    event_refs = list(events_collection_ref.list_documents())
+    for start in range(0, len(event_refs), _MAX_DELETES_PER_BATCH):
+        batch = db.batch()
+        for event_ref in event_refs[start:start + _MAX_DELETES_PER_BATCH]:
+            batch.delete(event_ref)
+        batch.commit()
+    # Payloads are stored under the events collection path, so this also catches uploads whose batch never committed.
+    try:
+        payload_count = delete_event_payloads(f"{assistant_message_ref.path}/{events_collection_ref.id}")
+    except Exception as e:
+        payload_count = 0
+        logger.warn(f"Failed to delete offloaded event payloads of {assistant_message_ref.path}: {e}")
+    assistant_message_ref.update({"runLedger.lastCommittedEventIndex": -1})
+    logger.info(f"Discarded {len(event_refs)} events and {payload_count} offloaded payloads of an interrupted attempt "
+                f"on {assistant_message_ref.path}.")
+
+
+__all__ = [
+    'MAX_RUN_ATTEMPTS',
+    'RunLeaseHeld',
+    'begin_run_attempt',
+    'claim_run_attempt',
+    'renew_run_lease_periodically',
+    'release_run_lease',
+    'discard_attempt_events',
+]
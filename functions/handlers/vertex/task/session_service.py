@@ -0,0 +1,224 @@
+# functions/handlers/vertex/task/session_service.py
+import asyncio
+import json
+import time
+from typing import Any, Optional
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.state import State
+
+from common.core import db, logger
+from .event_writer import MAX_INLINE_EVENT_BYTES, sanitize_for_firestore, store_event_payload, load_event_payload, event_doc_id
+
+# Runner app name for locally executed agents. Agent names carry a random suffix, so they cannot key sessions.
+ADK_SESSION_APP_NAME = "agent-lab"
+SESSION_SEGMENTS_SUBCOLLECTION = "adkSessions"
+APP_STATE_COLLECTION = "adkAppState"
+USER_STATE_COLLECTION = "adkUserState"
+
+
+class FirestoreSessionService(BaseSessionService):
+    """
+    ADK session service persisting sessions under `chats/{chatId}/adkSessions`.
+
+    A session is a chain of per-turn segments: each turn gets its own segment document (keyed by the assistant
+    message it produces) that points at the previous turn's segment via `parentSessionId`. Loading a session walks
+    the chain, so sibling branches of a chat share their common history without copying it, and each turn only
+    appends its own events. `app:` and `user:` state live in shared documents, like the in-memory service.
+    """
+
+    def __init__(self, chat_id: str):
+        self._segments_ref = db.collection("chats").document(chat_id).collection(SESSION_SEGMENTS_SUBCOLLECTION)
+        self._next_event_seq: dict[str, int] = {}
+
+    # --- Shared State ---
+    @staticmethod
+    def _app_state_ref(app_name: str):
+        return db.collection(APP_STATE_COLLECTION).document(app_name)
+
+    @staticmethod
+    def _user_state_ref(app_name: str, user_id: str):
+        return db.collection(USER_STATE_COLLECTION).document(f"{app_name}:{user_id}")
+
+    def _merged_state(self, app_name: str, user_id: str, session_state: dict) -> dict:
+        app_state = self._app_state_ref(app_name).get().to_dict() or {}
+        user_state = self._user_state_ref(app_name, user_id).get().to_dict() or {}
+        return {**session_state, **app_state, **user_state}
+
+    @staticmethod
+    def _split_state(state: dict) -> tuple[dict, dict, dict]:
+        app_state = {k: v for k, v in state.items() if k.startswith(State.APP_PREFIX)}
+        user_state = {k: v for k, v in state.items() if k.startswith(State.USER_PREFIX)}
+        session_state = {
+            k: v for k, v in state.items()
+            if not k.startswith((State.APP_PREFIX, State.USER_PREFIX, State.TEMP_PREFIX))
+        }
+        return app_state, user_state, session_state
+
+    # --- Segments ---
+    def _reset_segment(self, segment_ref):
+        """Clears events left in a segment by an interrupted attempt of the same turn."""
+        event_refs = list(segment_ref.collection("events").list_documents())
+        for start in range(0, len(event_refs), 500):
+            batch = db.batch()
+            for event_ref in event_refs[start:start + 500]:
+                batch.delete(event_ref)
+            batch.commit()
+
+    def _write_segment(self, app_name: str, user_id: str, session_id: str, parent_session_id: str | None, state: dict) -> Session:
+        segment_ref = self._segments_ref.document(session_id)
+        self._reset_segment(segment_ref)
+        app_state, user_state, session_state = self._split_state(state or {})
+        if app_state: self._app_state_ref(app_name).set(app_state, merge=True)
+        if user_state: self._user_state_ref(app_name, user_id).set(user_state, merge=True)
+        now = time.time()
+        segment_ref.set({
+            "appName": app_name, "userId": user_id, "parentSessionId": parent_session_id,
+            "state": sanitize_for_firestore(session_state)[0], "lastUpdateTime": now,
+        })
+        self._next_event_seq[session_id] = 0
+        return Session(id=session_id, app_name=app_name, user_id=user_id,
+                       state=self._merged_state(app_name, user_id, session_state), last_update_time=now)
+
+    def _load_segment_events(self, segment_id: str) -> list[Event]:
+        events = []
+        for event_snap in self._segments_ref.document(segment_id).collection("events").order_by("__name__").stream():
+            stored = event_snap.to_dict()
+            event_data = load_event_payload(stored["payloadUri"]) if stored.get("payloadUri") else stored["event"]
+            # Stored as a JSON-mode dump, so it is validated as JSON for base64 bytes (inline data, thought
+            # signatures) to decode back into bytes.
+            events.append(Event.model_validate_json(json.dumps(event_data)))
+        return events
+
+    def _load_session(self, app_name: str, user_id: str, session_id: str, config: Optional[GetSessionConfig]) -> Optional[Session]:
+        head_snap = self._segments_ref.document(session_id).get()
+        if not head_snap.exists:
+            return None
+        head = head_snap.to_dict()
+        if head.get("appName") != app_name or head.get("userId") != user_id:
+            return None
+
+        chain, parent_id = [session_id], head.get("parentSessionId")
+        while parent_id:
+            parent_snap = self._segments_ref.document(parent_id).get()
+            if not parent_snap.exists:
+                logger.warn(f"[SessionService] Segment {parent_id} of session {session_id} is missing; history is truncated there.")
+                break
+            chain.insert(0, parent_id)
+            parent_id = parent_snap.to_dict().get("parentSessionId")
+
+        segment_events = [self._load_segment_events(segment_id) for segment_id in chain]
+        # New events of this turn are numbered after the ones already stored in the head segment.
+        self._next_event_seq.setdefault(session_id, len(segment_events[-1]))
+        events = [event for events_of_segment in segment_events for event in events_of_segment]
+        if config and config.after_timestamp:
+            events = [event for event in events if event.timestamp >= config.after_timestamp]
+        if config and config.num_recent_events:
+            events = events[-config.num_recent_events:]
+        return Session(id=session_id, app_name=app_name, user_id=user_id, events=events,
+                       state=self._merged_state(app_name, user_id, head.get("state") or {}),
+                       last_update_time=head.get("lastUpdateTime") or 0.0)
+
+    # --- BaseSessionService ---
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[dict[str, Any]] = None,
+                             session_id: Optional[str] = None) -> Session:
+        session_id = session_id or self._segments_ref.document().id
+        return await asyncio.to_thread(self._write_segment, app_name, user_id, session_id, None, state or {})
+
+    async def fork_session(self, *, app_name: str, user_id: str, parent_session_id: str, session_id: str) -> Session:
+        """Starts a new turn segment on top of `parent_session_id`, inheriting its session state."""
+        parent_snap = await asyncio.to_thread(self._segments_ref.document(parent_session_id).get)
+        parent_state = (parent_snap.to_dict().get("state") or {}) if parent_snap.exists else {}
+        await asyncio.to_thread(self._write_segment, app_name, user_id, session_id, parent_session_id, parent_state)
+        return await self.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str,
+                          config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        return await asyncio.to_thread(self._load_session, app_name, user_id, session_id, config)
+
+    async def list_sessions(self, *, app_name: str, user_id: str) -> ListSessionsResponse:
+        def list_segments():
+            query = self._segments_ref.where("appName", "==", app_name).where("userId", "==", user_id)
+            return [
+                Session(id=snap.id, app_name=app_name, user_id=user_id, state={}, last_update_time=snap.to_dict().get("lastUpdateTime") or 0.0)
+                for snap in query.stream()
+            ]
+        return ListSessionsResponse(sessions=await asyncio.to_thread(list_segments))
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        def delete():
+            segment_ref = self._segments_ref.document(session_id)
+            self._reset_segment(segment_ref)
+            segment_ref.delete()
+        await asyncio.to_thread(delete)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        event = await super().append_event(session=session, event=event)
+        await asyncio.to_thread(self._persist_event, session, event)
+        return event
+
+    def _persist_event(self, session: Session, event: Event):
+        seq = self._next_event_seq.get(session.id, 0)
+        self._next_event_seq[session.id] = seq + 1
+        segment_ref = self._segments_ref.document(session.id)
+        event_ref = segment_ref.collection("events").document(event_doc_id(seq))
+
+        event_data = event.model_dump(mode="json", exclude_none=True)
+        event_data, size = sanitize_for_firestore(event_data)
+        if size > MAX_INLINE_EVENT_BYTES:
+            uri = store_event_payload(f"{event_ref.path}.json", json.dumps(event_data).encode("utf-8"))
+            stored = {"payloadUri": uri, "timestamp": event.timestamp}
+        else:
+            stored = {"event": event_data, "timestamp": event.timestamp}
+
+        batch = db.batch()
+        batch.set(event_ref, stored)
+        state_delta = (event.actions.state_delta if event.actions else None) or {}
+        app_state, user_state, session_state = self._split_state(state_delta)
+        if app_state: batch.set(self._app_state_ref(session.app_name), sanitize_for_firestore(app_state)[0], merge=True)
+        if user_state: batch.set(self._user_state_ref(session.app_name, session.user_id), sanitize_for_firestore(user_state)[0], merge=True)
+        segment_update = {"lastUpdateTime": event.timestamp}
+        if session_state:
+            _, _, full_session_state = self._split_state(session.state)
+            segment_update["state"] = sanitize_for_firestore(full_session_state)[0]
+        batch.update(segment_ref, segment_update)
+        batch.commit()
+
+
+# Messages that may sit between two turns of the same participant without breaking the session.
+_INTERLEAVED_PARTICIPANT_PREFIXES = ("user", "context_stuffed")
+
+
+def _has_indexed_context(messages: list[dict]) -> bool:
+    return any(part.get("retrieval_index") for message in messages for part in message.get("parts", []))
+
+
+def find_resumable_session(history: list[dict], participant_id: str) -> tuple[str | None, list[dict]]:
+    """
+    Looks for the previous turn of the same participant on this branch. Returns its session ID and the messages
+    added since (the new user turn and any context), or (None, full history) when the turn cannot be continued,
+    e.g. because another participant spoke in between or the previous run did not complete. Sessions that already
+    hold indexed context are not continued either: their retrieved excerpts were chosen for an earlier question,
+    and a fresh session re-runs retrieval for the new one.
+    """
+    for index in range(len(history) - 1, -1, -1):
+        message = history[index]
+        if message.get("participant", "").startswith(_INTERLEAVED_PARTICIPANT_PREFIXES):
+            continue
+        if message.get("participant") == participant_id and message.get("adkSessionId"):
+            if _has_indexed_context(history[:index]):
+                return None, history
+            return message["adkSessionId"], history[index + 1:]
+        break
+    return None, history
+
+
+__all__ = [
+    'ADK_SESSION_APP_NAME',
+    'SESSION_SEGMENTS_SUBCOLLECTION',
+    'FirestoreSessionService',
+    'find_resumable_session',
+]
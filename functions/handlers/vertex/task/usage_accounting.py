@@ -0,0 +1,80 @@
+# functions/handlers/vertex/task/usage_accounting.py
+import random
+from datetime import datetime, timezone
+from firebase_admin import firestore
+
+from common.core import db
+
+# Daily aggregates live in `usageDaily/{scope}:{subjectId}:{YYYY-MM-DD}/shards/{n}`. Each run increments one random
+# shard, so concurrent runs of a busy agent or user don't contend on one document (~1 write/s limit).
+USAGE_DAILY_COLLECTION = "usageDaily"
+USAGE_COUNTER_SHARDS = 10
+USAGE_SCOPE_USER = "user"
+USAGE_SCOPE_AGENT = "agent"
+USAGE_COUNTER_FIELDS = ("runs", "erroredRuns", "llmResponses", "promptTokens", "outputTokens", "totalTokens",
+                        "cachedPromptTokens", "costUsd", "durationMs")
+
+
+def summarize_event_usage(all_events: list) -> dict:
+    """
+    Rolls up the token counts ADK reports in each event's `usage_metadata`, plus the latencies recorded by
+    `_run_agent_and_collect_events`. Partial (streamed) events are skipped, since the final event repeats them.
+    """
+    usage = {"llmResponses": 0, "promptTokens": 0, "outputTokens": 0, "totalTokens": 0, "cachedPromptTokens": 0,
+             "firstEventLatencyMs": None, "durationMs": 0}
+    for event in all_events:
+        latency_ms = event.get("latencyMs") or 0
+        usage["durationMs"] += latency_ms
+        if usage["firstEventLatencyMs"] is None:
+            usage["firstEventLatencyMs"] = latency_ms
+        metadata = event.get("usage_metadata")
+        if not metadata or event.get("partial"):
+            continue
+        usage["llmResponses"] += 1
+        usage["promptTokens"] += metadata.get("prompt_token_count") or 0
+        usage["outputTokens"] += metadata.get("candidates_token_count") or 0
+        usage["totalTokens"] += metadata.get("total_token_count") or 0
+        usage["cachedPromptTokens"] += metadata.get("cached_content_token_count") or 0
+    return usage
+
+
+def _daily_doc_ref(scope: str, subject_id: str, day: str):
+    return db.collection(USAGE_DAILY_COLLECTION).document(f"{scope}:{subject_id}:{day}")
+
+
+def record_run_usage(user_id: str | None, participant_id: str, usage: dict, errored: bool = False):
+    """Adds one finished run to the user's and the agent's (or model's) daily aggregates."""
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    increments = {
+        "runs": 1,
+        "erroredRuns": 1 if errored else 0,
+        **{field: usage.get(field) or 0 for field in USAGE_COUNTER_FIELDS if field not in ("runs", "erroredRuns")},
+    }
+    counter_update = {field: firestore.Increment(value) for field, value in increments.items() if value}
+    batch = db.batch()
+    for scope, subject_id in ((USAGE_SCOPE_USER, user_id), (USAGE_SCOPE_AGENT, participant_id)):
+        if not subject_id:
+            continue
+        shard_ref = _daily_doc_ref(scope, subject_id, day).collection("shards").document(str(random.randrange(USAGE_COUNTER_SHARDS)))
+        # The identifying fields are repeated on every shard so shards can be queried as a collection group.
+        batch.set(shard_ref, {"scope": scope, "subjectId": subject_id, "day": day, **counter_update}, merge=True)
+    batch.commit()
+
+
+def get_daily_usage(scope: str, subject_id: str, day: str) -> dict:
+    """Sums the shards of one daily aggregate."""
+    totals = {field: 0 for field in USAGE_COUNTER_FIELDS}
+    for shard_snap in _daily_doc_ref(scope, subject_id, day).collection("shards").stream():
+        shard = shard_snap.to_dict() or {}
+        for field in USAGE_COUNTER_FIELDS:
+            totals[field] += shard.get(field) or 0
+    return totals
+
+
+__all__ = [
+    'USAGE_SCOPE_USER',
+    'USAGE_SCOPE_AGENT',
+    'summarize_event_usage',
+    'record_run_usage',
+    'get_daily_usage',
+]
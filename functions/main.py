@@ -5,7 +5,9 @@ from firebase_functions import https_fn, options, tasks_fn
 from firebase_functions.options import RateLimits, RetryConfig
 
 from common.utils import handle_exceptions_and_log
+from common.http_client import run_and_close_async_http_client
 import asyncio
+import os
 
 from handlers.vertex_agent_handler import (
     _deploy_agent_to_vertex_logic,
@@ -15,15 +17,27 @@ from handlers.vertex_agent_handler import (
 )
 
 from handlers.vertex.task import run_agent_task_wrapper
+from handlers.vertex.task.run_ledger import MAX_RUN_ATTEMPTS
+from handlers.vertex.orchestrator.scheduling import INTERACTIVE_MAX_CONCURRENT_DISPATCHES, BATCH_MAX_CONCURRENT_DISPATCHES
+from common.agents.tool_factory import start_tool_warm_up_in_background
 from handlers.context_handler import (
     _fetch_web_page_content_logic,
     _fetch_git_repo_contents_logic,
     _process_pdf_content_logic,
-    _upload_image_and_get_uri_logic
+    _upload_image_and_get_uri_logic,
+    _create_context_upload_session_logic,
+    _finalize_context_upload_logic,
+    _ingest_context_batch_logic
 )
+from handlers.event_handler import _get_event_payload_logic, _get_event_artifact_logic
 from handlers.mcp_handler import _list_mcp_server_tools_logic_async
 from handlers.a2a_handler import _fetch_a2a_agent_card_logic_async
 
+# Deploy instances, the only ones that build tools, pre-import the custom tool modules of recently updated agents
+# (see TOOL_WARMUP_AGENT_LIMIT).
+if os.environ.get("FUNCTION_TARGET") == "deploy_agent_to_vertex":
+    start_tool_warm_up_in_background()
+
 # --- Cloud Function Definitions ---
 
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=540)
@@ -78,6 +92,35 @@ def uploadImageForContext(req: https_fn.CallableRequest):
     # This now returns an object with a 'type' key to be consistent
     return _upload_image_and_get_uri_logic(req)
 
+@https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=60)
+@handle_exceptions_and_log
+def createContextUploadSession(req: https_fn.CallableRequest):
+    # Step 1 of the direct upload flow: returns a resumable GCS upload URL for the browser.
+    return _create_context_upload_session_logic(req)
+
+@https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=300)
+@handle_exceptions_and_log
+def finalizeContextUpload(req: https_fn.CallableRequest):
+    # Step 2 of the direct upload flow: processes the object already in GCS.
+    return _finalize_context_upload_logic(req)
+
+@https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=300)
+@handle_exceptions_and_log
+def ingestContextBatch(req: https_fn.CallableRequest):
+    return _ingest_context_batch_logic(req)
+
+@https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=60)
+@handle_exceptions_and_log
+def getEventPayload(req: https_fn.CallableRequest):
+    # Lazily loads event content/actions that were offloaded to GCS for the reasoning log.
+    return _get_event_payload_logic(req)
+
+@https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=60)
+@handle_exceptions_and_log
+def getEventArtifact(req: https_fn.CallableRequest):
+    # Lazily loads an artifact saved by a local run; events only reference it through actions.artifact_delta.
+    return _get_event_artifact_logic(req)
+
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=120)
 @handle_exceptions_and_log
 def list_mcp_server_tools(req: https_fn.CallableRequest):
@@ -86,16 +129,28 @@ def list_mcp_server_tools(req: https_fn.CallableRequest):
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=60)
 @handle_exceptions_and_log
 def fetchA2AAgentCard(req: https_fn.CallableRequest):
-    return asyncio.run(_fetch_a2a_agent_card_logic_async(req))
+    return run_and_close_async_http_client(_fetch_a2a_agent_card_logic_async(req))
 
-# Task handler for executing queries in the background
+# Task handlers for executing queries in the background. Interactive chat turns and batch (multi-agent)
+# runs use separate queues, so batch load cannot take the interactive queue's dispatch slots.
 @tasks_fn.on_task_dispatched(
-    rate_limits=RateLimits(max_concurrent_dispatches=10),
-    retry_config=RetryConfig(max_attempts=3, min_backoff_seconds=10),
+    rate_limits=RateLimits(max_concurrent_dispatches=INTERACTIVE_MAX_CONCURRENT_DISPATCHES),
+    retry_config=RetryConfig(max_attempts=MAX_RUN_ATTEMPTS, min_backoff_seconds=10),
     timeout_sec=540,
     memory=options.MemoryOption.GB_2,
     cpu=1
 )
 def executeAgentRunTask(req: tasks_fn.CallableRequest):
     """Background worker function triggered by Cloud Tasks."""
-    run_agent_task_wrapper(req.data)
\ No newline at end of file
+    run_agent_task_wrapper(req.data)
+
+@tasks_fn.on_task_dispatched(
+    rate_limits=RateLimits(max_concurrent_dispatches=BATCH_MAX_CONCURRENT_DISPATCHES),
+    retry_config=RetryConfig(max_attempts=MAX_RUN_ATTEMPTS, min_backoff_seconds=10),
+    timeout_sec=540,
+    memory=options.MemoryOption.GB_2,
+    cpu=1
+)
+def executeBatchAgentRunTask(req: tasks_fn.CallableRequest):
+    """Background worker for batch-class runs (e.g. Parallel and Loop agents)."""
+    run_agent_task_wrapper(req.data)
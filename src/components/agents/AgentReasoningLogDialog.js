@@ -1,13 +1,14 @@
 // src/components/agents/AgentReasoningLogDialog.js
-import React from 'react';
+import React, { useState } from 'react';
 import {
     Dialog, DialogTitle, DialogContent, DialogActions, Button,
-    Typography, Accordion, AccordionSummary, AccordionDetails, Box, Chip, Paper
+    Typography, Accordion, AccordionSummary, AccordionDetails, Box, Chip, Paper, Alert, CircularProgress
 } from '@mui/material';
 import ExpandMoreIcon from '@mui/icons-material/ExpandMore';
 import ReactMarkdown from 'react-markdown';
 import remarkGfm from 'remark-gfm';
 import { muiMarkdownComponentsConfig } from '../common/MuiMarkdownComponents';
+import { getEventPayload, getEventArtifact } from '../../services/chatService';
 
 const EventContentDisplay = ({ content }) => {
     if (content === null || content === undefined) return <Typography variant="caption" color="text.secondary">No content</Typography>;
@@ -102,7 +103,87 @@ const EventActionsDisplay = ({ actions }) => {
 };
 
 
-const AgentReasoningLogDialog = ({ open, onClose, events }) => {
+// Artifacts saved during the run live in GCS; events only reference them by filename and version.
+const EventArtifacts = ({ artifactDelta, eventId, chatId, messageId }) => {
+    const [loadingFile, setLoadingFile] = useState(null);
+    const [error, setError] = useState(null);
+    const filenames = Object.keys(artifactDelta || {});
+    if (filenames.length === 0 || !chatId || !messageId || !eventId) return null;
+
+    const handleOpen = async (filename) => {
+        setLoadingFile(filename);
+        setError(null);
+        try {
+            const artifact = await getEventArtifact(chatId, messageId, eventId, filename);
+            const blob = artifact.data !== undefined
+                ? new Blob([Uint8Array.from(atob(artifact.data), c => c.charCodeAt(0))], { type: artifact.mimeType })
+                : new Blob([artifact.text], { type: artifact.mimeType });
+            window.open(URL.createObjectURL(blob), '_blank', 'noopener');
+        } catch (err) {
+            setError(`Failed to load artifact: ${err.message}`);
+        } finally {
+            setLoadingFile(null);
+        }
+    };
+
+    return (
+        <Box sx={{ mt: 1 }}>
+            <Typography variant="caption" display="block" gutterBottom>Artifacts:</Typography>
+            {filenames.map(filename => (
+                <Chip key={filename} size="small" sx={{ mr: 0.5, mb: 0.5 }}
+                      label={loadingFile === filename ? <CircularProgress size={12} /> : `${filename} (v${artifactDelta[filename]})`}
+                      onClick={() => handleOpen(filename)} disabled={loadingFile !== null} />
+            ))}
+            {error && <Alert severity="error" sx={{ mt: 1 }}>{error}</Alert>}
+        </Box>
+    );
+};
+
+// Oversized content/actions are stored outside Firestore; the event only carries a truncated preview.
+const EventDetails = ({ event, chatId, messageId }) => {
+    const [fullPayloads, setFullPayloads] = useState({});
+    const [loading, setLoading] = useState(false);
+    const [error, setError] = useState(null);
+    const offloadedFields = Object.keys(event.offloadedPayloads || {}).filter(field => !(field in fullPayloads));
+    const canLoad = offloadedFields.length > 0 && chatId && messageId && event.id;
+
+    const handleLoadFull = async () => {
+        setLoading(true);
+        setError(null);
+        try {
+            const loaded = {};
+            for (const field of offloadedFields) {
+                loaded[field] = await getEventPayload(chatId, messageId, event.id, field);
+            }
+            setFullPayloads(prev => ({ ...prev, ...loaded }));
+        } catch (err) {
+            setError(`Failed to load full payload: ${err.message}`);
+        } finally {
+            setLoading(false);
+        }
+    };
+
+    return (
+        <>
+            {canLoad && (
+                <Alert severity="info" sx={{ mb: 1 }} action={
+                    <Button size="small" onClick={handleLoadFull} disabled={loading}>
+                        {loading ? <CircularProgress size={16} /> : 'Load full'}
+                    </Button>
+                }>
+                    This event was too large to store inline; showing a truncated preview.
+                </Alert>
+            )}
+            {error && <Alert severity="error" sx={{ mb: 1 }}>{error}</Alert>}
+            <EventContentDisplay content={'content' in fullPayloads ? fullPayloads.content : event.content} />
+            <EventActionsDisplay actions={'actions' in fullPayloads ? fullPayloads.actions : event.actions} /> {/* Display actions here */}
+            <EventArtifacts artifactDelta={('actions' in fullPayloads ? fullPayloads.actions : event.actions)?.artifact_delta}
+                            eventId={event.id} chatId={chatId} messageId={messageId} />
+        </>
+    );
+};
+
+const AgentReasoningLogDialog = ({ open, onClose, events, chatId, messageId }) => {
     if (!events || events.length === 0) {
         return (
             <Dialog open={open} onClose={onClose} maxWidth="sm">
@@ -135,8 +216,7 @@ const AgentReasoningLogDialog = ({ open, onClose, events }) => {
                             </Typography>
                         </AccordionSummary>
                         <AccordionDetails sx={{ bgcolor: 'background.default', borderTop: '1px solid', borderColor: 'divider' }}>
-                            <EventContentDisplay content={event.content} />
-                            <EventActionsDisplay actions={event.actions} /> {/* Display actions here */}
+                            <EventDetails event={event} chatId={chatId} messageId={messageId} />
                         </AccordionDetails>
                     </Accordion>
                 ))}
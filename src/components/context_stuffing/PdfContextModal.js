@@ -49,22 +49,13 @@ const PdfContextModal = ({ open, onClose, onSubmit }) => {
 
         let submissionData = { type: 'pdf' };
         if (uploadedFile) {
-            const reader = new FileReader();
-            reader.readAsDataURL(uploadedFile);
-            reader.onload = () => {
-                submissionData.fileData = reader.result.split(',')[1]; // Base64 data
-                submissionData.fileName = uploadedFile.name;
-                onSubmit(submissionData);
-                handleClose();
-            };
-            reader.onerror = () => {
-                setError('Error reading file.');
-            };
+            submissionData.file = uploadedFile;
+            submissionData.fileName = uploadedFile.name;
         } else {
             submissionData.url = pdfUrl;
-            onSubmit(submissionData);
-            handleClose();
         }
+        onSubmit(submissionData);
+        handleClose();
     };
 
     const handleClose = () => {
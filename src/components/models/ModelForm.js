@@ -6,6 +6,7 @@ import {
     FormControlLabel, Checkbox
 } from '@mui/material';
 import ProjectSelector from '../projects/ProjectSelector';
+import ModelSelector from './ModelSelector';
 import {
     MODEL_PROVIDERS_LITELLM,
     DEFAULT_LITELLM_PROVIDER_ID,
@@ -22,6 +23,11 @@ const ModelForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
     const [provider, setProvider] = useState(initialData.provider || DEFAULT_LITELLM_PROVIDER_ID);
     const [modelString, setModelString] = useState(initialData.modelString || DEFAULT_LITELLM_BASE_MODEL_ID);
     const [systemInstruction, setSystemInstruction] = useState(initialData.systemInstruction || '');
+    const [fallbackModelIds, setFallbackModelIds] = useState(initialData.fallbackModelIds || []);
+    const [hedgeDelayMs, setHedgeDelayMs] = useState(initialData.hedgeDelayMs ?? '');
+    const [responseCache, setResponseCache] = useState({
+        enabled: false, store: 'memory', ttlSeconds: 86400, ...(initialData.responseCache || {})
+    });
 
     // New state for parameters and enabled flags
     const [parameters, setParameters] = useState({});
@@ -325,6 +331,9 @@ const ModelForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
             modelString,
             systemInstruction,
             parameters: parametersToSave,
+            responseCache,
+            fallbackModelIds: fallbackModelIds.filter(id => id && id !== initialData.id),
+            hedgeDelayMs: hedgeDelayMs === '' ? null : Number(hedgeDelayMs),
         };
 
         onSubmit(modelData);
@@ -414,6 +423,83 @@ const ModelForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
                     {/* Dynamic Parameters Section */}
                     {renderParametersRecursively(parameterDefs, parameters, enabledParams)}
 
+                    <Grid item xs={12}>
+                        <Typography variant="subtitle1">Fallback Models</Typography>
+                        <Typography variant="caption" color="text.secondary" display="block" sx={{ mb: 1 }}>
+                            Tried in order when this model's provider fails. With a hedging delay, a slow request is also raced against the next model.
+                        </Typography>
+                        {fallbackModelIds.map((fallbackId, index) => (
+                            <Box key={index} sx={{ display: 'flex', gap: 1, alignItems: 'center', mb: 1 }}>
+                                <ModelSelector
+                                    selectedModelId={fallbackId}
+                                    onSelectionChange={(id) => setFallbackModelIds(prev => prev.map((v, i) => (i === index ? id : v)))}
+                                    projectIds={projectIds}
+                                />
+                                <Button onClick={() => setFallbackModelIds(prev => prev.filter((_, i) => i !== index))}>Remove</Button>
+                            </Box>
+                        ))}
+                        <Box sx={{ display: 'flex', gap: 2, alignItems: 'center' }}>
+                            <Button onClick={() => setFallbackModelIds(prev => [...prev, ''])} disabled={fallbackModelIds.length >= 3}>
+                                Add Fallback Model
+                            </Button>
+                            {fallbackModelIds.length > 0 && (
+                                <TextField
+                                    label="Hedging Delay (ms)"
+                                    type="number"
+                                    value={hedgeDelayMs}
+                                    onChange={(e) => setHedgeDelayMs(e.target.value)}
+                                    size="small"
+                                    helperText="Leave empty to fall back on errors only."
+                                    inputProps={{ min: 100 }}
+                                />
+                            )}
+                        </Box>
+                    </Grid>
+
+                    <Grid item xs={12} sm={responseCache.enabled ? 4 : 12}>
+                        <FormControlLabel
+                            control={<Checkbox checked={responseCache.enabled} onChange={(e) => setResponseCache(prev => ({ ...prev, enabled: e.target.checked }))} />}
+                            label="Cache identical requests"
+                        />
+                        <FormHelperText>Replays stored responses for repeated prompts. Intended for evals at temperature 0.</FormHelperText>
+                    </Grid>
+                    {responseCache.enabled && (
+                        <>
+                            <Grid item xs={12} sm={4}>
+                                <FormControl fullWidth variant="outlined">
+                                    <InputLabel id="response-cache-store-label">Cache Store</InputLabel>
+                                    <Select
+                                        labelId="response-cache-store-label"
+                                        value={responseCache.store}
+                                        onChange={(e) => setResponseCache(prev => ({ ...prev, store: e.target.value }))}
+                                        label="Cache Store"
+                                    >
+                                        <MenuItem value="memory">Instance memory</MenuItem>
+                                        <MenuItem value="firestore">Firestore (shared)</MenuItem>
+                                    </Select>
+                                </FormControl>
+                            </Grid>
+                            <Grid item xs={12} sm={4}>
+                                <TextField
+                                    label="Cache TTL (seconds)"
+                                    type="number"
+                                    value={responseCache.ttlSeconds}
+                                    onChange={(e) => setResponseCache(prev => ({ ...prev, ttlSeconds: Number(e.target.value) }))}
+                                    fullWidth
+                                    variant="outlined"
+                                    inputProps={{ min: 60 }}
+                                />
+                            </Grid>
+                            <Grid item xs={12}>
+                                <FormControlLabel
+                                    control={<Checkbox checked={!!responseCache.allowNonZeroTemperature} onChange={(e) => setResponseCache(prev => ({ ...prev, allowNonZeroTemperature: e.target.checked }))} />}
+                                    label="Also cache when temperature is not 0"
+                                />
+                                <FormHelperText>Without this, caching only applies when the temperature parameter is set to 0; otherwise every repeat would get the same sampled reply.</FormHelperText>
+                            </Grid>
+                        </>
+                    )}
+
                     <Grid item xs={12}>
                         <TextField
                             label="System Instruction (System Prompt)"
@@ -259,7 +259,9 @@ const ToolSelector = ({
                     module_path: toolManifestEntry.module_path,
                     class_name: toolManifestEntry.class_name,
                     type: toolTypeFromManifest,
-                    sourceRepoUrl: sourceRepoUrlForBackend
+                    sourceRepoUrl: sourceRepoUrlForBackend,
+                    ...(toolManifestEntry.stateless && { stateless: true }),
+                    ...(toolManifestEntry.idempotent && { idempotent: true })
                 };
             } else if (toolTypeFromManifest === 'mcp') { // Handle MCP tools
                 toolBaseData = {
@@ -269,7 +271,8 @@ const ToolSelector = ({
                     type: 'mcp',
                     mcpServerUrl: toolManifestEntry.mcpServerUrl,
                     mcpToolName: toolManifestEntry.mcpToolName,
-                    auth: toolManifestEntry.auth // *** IMPORTANT: Persist auth config ***
+                    auth: toolManifestEntry.auth, // *** IMPORTANT: Persist auth config ***
+                    ...(toolManifestEntry.readOnly && { idempotent: true })
                 };
             }
             else {
@@ -305,6 +308,8 @@ const ToolSelector = ({
             class_name: toolForSetup.class_name,
             type: toolForSetup.type,
             configuration: toolConfiguration,
+            ...(toolForSetup.stateless && { stateless: true }),
+            ...(toolForSetup.idempotent && { idempotent: true }),
             ...(toolForSetup.type === 'custom_repo' && { sourceRepoUrl: sourceRepoUrlForBackend })
         };
         let finalSelectedTools;
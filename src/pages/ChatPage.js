@@ -31,6 +31,7 @@ const ChatPage = ({ isReadOnly = false }) => {
     const [pageError, setPageError] = useState(null);
     const [isReasoningLogOpen, setIsReasoningLogOpen] = useState(false);
     const [selectedEventsForLog, setSelectedEventsForLog] = useState([]);
+    const [selectedLogMessageId, setSelectedLogMessageId] = useState(null);
     const [loadingEvents, setLoadingEvents] = useState(false);
     const [isContextLoading, setIsContextLoading] = useState(false);
     const [contextDetailsOpen, setContextDetailsOpen] = useState(false);
@@ -53,6 +54,7 @@ const ChatPage = ({ isReadOnly = false }) => {
 
     const handleOpenReasoningLog = async (messageId) => {
         setLoadingEvents(true);
+        setSelectedLogMessageId(messageId);
         setIsReasoningLogOpen(true);
         try {
             const events = await chatService.getEventsForMessage(effectiveChatId, messageId);
@@ -192,7 +194,7 @@ const ChatPage = ({ isReadOnly = false }) => {
                 )}
             </Paper>
 
-            <AgentReasoningLogDialog open={isReasoningLogOpen} onClose={() => setIsReasoningLogOpen(false)} events={loadingEvents ? [] : selectedEventsForLog} />
+            <AgentReasoningLogDialog open={isReasoningLogOpen} onClose={() => setIsReasoningLogOpen(false)} events={loadingEvents ? [] : selectedEventsForLog} chatId={effectiveChatId} messageId={selectedLogMessageId} />
             <ContextDetailsDialog open={contextDetailsOpen} onClose={() => setContextDetailsOpen(false)} contextItems={contextDetailsItems} />
             <Snackbar open={snackbar.open} autoHideDuration={3000} onClose={() => setSnackbar(s => ({ ...s, open: false }))} message={snackbar.message} />
         </Container>
@@ -62,7 +62,7 @@ export const deployAgent = async (agentConfig, agentDocId) => {
 };
 
 // This function now handles querying agents OR models
-export const executeQuery = async ({ agentId, modelId, message, adkUserId, chatId, parentMessageId, stuffedContextItems }) => {
+export const executeQuery = async ({ agentId, modelId, message, adkUserId, chatId, parentMessageId, stuffedContextItems, runClass }) => {
     try {
         const payload = {
             agentId, // Can be null
@@ -71,7 +71,8 @@ export const executeQuery = async ({ agentId, modelId, message, adkUserId, chatI
             adkUserId,
             chatId,
             parentMessageId,
-            stuffedContextItems
+            stuffedContextItems,
+            runClass // Optional: 'batch' schedules the run on the batch queue
         };
         // This cloud function now returns the new messageId immediately
         const result = await executeQueryCallable(payload);
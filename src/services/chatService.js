@@ -1,5 +1,5 @@
 // src/services/chatService.js
-import { db } from '../firebaseConfig';
+import { db, createCallable } from '../firebaseConfig';
 import {
     collection,
     addDoc,
@@ -158,6 +158,21 @@ export const getEventsForMessage = async (chatId, messageId) => {
     return querySnapshot.docs.map(doc => ({ id: doc.id, ...doc.data() }));
 }
 
+// Large event content/actions are stored in Cloud Storage; the event doc only keeps a preview.
+const getEventPayloadCallable = createCallable('getEventPayload');
+
+export const getEventPayload = async (chatId, messageId, eventId, field) => {
+    const result = await getEventPayloadCallable({ chatId, messageId, eventId, field });
+    return result.data.payload;
+};
+
+const getEventArtifactCallable = createCallable('getEventArtifact');
+
+export const getEventArtifact = async (chatId, messageId, eventId, filename) => {
+    const result = await getEventArtifactCallable({ chatId, messageId, eventId, filename });
+    return result.data;
+};
+
 // NEW FUNCTION to listen to events in real-time
 export const listenToMessageEvents = (chatId, messageId, onUpdate) => {
     const q = query(collection(db, "chats", chatId, "messages", messageId, "events"), orderBy("eventIndex", "asc"));
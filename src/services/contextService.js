@@ -2,16 +2,19 @@
 import { createCallable } from '../firebaseConfig';
 
 const fetchWebPageContentCallable = createCallable('fetch_web_page_content');
-const uploadImageForContextCallable = createCallable('uploadImageForContext');
 const fetchGitRepoContentsCallable = createCallable('fetch_git_repo_contents');
 const processPdfContentCallable = createCallable('process_pdf_content');
+const createContextUploadSessionCallable = createCallable('createContextUploadSession');
+const finalizeContextUploadCallable = createCallable('finalizeContextUpload');
+const ingestContextBatchCallable = createCallable('ingestContextBatch');
 
 // Each callable now creates the context message in Firestore directly.
 // Therefore, chatId and parentMessageId must be provided.
 
-export const fetchWebPageContent = async ({ url, chatId, parentMessageId }) => {
+export const fetchWebPageContent = async ({ url, chatId, parentMessageId, keepRaw = false }) => {
     try {
-        const result = await fetchWebPageContentCallable({ url, chatId, parentMessageId });
+        // The backend stores extracted readable text; keepRaw additionally stores the original HTML.
+        const result = await fetchWebPageContentCallable({ url, chatId, parentMessageId, keepRaw });
         return result.data; // { success, name, storageUrl, type, mimeType, messageId, preview }
     } catch (error) {
         console.error("Error calling fetchWebPageContent callable:", error);
@@ -29,9 +32,41 @@ export const fetchGitRepoContents = async ({ orgUser, repoName, gitToken, includ
     }
 };
 
-export const processPdfContent = async ({ url, fileData, fileName, chatId, parentMessageId }) => { // fileData is base64 string
+// Files are uploaded straight to Cloud Storage through a resumable upload session and then
+// processed in place, so file bytes never travel through the callable request body.
+const uploadFileToStorage = async ({ file, contextType }) => {
+    const session = await createContextUploadSessionCallable({
+        fileName: file.name,
+        mimeType: file.type,
+        contextType,
+        size: file.size
+    });
+    const { uploadUrl, objectPath } = session.data;
+    const uploadResponse = await fetch(uploadUrl, { method: 'PUT', body: file });
+    if (!uploadResponse.ok) {
+        throw new Error(`Upload to storage failed with status ${uploadResponse.status}.`);
+    }
+    return objectPath;
+};
+
+const uploadFileAndFinalize = async ({ file, contextType, chatId, parentMessageId }) => {
+    const objectPath = await uploadFileToStorage({ file, contextType });
+    const result = await finalizeContextUploadCallable({
+        objectPath,
+        contextType,
+        fileName: file.name,
+        chatId,
+        parentMessageId
+    });
+    return result.data; // { success, name, storageUrl, type, mimeType, messageId, preview }
+};
+
+export const processPdfContent = async ({ url, file, fileName, chatId, parentMessageId }) => {
     try {
-        const result = await processPdfContentCallable({ url, fileData, fileName, chatId, parentMessageId });
+        if (file) {
+            return await uploadFileAndFinalize({ file, contextType: 'pdf', chatId, parentMessageId });
+        }
+        const result = await processPdfContentCallable({ url, fileName, chatId, parentMessageId });
         return result.data; // { success, name, storageUrl, type, mimeType, messageId, preview }
     } catch (error) {
         console.error("Error calling processPdfContent callable:", error);
@@ -39,30 +74,35 @@ export const processPdfContent = async ({ url, fileData, fileName, chatId, paren
     }
 };
 
-export const uploadImageForContext = (params) => {
+export const uploadImageForContext = async (params) => {
     // params: { file: File, chatId, parentMessageId }
     const { file, chatId, parentMessageId } = params || {};
-    return new Promise((resolve, reject) => {
-        if (!file) {
-            return reject(new Error("File is required."));
-        }
-        const reader = new FileReader();
-        reader.readAsDataURL(file);
-        reader.onload = async () => {
-            try {
-                const base64Data = reader.result.split(',')[1];
-                const result = await uploadImageForContextCallable({
-                    fileData: base64Data,
-                    fileName: file.name,
-                    mimeType: file.type,
-                    chatId,
-                    parentMessageId
-                });
-                resolve(result.data); // { success, name, storageUrl, signedUrl?, type, mimeType, messageId, preview }
-            } catch (error) {
-                reject(error);
-            }
-        };
-        reader.onerror = error => reject(error);
-    });
-};
\ No newline at end of file
+    if (!file) {
+        throw new Error("File is required.");
+    }
+    try {
+        return await uploadFileAndFinalize({ file, contextType: 'image', chatId, parentMessageId });
+    } catch (error) {
+        console.error("Error uploading image for context:", error);
+        throw error;
+    }
+};
+
+// Ingests several context items in one call. Items are processed concurrently on the backend and
+// their context messages are chained in the given order.
+// items: [{ type: 'webpage', url, keepRaw }, { type: 'gitrepo', orgUser, repoName, ... }, { type: 'pdf', url }, { type: 'pdf' | 'image', file }]
+export const ingestContextBatch = async ({ items, chatId, parentMessageId }) => {
+    try {
+        const preparedItems = await Promise.all((items || []).map(async (item) => {
+            if (!item.file) return item;
+            const { file, ...rest } = item;
+            const objectPath = await uploadFileToStorage({ file, contextType: item.type });
+            return { ...rest, objectPath, fileName: file.name };
+        }));
+        const result = await ingestContextBatchCallable({ items: preparedItems, chatId, parentMessageId });
+        return result.data; // { success, results: [{ index, success, messageId?, error? }], lastMessageId, bytesProcessed }
+    } catch (error) {
+        console.error("Error calling ingestContextBatch callable:", error);
+        throw error;
+    }
+};